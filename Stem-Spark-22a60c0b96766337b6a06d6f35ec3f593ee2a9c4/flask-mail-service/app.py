@@ -3,17 +3,29 @@ from flask_mail import Mail, Message
 from flask_cors import CORS
 import os
 import logging
+import time
 from datetime import datetime
 import json
 from typing import Dict, Any, Optional
+from metrics import metrics
+from smtp_probe import SmtpProbe
+from lanes import LaneScheduler, LANE_CRITICAL, LANE_TRANSACTIONAL, LANE_BULK, resolve_lane
+from logging_setup import configure_logging, add_log_filter
+import request_timing
+from request_timing import stage, RequestIdFilter
+from template_sandbox import TemplateSandbox, TemplateLimitError
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging (queued, JSON lines, sampled success messages)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
 
+# Server-Timing stage timers and X-Request-ID correlation on the send routes
+request_timing.init_app(app, timed_prefixes=('/send-',))
+add_log_filter(RequestIdFilter())
+
 # Flask Mail Configuration
 app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
 app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
@@ -24,6 +36,15 @@ app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', 'norep
 
 mail = Mail(app)
 
+# Priority lanes for SMTP delivery (critical / transactional / bulk)
+lane_scheduler = LaneScheduler.from_env(metrics=metrics)
+
+# Cached SMTP connectivity probe for /ready (started on first use)
+smtp_probe = SmtpProbe.from_config(app.config, metrics=metrics)
+
+# Caller-supplied templates render sandboxed, within time, loop and output limits
+template_sandbox = TemplateSandbox.from_env(metrics=metrics)
+
 # Email Templates
 WELCOME_EMAIL_TEMPLATE = """
 <!DOCTYPE html>
@@ -302,8 +323,20 @@ ADMIN_NOTIFICATION_TEMPLATE = """
 </html>
 """
 
-def send_email(to_email: str, subject: str, html_content: str, plain_text: str = None) -> Dict[str, Any]:
-    """Send an email using Flask Mail"""
+def _send_in_app_context(msg: Message) -> None:
+    """Lane workers run outside the request, so push an app context for Flask-Mail"""
+    started = time.perf_counter()
+    try:
+        with app.app_context():
+            mail.send(msg)
+    except Exception:
+        lane_scheduler.record_delivery(time.perf_counter() - started, errors=1)
+        raise
+    lane_scheduler.record_delivery(time.perf_counter() - started)
+
+def send_email(to_email: str, subject: str, html_content: str, plain_text: str = None,
+               lane: str = LANE_TRANSACTIONAL) -> Dict[str, Any]:
+    """Send an email using Flask Mail through the given priority lane"""
     try:
         msg = Message(
             subject=subject,
@@ -311,11 +344,17 @@ def send_email(to_email: str, subject: str, html_content: str, plain_text: str =
             html=html_content,
             body=plain_text
         )
-        mail.send(msg)
-        logger.info(f"Email sent successfully to {to_email}")
+        send_started = time.perf_counter()
+        with stage('smtp'):
+            lane_scheduler.run(lane, _send_in_app_context, msg)
+        logger.info("Email sent successfully to %s", to_email, extra={
+            'sampled': True,
+            'lane': lane,
+            'send_ms': round((time.perf_counter() - send_started) * 1000, 2)
+        })
         return {"success": True, "message": "Email sent successfully"}
     except Exception as e:
-        logger.error(f"Failed to send email to {to_email}: {str(e)}")
+        logger.error("Failed to send email to %s: %s", to_email, e)
         return {"success": False, "error": str(e)}
 
 @app.route('/health', methods=['GET'])
@@ -327,6 +366,25 @@ def health_check():
         "timestamp": datetime.now().isoformat()
     })
 
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness endpoint backed by the cached SMTP connectivity probe"""
+    smtp = smtp_probe.status()
+    return jsonify({
+        "status": "ready" if smtp["ok"] else "not_ready",
+        "smtp": smtp,
+        "timestamp": datetime.now().isoformat()
+    }), 200 if smtp["ok"] else 503
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Service metrics, including per-lane queue depth and latency"""
+    snapshot = metrics.snapshot()
+    snapshot['lanes'] = lane_scheduler.stats()
+    if lane_scheduler.limiter is not None:
+        snapshot['concurrency'] = lane_scheduler.limiter.stats()
+    return jsonify(snapshot)
+
 @app.route('/send-welcome-email', methods=['POST'])
 def send_welcome_email():
     """Send welcome email to new users"""
@@ -340,10 +398,11 @@ def send_welcome_email():
         if not user_email or not full_name:
             return jsonify({"success": False, "error": "Missing required fields"}), 400
         
-        html_content = render_template_string(WELCOME_EMAIL_TEMPLATE, 
-                                            full_name=full_name, 
-                                            role=role, 
-                                            login_url=login_url)
+        with stage('render'):
+            html_content = render_template_string(WELCOME_EMAIL_TEMPLATE, 
+                                                full_name=full_name, 
+                                                role=role, 
+                                                login_url=login_url)
         
         result = send_email(
             to_email=user_email,
@@ -353,7 +412,7 @@ def send_welcome_email():
         
         return jsonify(result)
     except Exception as e:
-        logger.error(f"Error sending welcome email: {str(e)}")
+        logger.error("Error sending welcome email: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/send-password-reset', methods=['POST'])
@@ -368,18 +427,20 @@ def send_password_reset():
         if not user_email or not reset_token or not reset_url:
             return jsonify({"success": False, "error": "Missing required fields"}), 400
         
-        html_content = render_template_string(PASSWORD_RESET_TEMPLATE, 
-                                            reset_url=reset_url)
+        with stage('render'):
+            html_content = render_template_string(PASSWORD_RESET_TEMPLATE, 
+                                                reset_url=reset_url)
         
         result = send_email(
             to_email=user_email,
             subject="Password Reset Request - Novakinetix Academy",
-            html_content=html_content
+            html_content=html_content,
+            lane=LANE_CRITICAL
         )
         
         return jsonify(result)
     except Exception as e:
-        logger.error(f"Error sending password reset email: {str(e)}")
+        logger.error("Error sending password reset email: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/send-volunteer-hours-approved', methods=['POST'])
@@ -398,13 +459,14 @@ def send_volunteer_hours_approved():
         if not all([intern_email, intern_name, activity_type, description, hours, date]):
             return jsonify({"success": False, "error": "Missing required fields"}), 400
         
-        html_content = render_template_string(VOLUNTEER_HOURS_APPROVED_TEMPLATE,
-                                            intern_name=intern_name,
-                                            activity_type=activity_type,
-                                            description=description,
-                                            hours=hours,
-                                            date=date,
-                                            total_hours=total_hours)
+        with stage('render'):
+            html_content = render_template_string(VOLUNTEER_HOURS_APPROVED_TEMPLATE,
+                                                intern_name=intern_name,
+                                                activity_type=activity_type,
+                                                description=description,
+                                                hours=hours,
+                                                date=date,
+                                                total_hours=total_hours)
         
         result = send_email(
             to_email=intern_email,
@@ -414,7 +476,7 @@ def send_volunteer_hours_approved():
         
         return jsonify(result)
     except Exception as e:
-        logger.error(f"Error sending volunteer hours approved email: {str(e)}")
+        logger.error("Error sending volunteer hours approved email: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/send-volunteer-hours-rejected', methods=['POST'])
@@ -433,13 +495,14 @@ def send_volunteer_hours_rejected():
         if not all([intern_email, intern_name, activity_type, description, hours, date, rejection_reason]):
             return jsonify({"success": False, "error": "Missing required fields"}), 400
         
-        html_content = render_template_string(VOLUNTEER_HOURS_REJECTED_TEMPLATE,
-                                            intern_name=intern_name,
-                                            activity_type=activity_type,
-                                            description=description,
-                                            hours=hours,
-                                            date=date,
-                                            rejection_reason=rejection_reason)
+        with stage('render'):
+            html_content = render_template_string(VOLUNTEER_HOURS_REJECTED_TEMPLATE,
+                                                intern_name=intern_name,
+                                                activity_type=activity_type,
+                                                description=description,
+                                                hours=hours,
+                                                date=date,
+                                                rejection_reason=rejection_reason)
         
         result = send_email(
             to_email=intern_email,
@@ -449,7 +512,7 @@ def send_volunteer_hours_rejected():
         
         return jsonify(result)
     except Exception as e:
-        logger.error(f"Error sending volunteer hours rejected email: {str(e)}")
+        logger.error("Error sending volunteer hours rejected email: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/send-tutoring-notification', methods=['POST'])
@@ -471,16 +534,17 @@ def send_tutoring_notification():
         if not all([recipient_email, recipient_name, message, subject, session_date, duration_minutes, tutor_name, student_name]):
             return jsonify({"success": False, "error": "Missing required fields"}), 400
         
-        html_content = render_template_string(TUTORING_NOTIFICATION_TEMPLATE,
-                                            recipient_name=recipient_name,
-                                            session_type=session_type,
-                                            message=message,
-                                            subject=subject,
-                                            session_date=session_date,
-                                            duration_minutes=duration_minutes,
-                                            tutor_name=tutor_name,
-                                            student_name=student_name,
-                                            notes=notes)
+        with stage('render'):
+            html_content = render_template_string(TUTORING_NOTIFICATION_TEMPLATE,
+                                                recipient_name=recipient_name,
+                                                session_type=session_type,
+                                                message=message,
+                                                subject=subject,
+                                                session_date=session_date,
+                                                duration_minutes=duration_minutes,
+                                                tutor_name=tutor_name,
+                                                student_name=student_name,
+                                                notes=notes)
         
         result = send_email(
             to_email=recipient_email,
@@ -490,7 +554,7 @@ def send_tutoring_notification():
         
         return jsonify(result)
     except Exception as e:
-        logger.error(f"Error sending tutoring notification email: {str(e)}")
+        logger.error("Error sending tutoring notification email: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/send-admin-notification', methods=['POST'])
@@ -509,23 +573,25 @@ def send_admin_notification():
         if not all([admin_email, admin_name, notification_message, notification_type]):
             return jsonify({"success": False, "error": "Missing required fields"}), 400
         
-        html_content = render_template_string(ADMIN_NOTIFICATION_TEMPLATE,
-                                            admin_name=admin_name,
-                                            notification_message=notification_message,
-                                            notification_type=notification_type,
-                                            priority=priority,
-                                            action_required=action_required,
-                                            additional_info=additional_info)
+        with stage('render'):
+            html_content = render_template_string(ADMIN_NOTIFICATION_TEMPLATE,
+                                                admin_name=admin_name,
+                                                notification_message=notification_message,
+                                                notification_type=notification_type,
+                                                priority=priority,
+                                                action_required=action_required,
+                                                additional_info=additional_info)
         
         result = send_email(
             to_email=admin_email,
             subject=f"Admin Notification: {notification_type} - Novakinetix Academy",
-            html_content=html_content
+            html_content=html_content,
+            lane=resolve_lane(priority, LANE_TRANSACTIONAL)
         )
         
         return jsonify(result)
     except Exception as e:
-        logger.error(f"Error sending admin notification email: {str(e)}")
+        logger.error("Error sending admin notification email: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/send-custom-email', methods=['POST'])
@@ -541,17 +607,23 @@ def send_custom_email():
         if not all([to_email, subject, template]):
             return jsonify({"success": False, "error": "Missing required fields"}), 400
         
-        html_content = render_template_string(template, **template_data)
+        try:
+            with stage('render'):
+                html_content = template_sandbox.render(template, template_data)
+        except TemplateLimitError as e:
+            logger.warning("Rejected custom template: %s", e)
+            return jsonify({"success": False, "error": str(e)}), 400
         
         result = send_email(
             to_email=to_email,
             subject=subject,
-            html_content=html_content
+            html_content=html_content,
+            lane=resolve_lane(data.get('priority'), LANE_BULK)
         )
         
         return jsonify(result)
     except Exception as e:
-        logger.error(f"Error sending custom email: {str(e)}")
+        logger.error("Error sending custom email: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 if __name__ == '__main__':
@@ -0,0 +1,130 @@
+"""
+Adaptive concurrency for SMTP delivery.
+A fixed number of delivery threads is either too few for a healthy relay or enough to
+get a struggling one to throttle and time out. The lane scheduler's threads are instead
+gated by a limit that follows the relay: every delivered message reports its send latency
+and whether it failed, and once per window (about one message per allowed slot) the limit
+is adjusted AIMD-style. A window whose error rate is over the threshold, or whose average
+latency has drifted more than `tolerance` times above the baseline, cuts the limit by
+`backoff`; a healthy window that actually used its slots raises it by one. The baseline
+follows the fastest windows down at once and slower ones up only gradually, so a relay
+that stays slow eventually becomes the new normal instead of pinning the limit at its floor.
+"""
+
+import os
+import threading
+
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_BACKOFF = 0.7
+DEFAULT_TOLERANCE = 2.0
+DEFAULT_ERROR_THRESHOLD = 0.1
+
+# Fewest samples in an adjustment window, so a low limit is not judged on one message
+MIN_WINDOW = 8
+
+# How quickly the baseline rises towards slower windows (it drops to faster ones at once)
+BASELINE_ALPHA = 0.05
+
+
+class AdaptiveLimit:
+    """AIMD concurrency limit driven by per-message send latency and failures"""
+
+    def __init__(self, max_limit, min_limit=DEFAULT_MIN_LIMIT, initial=None, backoff=DEFAULT_BACKOFF,
+                 tolerance=DEFAULT_TOLERANCE, error_threshold=DEFAULT_ERROR_THRESHOLD, metrics=None):
+        if not 1 <= min_limit <= max_limit:
+            raise ValueError("Concurrency bounds need 1 <= min <= max")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = max_limit if initial is None else max(min_limit, min(max_limit, initial))
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.error_threshold = error_threshold
+        self.metrics = metrics
+        self.baseline = None
+        self._samples = 0
+        self._errors = 0
+        self._latency = 0.0
+        self._peak_inflight = 0
+        self._lock = threading.Lock()
+        self._record_limit()
+
+    @classmethod
+    def from_env(cls, workers, metrics=None):
+        """Build from MAIL_CONCURRENCY_MIN and MAIL_CONCURRENCY_MAX (default: the lane worker
+        count); returns None when MAIL_CONCURRENCY_ADAPTIVE is false"""
+        if os.environ.get('MAIL_CONCURRENCY_ADAPTIVE', 'true').lower() != 'true':
+            return None
+        max_limit = int(os.environ.get('MAIL_CONCURRENCY_MAX', workers))
+        return cls(
+            max_limit=max_limit,
+            min_limit=int(os.environ.get('MAIL_CONCURRENCY_MIN', DEFAULT_MIN_LIMIT)),
+            backoff=float(os.environ.get('MAIL_CONCURRENCY_BACKOFF', DEFAULT_BACKOFF)),
+            tolerance=float(os.environ.get('MAIL_CONCURRENCY_TOLERANCE', DEFAULT_TOLERANCE)),
+            error_threshold=float(os.environ.get('MAIL_CONCURRENCY_ERROR_THRESHOLD', DEFAULT_ERROR_THRESHOLD)),
+            metrics=metrics
+        )
+
+    def observe_inflight(self, inflight):
+        """Note how many deliveries are running; the limit only grows if it was reached"""
+        with self._lock:
+            if inflight > self._peak_inflight:
+                self._peak_inflight = inflight
+
+    def record(self, latency, count=1, errors=0):
+        """Report count messages sent with an average latency (seconds), errors of them failed"""
+        if count <= 0:
+            return
+        with self._lock:
+            self._samples += count
+            self._errors += errors
+            self._latency += latency * count
+            if self._samples < max(MIN_WINDOW, self.limit):
+                return
+            direction = self._adjust()
+        if direction:
+            self._record_limit(direction)
+
+    def _adjust(self):
+        average = self._latency / self._samples
+        error_rate = self._errors / self._samples
+        saturated = self._peak_inflight >= self.limit
+        self._samples = self._errors = self._peak_inflight = 0
+        self._latency = 0.0
+
+        if error_rate > self.error_threshold:
+            # Failed sends are often fast, so they say nothing about the baseline
+            return self._decrease()
+        if self.baseline is None or average < self.baseline:
+            self.baseline = average
+        elif average > self.baseline * self.tolerance:
+            self.baseline += BASELINE_ALPHA * (average - self.baseline)
+            return self._decrease()
+        else:
+            self.baseline += BASELINE_ALPHA * (average - self.baseline)
+        if saturated and self.limit < self.max_limit:
+            self.limit += 1
+            return 'up'
+        return None
+
+    def _decrease(self):
+        limit = max(self.min_limit, int(self.limit * self.backoff))
+        if limit == self.limit:
+            return None
+        self.limit = limit
+        return 'down'
+
+    def _record_limit(self, direction=None):
+        if not self.metrics:
+            return
+        self.metrics.set_gauge('delivery_concurrency_limit', self.limit)
+        if direction:
+            self.metrics.incr('delivery_concurrency_adjustments_total', direction=direction)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'min': self.min_limit,
+                'max': self.max_limit,
+                'baseline_ms': round(self.baseline * 1000, 2) if self.baseline is not None else None
+            }
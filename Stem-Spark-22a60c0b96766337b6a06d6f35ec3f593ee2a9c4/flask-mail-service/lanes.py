@@ -0,0 +1,242 @@
+"""
+Priority lanes for outbound mail.
+Each lane has its own queue and concurrency cap; a shared pool of delivery threads
+picks the next job with smooth weighted round-robin so that bulk traffic cannot
+starve password resets and other critical sends. Deliveries across all lanes can also
+be capped by an AdaptiveLimit that backs off when the relay slows down or fails.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+from concurrency import AdaptiveLimit
+
+LANE_CRITICAL = 'critical'
+LANE_TRANSACTIONAL = 'transactional'
+LANE_BULK = 'bulk'
+
+# name -> (weight, concurrency)
+DEFAULT_LANES = {
+    LANE_CRITICAL: (6, 4),
+    LANE_TRANSACTIONAL: (3, 4),
+    LANE_BULK: (1, 2)
+}
+
+DEFAULT_WORKERS = 8
+
+# Smoothing factor for the per-lane moving average of job service time
+SERVICE_TIME_ALPHA = 0.2
+
+# Values accepted in a request's "priority" field
+PRIORITY_ALIASES = {
+    'critical': LANE_CRITICAL,
+    'urgent': LANE_CRITICAL,
+    'high': LANE_CRITICAL,
+    'transactional': LANE_TRANSACTIONAL,
+    'normal': LANE_TRANSACTIONAL,
+    'medium': LANE_TRANSACTIONAL,
+    'bulk': LANE_BULK,
+    'low': LANE_BULK
+}
+
+
+def resolve_lane(priority, default=LANE_TRANSACTIONAL):
+    """Map a caller-supplied priority to a lane name, falling back to the endpoint default"""
+    if not priority:
+        return default
+    return PRIORITY_ALIASES.get(str(priority).strip().lower(), default)
+
+
+def parse_lanes(spec):
+    """Parse "critical:6:4,transactional:3:4,bulk:1:2" into {name: (weight, concurrency)}"""
+    lanes = {}
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, weight, concurrency = item.split(':')
+        lanes[name.strip()] = (int(weight), int(concurrency))
+    return lanes
+
+
+class Lane:
+    def __init__(self, name, weight, concurrency):
+        if weight < 1 or concurrency < 1:
+            raise ValueError(f"Lane {name} needs a positive weight and concurrency")
+        self.name = name
+        self.weight = weight
+        self.concurrency = concurrency
+        self.queue = deque()
+        self.active = 0
+        self.current_weight = 0
+        self.service_time = 0.0
+
+
+class LaneScheduler:
+    """Dispatches callables onto weighted, concurrency-capped lanes"""
+
+    def __init__(self, lanes=None, workers=DEFAULT_WORKERS, metrics=None, limiter=None):
+        lanes = lanes or DEFAULT_LANES
+        self.lanes = {name: Lane(name, weight, concurrency)
+                      for name, (weight, concurrency) in lanes.items()}
+        self.workers = workers
+        self.metrics = metrics
+        self.limiter = limiter
+        self.active = 0
+        self._cond = threading.Condition()
+        self._threads = []
+        self._pid = None
+        self._stopping = False
+
+    @classmethod
+    def from_env(cls, metrics=None):
+        """Build a scheduler from MAIL_LANES and MAIL_LANE_WORKERS, with an adaptive
+        delivery limit unless MAIL_CONCURRENCY_ADAPTIVE is false"""
+        spec = os.environ.get('MAIL_LANES')
+        lanes = parse_lanes(spec) if spec else DEFAULT_LANES
+        workers = int(os.environ.get('MAIL_LANE_WORKERS', DEFAULT_WORKERS))
+        limiter = AdaptiveLimit.from_env(workers, metrics=metrics)
+        return cls(lanes=lanes, workers=workers, metrics=metrics, limiter=limiter)
+
+    def submit(self, lane_name, fn, *args, **kwargs):
+        """Queue fn on a lane and return a Future for its result"""
+        lane = self.lanes.get(lane_name)
+        if lane is None:
+            raise ValueError(f"Unknown lane: {lane_name}")
+
+        future = Future()
+        with self._cond:
+            self._ensure_workers()
+            lane.queue.append((future, fn, args, kwargs, time.perf_counter()))
+            self._record_depth(lane)
+            self._cond.notify()
+        return future
+
+    def run(self, lane_name, fn, *args, **kwargs):
+        """Run fn on a lane and block until it finishes"""
+        return self.submit(lane_name, fn, *args, **kwargs).result()
+
+    def _ensure_workers(self):
+        # A forked child (gunicorn --preload) inherits the list but not the threads
+        if self._threads and self._pid == os.getpid():
+            return
+        self._threads = []
+        self._pid = os.getpid()
+        self._stopping = False
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"mail-lane-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def record_delivery(self, latency, count=1, errors=0):
+        """Feed the adaptive limit: count messages sent at an average latency (seconds)"""
+        if self.limiter is not None:
+            self.limiter.record(latency, count, errors)
+
+    def _pick_lane(self):
+        """Smooth weighted round-robin over lanes that have work and a free slot"""
+        if self.limiter is not None and self.active >= self.limiter.limit:
+            return None
+        eligible = [lane for lane in self.lanes.values()
+                    if lane.queue and lane.active < lane.concurrency]
+        if not eligible:
+            return None
+
+        total = 0
+        chosen = None
+        for lane in eligible:
+            lane.current_weight += lane.weight
+            total += lane.weight
+            if chosen is None or lane.current_weight > chosen.current_weight:
+                chosen = lane
+        chosen.current_weight -= total
+        return chosen
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                lane = self._pick_lane()
+                while lane is None:
+                    if self._stopping:
+                        return
+                    self._cond.wait()
+                    lane = self._pick_lane()
+                future, fn, args, kwargs, enqueued_at = lane.queue.popleft()
+                lane.active += 1
+                self.active += 1
+                if self.limiter is not None:
+                    self.limiter.observe_inflight(self.active)
+                self._record_depth(lane)
+
+            started = time.perf_counter()
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                finished = time.perf_counter()
+                with self._cond:
+                    lane.active -= 1
+                    self.active -= 1
+                    elapsed = finished - started
+                    if lane.service_time:
+                        lane.service_time += SERVICE_TIME_ALPHA * (elapsed - lane.service_time)
+                    else:
+                        lane.service_time = elapsed
+                    self._record_depth(lane)
+                    self._cond.notify_all()
+                self._record_job(lane, future, enqueued_at, started, finished)
+
+    def _record_depth(self, lane):
+        if self.metrics:
+            self.metrics.set_gauge('lane_queue_depth', len(lane.queue), lane=lane.name)
+            self.metrics.set_gauge('lane_active', lane.active, lane=lane.name)
+
+    def _record_job(self, lane, future, enqueued_at, started, finished):
+        if not self.metrics:
+            return
+        failed = future.cancelled() or future.exception() is not None
+        self.metrics.incr('lane_jobs_total', lane=lane.name, status='error' if failed else 'ok')
+        self.metrics.observe('lane_wait_ms', (started - enqueued_at) * 1000, lane=lane.name)
+        self.metrics.observe('lane_latency_ms', (finished - enqueued_at) * 1000, lane=lane.name)
+
+    def estimated_wait(self, lane_name):
+        """Seconds a job submitted now would queue before starting, from the moving average
+        of recent service times (0 until the lane has finished a job)"""
+        lane = self.lanes[lane_name]
+        with self._cond:
+            concurrency = lane.concurrency
+            if self.limiter is not None:
+                concurrency = min(concurrency, self.limiter.limit)
+            if lane.active < concurrency and not lane.queue:
+                return 0.0
+            return (len(lane.queue) + 1) * lane.service_time / concurrency
+
+    def stats(self):
+        """Current queue depth and in-flight count per lane"""
+        with self._cond:
+            return {
+                name: {
+                    'weight': lane.weight,
+                    'concurrency': lane.concurrency,
+                    'queued': len(lane.queue),
+                    'active': lane.active,
+                    'service_ms': round(lane.service_time * 1000, 2)
+                }
+                for name, lane in self.lanes.items()
+            }
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads once queued jobs have drained"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            threads, self._threads = self._threads, []
+        if wait:
+            for thread in threads:
+                thread.join()
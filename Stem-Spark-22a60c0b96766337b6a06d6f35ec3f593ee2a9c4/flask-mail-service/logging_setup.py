@@ -0,0 +1,131 @@
+"""
+Non-blocking logging for the mail service.
+Request threads only enqueue records; a QueueListener thread formats them as JSON lines
+and writes them out. High-volume success lines can be sampled before they are enqueued.
+"""
+
+import os
+import sys
+import json
+import atexit
+import queue
+import logging
+import itertools
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Attributes every LogRecord has; anything else came from extra={...}
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with extra fields such as duration_ms kept as keys"""
+
+    def format(self, record):
+        payload = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and key != 'sampled':
+                payload[key] = value
+        if record.exc_info:
+            payload['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+class LazyQueueHandler(QueueHandler):
+    """Enqueue the record untouched so %-formatting happens on the listener thread"""
+
+    def prepare(self, record):
+        return record
+
+
+class SuccessSampler(logging.Filter):
+    """Keep one in every N records logged with extra={'sampled': True}"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, 'sampled', False):
+            return True
+        if not self.every:
+            return False
+        with self._lock:
+            return next(self._counter) % self.every == 0
+
+
+def configure_logging(level=None, log_format=None, sample_rate=None):
+    """Route the root logger through a queue; reads LOG_LEVEL, LOG_FORMAT and LOG_SUCCESS_SAMPLE_RATE"""
+    global _listener, _handler
+    level = level or os.environ.get('LOG_LEVEL', 'INFO')
+    log_format = log_format or os.environ.get('LOG_FORMAT', 'json')
+    if sample_rate is None:
+        sample_rate = float(os.environ.get('LOG_SUCCESS_SAMPLE_RATE', 1.0))
+
+    if _listener is not None:
+        _listener.stop()
+
+    output = logging.StreamHandler(sys.stderr)
+    if log_format == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(levelname)s:%(name)s:%(message)s'))
+
+    records = queue.SimpleQueue()
+    handler = LazyQueueHandler(records)
+    handler.addFilter(SuccessSampler(sample_rate))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if type(existing) in (LazyQueueHandler, logging.StreamHandler):
+            root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    _handler = handler
+
+    _listener = QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def add_log_filter(log_filter):
+    """Attach a filter to the queue handler; it runs in the thread that logs the record,
+    before the record is enqueued, so it can read that thread's request context"""
+    if _handler is not None:
+        _handler.addFilter(log_filter)
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_listener_after_fork():
+    """A forked child (gunicorn --preload worker) inherits the queue but not the listener thread"""
+    if _listener is not None:
+        # Records still queued at fork time belong to the parent, which writes them itself
+        records = queue.SimpleQueue()
+        _listener.queue = records
+        if _handler is not None:
+            _handler.queue = records
+        _listener._thread = None
+        _listener.start()
+
+
+atexit.register(stop_logging)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_listener_after_fork)
@@ -0,0 +1,108 @@
+"""
+Per-request stage timers for the send routes.
+Stages are recorded with `with stage('render'):` and returned to the caller in a
+Server-Timing header, alongside the correlation ID taken from (or echoed into)
+the request ID header.
+"""
+
+import os
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+from flask import g, request, has_request_context
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = os.environ.get('REQUEST_ID_HEADER', 'X-Request-ID')
+
+
+class RequestTimer:
+    """Ordered stage durations for one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = []
+
+    def add(self, name, duration_ms):
+        self.stages.append((name, duration_ms))
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def header(self):
+        """Format as a Server-Timing header value"""
+        parts = [f"{name};dur={duration:.2f}" for name, duration in self.stages]
+        parts.append(f"total;dur={self.total_ms():.2f}")
+        return ', '.join(parts)
+
+
+@contextmanager
+def stage(name):
+    """Time a block as a named stage of the current request (no-op outside a request)"""
+    timer = g.get('timer') if has_request_context() else None
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, (time.perf_counter() - started) * 1000)
+
+
+def current_request_id():
+    if has_request_context():
+        return g.get('request_id')
+    return None
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp records logged inside a request with its correlation ID"""
+
+    def filter(self, record):
+        request_id = current_request_id()
+        if request_id and not hasattr(record, 'request_id'):
+            record.request_id = request_id
+        return True
+
+
+def init_app(app, profiler=None, timed_prefixes=('/api/send',)):
+    """Install timing (and optional profiling) hooks on the send routes"""
+
+    def is_timed():
+        return request.path.startswith(timed_prefixes)
+
+    @app.before_request
+    def start_timer():
+        g.request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+        if not is_timed():
+            return
+        g.timer = RequestTimer()
+        if profiler is not None:
+            g.profile_token = profiler.start_request()
+        if request.is_json:
+            # Parse once here so the JSON decode shows up as its own stage; later
+            # get_json() calls in the view reuse the cached result
+            with stage('parse'):
+                request.get_json(silent=True)
+
+    @app.after_request
+    def add_timing_headers(response):
+        response.headers[REQUEST_ID_HEADER] = g.get('request_id', '')
+        timer = g.get('timer')
+        if timer is None:
+            return response
+        response.headers['Server-Timing'] = timer.header()
+        logger.info("Request timing %s %s", request.method, request.path, extra={
+            'sampled': True,
+            'status': response.status_code,
+            'stages': {name: round(duration, 2) for name, duration in timer.stages},
+            'duration_ms': round(timer.total_ms(), 2)
+        })
+        return response
+
+    @app.teardown_request
+    def finish_profile(exc):
+        if profiler is not None:
+            profiler.finish_request(g.pop('profile_token', None))
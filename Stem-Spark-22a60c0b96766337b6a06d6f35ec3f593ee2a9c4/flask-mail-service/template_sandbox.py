@@ -0,0 +1,247 @@
+"""
+Sandboxed rendering of caller-supplied templates (/send-custom-email).
+Templates run in a Jinja SandboxedEnvironment, so they cannot reach Python internals, and
+every render gets a budget: a wall-clock deadline, a cap on loop iterations and calls
+across the whole render, and a cap on output size. Loops are counted by rewriting each
+{% for %} at compile time to iterate through a guard that cannot be shadowed from the
+template; every call (macros included) is charged and checks the deadline, so recursive
+macros cannot multiply work between checks, and runaway recursion is rejected too.
+Operations that can build a huge string from a short expression (repetition, padding,
+format widths, replace) have their result size checked before they allocate. A template
+that exceeds its budget is stopped at the next check and rejected, so one bad template
+costs its own request at most the time limit instead of pinning the worker.
+"""
+
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from jinja2 import nodes, TemplateSyntaxError
+from jinja2.exceptions import SecurityError
+from jinja2.sandbox import SandboxedEnvironment
+from jinja2.filters import do_center, do_indent, do_format
+
+DEFAULT_MAX_SECONDS = 2.0
+DEFAULT_MAX_OUTPUT = 512 * 1024
+DEFAULT_MAX_ITERATIONS = 10000
+DEFAULT_CACHE_SIZE = 128
+
+# Loop iterations between clock reads
+CHECK_EVERY = 256
+
+# str methods whose result can be much longer than the string and arguments
+GROWING_METHODS = frozenset(['ljust', 'rjust', 'center', 'zfill', 'expandtabs', 'replace', 'format', 'format_map'])
+
+_PERCENT_SPEC = re.compile(r'%[-#0 +]*(\d+|\*)?(?:\.(\d+|\*))?')
+_FORMAT_SPEC = re.compile(r'\{[^{}]*:([^{}]*)\}')
+_NUMBER = re.compile(r'\d+')
+
+_budget = threading.local()
+
+
+class TemplateLimitError(Exception):
+    """A custom template was rejected; reason is the metrics label"""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class RenderBudget:
+    """Limits for one render, checked from the loop guard, every call and the output loop"""
+
+    def __init__(self, max_seconds: float, max_iterations: int, max_output: int):
+        self.deadline = time.monotonic() + max_seconds
+        self.max_seconds = max_seconds
+        self.max_iterations = max_iterations
+        self.max_output = max_output
+        self.iterations = 0
+
+    def tick(self) -> None:
+        self.iterations += 1
+        if self.iterations > self.max_iterations:
+            raise TemplateLimitError('iterations', f'Template exceeded {self.max_iterations} loop iterations and calls')
+        if self.iterations % CHECK_EVERY == 0:
+            self.check_time()
+
+    def check_time(self) -> None:
+        if time.monotonic() > self.deadline:
+            raise TemplateLimitError('timeout', f'Template took longer than {self.max_seconds}s to render')
+
+    def check_size(self, size: int) -> None:
+        if size > self.max_output:
+            raise TemplateLimitError('output', f'Template output exceeded {self.max_output} characters')
+
+
+def guard_iter(iterable: Iterable) -> Iterator:
+    """Iterate, charging every item to the current render's budget"""
+    budget = _budget.current
+    for item in iterable:
+        budget.tick()
+        yield item
+
+
+def format_size(template: str, args) -> int:
+    """Upper bound on the padding a %- or {}-format string can add: its field widths plus,
+    for "*" widths, the largest integer argument"""
+    values = args if isinstance(args, (tuple, list)) else (args,)
+    largest = max((value for value in values if isinstance(value, int)), default=0)
+    size = 0
+    for match in _PERCENT_SPEC.finditer(template):
+        for width in match.groups():
+            if width == '*':
+                size += largest
+            elif width:
+                size += int(width)
+    for match in _FORMAT_SPEC.finditer(template):
+        size += sum(int(number) for number in _NUMBER.findall(match.group(1)))
+    return len(template) + size
+
+
+def grown_size(value: str, method: str, args, kwargs) -> int:
+    """Upper bound on the length of value.<method>(*args)"""
+    if method in ('format', 'format_map'):
+        return format_size(value, args)
+    if method == 'replace' and len(args) >= 2 and isinstance(args[0], str) and isinstance(args[1], str):
+        old, new = args[0], args[1]
+        matches = value.count(old) if old else len(value) + 1
+        return len(value) + matches * max(0, len(new) - len(old))
+    if method == 'expandtabs':
+        tabsize = args[0] if args else kwargs.get('tabsize', 8)
+        return len(value) + value.count('\t') * tabsize if isinstance(tabsize, int) else len(value)
+    width = args[0] if args else kwargs.get('width', 0)
+    return max(len(value), width) if isinstance(width, int) else len(value)
+
+
+def _checked(budget_size, filter_func):
+    """Wrap a filter so its estimated result size is checked before it runs"""
+    def wrapped(value, *args, **kwargs):
+        budget = _budget.current
+        budget.check_time()
+        budget.check_size(budget_size(value, args, kwargs))
+        return filter_func(value, *args, **kwargs)
+    return wrapped
+
+
+def _indent_size(value, args, kwargs):
+    width = args[0] if args else kwargs.get('width', 4)
+    width = width if isinstance(width, int) else len(str(width))
+    return len(str(value)) + (str(value).count('\n') + 1) * width
+
+
+class LimitedEnvironment(SandboxedEnvironment):
+    """Sandbox whose loops, calls and string operations are charged to a RenderBudget"""
+
+    intercepted_binops = frozenset(['*', '%'])
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.filters['center'] = _checked(lambda value, args, kwargs: grown_size(str(value), 'center', args, kwargs),
+                                          do_center)
+        self.filters['indent'] = _checked(_indent_size, do_indent)
+        self.filters['format'] = _checked(lambda value, args, kwargs: format_size(str(value), args or kwargs),
+                                          do_format)
+
+    def _generate(self, source, name, filename, defer_init=False):
+        for loop in source.find_all(nodes.For):
+            loop.iter = nodes.Call(nodes.ImportedName(f'{__name__}.guard_iter'), [loop.iter], [], None, None,
+                                   lineno=loop.lineno)
+        return super()._generate(source, name, filename, defer_init=defer_init)
+
+    def call_binop(self, context, operator, left, right):
+        budget = _budget.current
+        budget.check_time()
+        if operator == '*':
+            for value, count in ((left, right), (right, left)):
+                if isinstance(value, (str, list, tuple)) and isinstance(count, int):
+                    budget.check_size(len(value) * count)
+        elif isinstance(left, str):
+            budget.check_size(format_size(left, right))
+        return super().call_binop(context, operator, left, right)
+
+    def call(__self, __context, __obj, *args, **kwargs):
+        # Macro calls come through here too; a recursive macro never reaches a loop guard
+        budget = _budget.current
+        budget.tick()
+        budget.check_time()
+        owner = getattr(__obj, '__self__', None)
+        if isinstance(owner, str) and getattr(__obj, '__name__', None) in GROWING_METHODS:
+            budget.check_size(grown_size(owner, __obj.__name__, args, kwargs))
+        return super().call(__context, __obj, *args, **kwargs)
+
+
+class TemplateSandbox:
+    """Compiles and renders caller-supplied templates within a per-render budget"""
+
+    def __init__(self, max_seconds: float = DEFAULT_MAX_SECONDS, max_output: int = DEFAULT_MAX_OUTPUT,
+                 max_iterations: int = DEFAULT_MAX_ITERATIONS, cache_size: int = DEFAULT_CACHE_SIZE,
+                 metrics=None):
+        self.max_seconds = max_seconds
+        self.max_output = max_output
+        self.max_iterations = max_iterations
+        self.cache_size = cache_size
+        self.metrics = metrics
+        self.env = LimitedEnvironment(autoescape=True)
+        self._compiled = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, metrics=None) -> 'TemplateSandbox':
+        """Build from CUSTOM_TEMPLATE_MAX_SECONDS, CUSTOM_TEMPLATE_MAX_OUTPUT and CUSTOM_TEMPLATE_MAX_ITERATIONS"""
+        return cls(
+            max_seconds=float(os.environ.get('CUSTOM_TEMPLATE_MAX_SECONDS', DEFAULT_MAX_SECONDS)),
+            max_output=int(os.environ.get('CUSTOM_TEMPLATE_MAX_OUTPUT', DEFAULT_MAX_OUTPUT)),
+            max_iterations=int(os.environ.get('CUSTOM_TEMPLATE_MAX_ITERATIONS', DEFAULT_MAX_ITERATIONS)),
+            metrics=metrics
+        )
+
+    def compile(self, source: str):
+        """Compile a template once; callers tend to resend the same few templates"""
+        with self._lock:
+            template = self._compiled.get(source)
+            if template is not None:
+                self._compiled.move_to_end(source)
+                return template
+        if len(source) > self.max_output:
+            raise TemplateLimitError('output', f'Template source exceeded {self.max_output} characters')
+        try:
+            template = self.env.from_string(source)
+        except TemplateSyntaxError as e:
+            raise TemplateLimitError('syntax', f'Invalid template: {e}') from e
+        with self._lock:
+            self._compiled[source] = template
+            while len(self._compiled) > self.cache_size:
+                self._compiled.popitem(last=False)
+        return template
+
+    def render(self, source: str, data: Optional[Dict[str, Any]] = None) -> str:
+        """Render a caller-supplied template, raising TemplateLimitError if it is rejected"""
+        started = time.perf_counter()
+        try:
+            template = self.compile(source)
+            budget = RenderBudget(self.max_seconds, self.max_iterations, self.max_output)
+            _budget.current = budget
+            chunks = []
+            size = 0
+            try:
+                for chunk in template.generate(**(data or {})):
+                    size += len(chunk)
+                    budget.check_size(size)
+                    budget.check_time()
+                    chunks.append(chunk)
+            except SecurityError as e:
+                raise TemplateLimitError('unsafe', f'Template is not allowed: {e}') from e
+            except RecursionError as e:
+                raise TemplateLimitError('recursion', 'Template recursed too deeply') from e
+            finally:
+                _budget.current = None
+        except TemplateLimitError as e:
+            if self.metrics:
+                self.metrics.incr('custom_template_rejected_total', reason=e.reason)
+            raise
+        if self.metrics:
+            self.metrics.observe('custom_template_render_ms', (time.perf_counter() - started) * 1000)
+        return ''.join(chunks)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Tests for budgeted rendering of custom templates
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from template_sandbox import TemplateSandbox, TemplateLimitError
+from metrics import Metrics
+
+# Doubles its work with every level of n and never reaches a loop guard
+EXPONENTIAL_MACRO = ('{% macro f(n) %}{% if n %}{{ f(n-1) }}{{ f(n-1) }}{% endif %}{% endmacro %}'
+                     '{{ f(18) }}')
+
+
+def rejection(sandbox, source, data=None):
+    try:
+        sandbox.render(source, data)
+    except TemplateLimitError as e:
+        return e.reason
+    raise AssertionError(f'{source!r} was not rejected')
+
+
+def test_renders_within_budget():
+    sandbox = TemplateSandbox()
+    html = sandbox.render('{% for name in names %}<p>{{ name|upper }}</p>{% endfor %}',
+                          {'names': ['ada', '<b>']})
+    assert html == '<p>ADA</p><p>&lt;B&gt;</p>'
+
+
+def test_rejections():
+    sandbox = TemplateSandbox(max_iterations=1000, max_output=10000)
+    assert rejection(sandbox, '{% for i in range(5000) %}x{% endfor %}') == 'iterations'
+    assert rejection(sandbox, '{% for i in range(100) %}{% for j in range(100) %}{% endfor %}{% endfor %}') == 'iterations'
+    assert rejection(sandbox, "{{ 'x' * 100000 }}") == 'output'
+    assert rejection(sandbox, "{{ 'x'.ljust(100000) }}") == 'output'
+    assert rejection(sandbox, "{{ '%100000s' % 'x' }}") == 'output'
+    assert rejection(sandbox, '{% for i in range(900) %}{{ chunk }}{% endfor %}', {'chunk': 'y' * 100}) == 'output'
+    assert rejection(sandbox, '{{ ().__class__.__mro__ }}') == 'unsafe'
+    assert rejection(sandbox, "{{ ''.__class__.__subclasses__() }}") == 'unsafe'
+    assert rejection(sandbox, '{% for x in %}') == 'syntax'
+    assert rejection(TemplateSandbox(max_iterations=10 ** 9),
+                     '{% macro f(n) %}{{ f(n + 1) }}{% endmacro %}{{ f(0) }}') == 'recursion'
+
+
+def test_recursive_macros_are_charged():
+    # Every macro call counts towards the iteration cap...
+    assert rejection(TemplateSandbox(), EXPONENTIAL_MACRO) == 'iterations'
+
+    # ...and checks the deadline, so the render stops close to it
+    sandbox = TemplateSandbox(max_seconds=0.2, max_iterations=10 ** 9)
+    started = time.monotonic()
+    assert rejection(sandbox, EXPONENTIAL_MACRO) == 'timeout'
+    assert time.monotonic() - started < 1.0
+
+
+def test_rejections_are_counted():
+    registry = Metrics()
+    sandbox = TemplateSandbox(max_iterations=100, metrics=registry)
+    sandbox.render('{{ 1 + 1 }}')
+    rejection(sandbox, '{% for i in range(1000) %}{% endfor %}')
+    rejection(sandbox, '{% if %}')
+    rejection(sandbox, '{% if %}')
+    snapshot = registry.snapshot()
+    assert snapshot['counters']['custom_template_rejected_total{reason=iterations}'] == 1
+    assert snapshot['counters']['custom_template_rejected_total{reason=syntax}'] == 2
+    assert snapshot['summaries']['custom_template_render_ms']['count'] == 1
+
+
+if __name__ == '__main__':
+    test_renders_within_budget()
+    test_rejections()
+    test_recursive_macros_are_charged()
+    test_rejections_are_counted()
+    print('template sandbox tests passed')
@@ -0,0 +1,33 @@
+"""
+Guard for operational admin endpoints.
+Admin routes are disabled unless ADMIN_API_TOKEN is set, and callers must send the
+token in the X-Admin-Token header (or as a Bearer token).
+"""
+
+import os
+import hmac
+from functools import wraps
+from flask import request, jsonify
+
+
+def _supplied_token():
+    token = request.headers.get('X-Admin-Token')
+    if token:
+        return token
+    auth = request.headers.get('Authorization', '')
+    if auth.startswith('Bearer '):
+        return auth[len('Bearer '):]
+    return ''
+
+
+def admin_required(view):
+    """Reject the request unless it carries the configured admin token"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        expected = os.environ.get('ADMIN_API_TOKEN')
+        if not expected:
+            return jsonify({'error': 'Admin endpoints are disabled'}), 403
+        if not hmac.compare_digest(_supplied_token().encode(), expected.encode()):
+            return jsonify({'error': 'Unauthorized'}), 401
+        return view(*args, **kwargs)
+    return wrapper
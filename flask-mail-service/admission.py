@@ -0,0 +1,139 @@
+"""
+Admission control for the send endpoints.
+When the SMTP relay slows down, requests would otherwise pile up in gunicorn's backlog until
+callers time out and retry, adding to the overload. Each send request is instead checked
+on arrival against the number of sends already in flight in this worker and the estimated
+queue wait of its delivery lane; past either threshold it is rejected at once with 429 and
+a Retry-After derived from how long the backlog should take to drain.
+
+Requests waiting in gunicorn's backlog are invisible to the app, so the in-flight cap is
+kept below the thread count: once it is reached new sends are shed, whatever the recent
+request durations. Critical sends (password resets) get a few reserved slots above the cap
+rather than an exemption, and one thread always stays free to answer 429s.
+"""
+
+import os
+import math
+import time
+import random
+import threading
+from functools import wraps
+from flask import jsonify, request
+
+from lanes import LANE_CRITICAL
+
+DEFAULT_MAX_WAIT = 5.0
+DEFAULT_CRITICAL_RESERVE = 1
+
+# Request durations are smoothed the same way lane service times are
+DURATION_ALPHA = 0.2
+
+
+def default_max_inflight(critical_reserve=DEFAULT_CRITICAL_RESERVE):
+    """The gunicorn thread count less the critical reserve and one thread to shed load"""
+    return max(1, int(os.environ.get('GUNICORN_THREADS', 4)) - 1 - critical_reserve)
+
+
+class AdmissionController:
+    """Caps in-flight sends per worker and sheds requests whose lane wait is too long"""
+
+    def __init__(self, scheduler, max_inflight=None, max_wait=DEFAULT_MAX_WAIT,
+                 critical_reserve=DEFAULT_CRITICAL_RESERVE, metrics=None):
+        self.scheduler = scheduler
+        self.max_inflight = default_max_inflight(critical_reserve) if max_inflight is None else max_inflight
+        self.max_wait = max_wait
+        self.critical_reserve = critical_reserve
+        self.metrics = metrics
+        self.inflight = 0
+        self.request_time = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, scheduler, metrics=None):
+        """Build from ADMISSION_MAX_INFLIGHT, ADMISSION_MAX_WAIT (0 disables either check) and
+        ADMISSION_CRITICAL_RESERVE"""
+        max_inflight = os.environ.get('ADMISSION_MAX_INFLIGHT')
+        return cls(
+            scheduler,
+            max_inflight=int(max_inflight) if max_inflight else None,
+            max_wait=float(os.environ.get('ADMISSION_MAX_WAIT', DEFAULT_MAX_WAIT)),
+            critical_reserve=int(os.environ.get('ADMISSION_CRITICAL_RESERVE', DEFAULT_CRITICAL_RESERVE)),
+            metrics=metrics
+        )
+
+    def try_acquire(self, lane):
+        """Admit a request for lane, returning None, or the Retry-After seconds if it is shed.
+
+        A request is shed once max_inflight sends are in flight; critical sends may also use
+        critical_reserve slots above that. With max_wait 0 the lane wait check is off.
+        """
+        if self.max_wait:
+            wait = self.scheduler.estimated_wait(lane)
+            if wait > self.max_wait:
+                return self._shed(lane, 'queue_wait', wait)
+        with self._lock:
+            limit = self.max_inflight + (self.critical_reserve if lane == LANE_CRITICAL else 0)
+            if self.max_inflight and self.inflight >= limit:
+                # Requests queued behind a full worker wait about one request duration each round
+                drain = self.request_time * (self.inflight - limit + 1)
+            else:
+                self.inflight += 1
+                inflight = self.inflight
+                drain = None
+        if drain is not None:
+            return self._shed(lane, 'inflight', drain)
+        if self.metrics:
+            self.metrics.set_gauge('admission_inflight', inflight)
+        return None
+
+    def release(self, duration):
+        with self._lock:
+            self.inflight -= 1
+            inflight = self.inflight
+            if self.request_time:
+                self.request_time += DURATION_ALPHA * (duration - self.request_time)
+            else:
+                self.request_time = duration
+        if self.metrics:
+            self.metrics.set_gauge('admission_inflight', inflight)
+
+    def _shed(self, lane, reason, seconds):
+        if self.metrics:
+            self.metrics.incr('admission_shed_total', lane=lane, reason=reason)
+        # Spread retries out so shed callers do not all come back in the same second
+        return max(1, math.ceil(seconds * random.uniform(1.0, 1.5)))
+
+    def guard(self, lane):
+        """Decorate a send route; lane is a lane name or a function of the JSON body"""
+        def decorator(view):
+            @wraps(view)
+            def wrapped(*args, **kwargs):
+                if callable(lane):
+                    data = request.get_json(silent=True)
+                    target = lane(data if isinstance(data, dict) else {})
+                else:
+                    target = lane
+                retry_after = self.try_acquire(target)
+                if retry_after is not None:
+                    response = jsonify({'error': 'Service is overloaded; retry later', 'retry_after': retry_after})
+                    return response, 429, {'Retry-After': str(retry_after)}
+                started = time.perf_counter()
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    self.release(time.perf_counter() - started)
+            return wrapped
+        return decorator
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'inflight': self.inflight,
+                'max_inflight': self.max_inflight,
+                'critical_reserve': self.critical_reserve,
+                'max_wait_s': self.max_wait,
+                'request_ms': round(self.request_time * 1000, 2)
+            }
+        stats['estimated_wait_s'] = {name: round(self.scheduler.estimated_wait(name), 3)
+                                     for name in self.scheduler.lanes}
+        return stats
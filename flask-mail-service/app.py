@@ -2,21 +2,54 @@ import os
 import json
 import base64
 from flask import Flask, request, jsonify, render_template_string
-from flask_mail import Mail, Message
+from flask_mail import Mail, Message, BadHeaderError, sanitize_address, sanitize_addresses
 from flask_cors import CORS
 import logging
 from datetime import datetime
 import re
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.image import MIMEImage
+from email.utils import formataddr, parseaddr
+import threading
+import time
+import smtplib
+import math
+from metrics import metrics
+from smtp_probe import SmtpProbe
+from logging_setup import configure_logging, add_log_filter
+import request_timing
+from request_timing import stage, RequestIdFilter
+from profiler import RequestProfiler
+from memory_tracer import MemoryTracer
+from admin_auth import admin_required
+from lanes import LaneScheduler, LANE_CRITICAL, LANE_TRANSACTIONAL, LANE_BULK, resolve_lane
+from render_pool import RenderPool, chunked
+from admission import AdmissionController
+from relays import RelayPool
+from suppression import SuppressionList
+from bounces import BounceIngestor
+from shared_state import SharedState, parse_rate
+from send_stats import SendStats
+from collections import Counter
+from attachments import AttachmentStore, AttachmentError, StreamedMessage, send_payload
+from dkim import DKIMSigner
+from archive import MessageArchive
+from outbox import OutboxPoller
+from preview import PreviewCache, SAMPLE_DATA, templates_version
+from fanout import FanoutMessageBuilder, logo_part, new_boundary, encode_header_value, encode_address, has_line_break
+from locales import TemplateLocalizer, install_filters
+from minify import MinifyingLoader, minify_html, minify_mode, MODE_OFF, MODE_FULL
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging (queued, JSON lines, sampled success messages)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
+install_filters(app.jinja_env)
+
+# Server-Timing / correlation IDs on the send routes, plus the on-demand profiler
+request_profiler = RequestProfiler()
+request_timing.init_app(app, profiler=request_profiler)
+add_log_filter(RequestIdFilter())
 
 # Flask Mail Configuration
 app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
@@ -28,6 +61,48 @@ app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER')
 
 mail = Mail(app)
 
+# Priority lanes for SMTP delivery (critical / transactional / bulk)
+lane_scheduler = LaneScheduler.from_env(metrics=metrics)
+
+# Overload shedding: 429 + Retry-After once in-flight sends or lane queue wait pass a threshold
+admission = AdmissionController.from_env(lane_scheduler, metrics=metrics)
+
+# Cached SMTP connectivity probe for /ready without MAIL_RELAYS (started in each worker
+# by the gunicorn post_worker_init hook, or on first use)
+smtp_probe = SmtpProbe.from_config(app.config, metrics=metrics)
+
+# Weighted SMTP relays with failover when MAIL_RELAYS is set; otherwise MAIL_SERVER is used
+relay_pool = RelayPool.from_env(app.config, metrics=metrics)
+
+# Hard-bounced and unsubscribed addresses, checked before anything is rendered
+suppression_list = SuppressionList.from_env(metrics=metrics)
+
+# DSN bounce ingestion from BOUNCE_MAILDIR / BOUNCE_MBOX (None when neither is set)
+bounce_ingestor = BounceIngestor.from_env(suppression_list=suppression_list, metrics=metrics)
+
+# Counters and TTL keys shared by every worker on the host: per-recipient throttles
+# (RECIPIENT_RATE_LIMIT="count/seconds") and Idempotency-Key dedupe windows
+shared_state = SharedState.from_env()
+RECIPIENT_RATE_LIMIT = parse_rate(os.environ.get('RECIPIENT_RATE_LIMIT'))
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 86400))
+
+# Dashboard aggregates (per template/status/hour/day plus a latency sketch), kept in the
+# same shared store so /api/stats reflects every worker
+send_stats = SendStats(shared_state)
+
+# Files under ATTACHMENT_DIR (certificates, receipts) that callers can attach by path or
+# upload id; encoded once per content hash and streamed to the relay
+attachment_store = AttachmentStore.from_env(metrics=metrics)
+
+# DKIM signing when DKIM_DOMAIN, DKIM_SELECTOR and DKIM_PRIVATE_KEY_PATH are set (None otherwise);
+# the key is parsed once here and once in each render pool process
+dkim_signer = DKIMSigner.from_env(metrics=metrics)
+
+# Compressed archive of every sent message under ARCHIVE_DIR (None when unset), written by a
+# background thread and looked up by Message-ID or recipient
+message_archive = MessageArchive.from_env(metrics=metrics)
+
 # Email templates
 WELCOME_EMAIL_TEMPLATE = """
 {% extends "base_email.html" %}
@@ -121,10 +196,10 @@ VOLUNTEER_HOURS_APPROVED_TEMPLATE = """
 <div class="highlight">
     <h3>Approved Hours Summary:</h3>
     <ul>
-        <li><strong>Date:</strong> {{ hours_date }}</li>
-        <li><strong>Hours:</strong> {{ hours_count }} hours</li>
+        <li><strong>Date:</strong> {{ hours_date|localdate }}</li>
+        <li><strong>Hours:</strong> {{ hours_count|localnumber }} hours</li>
         <li><strong>Activity:</strong> {{ activity_description }}</li>
-        <li><strong>Total Hours:</strong> {{ total_hours }} hours</li>
+        <li><strong>Total Hours:</strong> {{ total_hours|localnumber }} hours</li>
     </ul>
 </div>
 
@@ -162,8 +237,8 @@ VOLUNTEER_HOURS_REJECTED_TEMPLATE = """
 <div class="highlight">
     <h3>Submission Details:</h3>
     <ul>
-        <li><strong>Date:</strong> {{ hours_date }}</li>
-        <li><strong>Hours:</strong> {{ hours_count }} hours</li>
+        <li><strong>Date:</strong> {{ hours_date|localdate }}</li>
+        <li><strong>Hours:</strong> {{ hours_count|localnumber }} hours</li>
         <li><strong>Activity:</strong> {{ activity_description }}</li>
     </ul>
 </div>
@@ -204,9 +279,9 @@ TUTORING_SESSION_CONFIRMATION_TEMPLATE = """
     <h3>Session Details:</h3>
     <ul>
         <li><strong>Subject:</strong> {{ subject }}</li>
-        <li><strong>Date:</strong> {{ session_date }}</li>
+        <li><strong>Date:</strong> {{ session_date|localdate }}</li>
         <li><strong>Time:</strong> {{ session_time }}</li>
-        <li><strong>Duration:</strong> {{ duration }} minutes</li>
+        <li><strong>Duration:</strong> {{ duration|localnumber }} minutes</li>
         <li><strong>Tutor:</strong> {{ tutor_name }}</li>
     </ul>
 </div>
@@ -230,31 +305,159 @@ TUTORING_SESSION_CONFIRMATION_TEMPLATE = """
 {% endblock %}
 """
 
+TEMPLATE_MAP = {
+    'welcome': WELCOME_EMAIL_TEMPLATE,
+    'password_reset': PASSWORD_RESET_TEMPLATE,
+    'volunteer_hours_approved': VOLUNTEER_HOURS_APPROVED_TEMPLATE,
+    'volunteer_hours_rejected': VOLUNTEER_HOURS_REJECTED_TEMPLATE,
+    'tutoring_session_confirmation': TUTORING_SESSION_CONFIRMATION_TEMPLATE
+}
+
+# Optional HTML minification: "static" minifies template sources once at load time,
+# "full" additionally minifies every rendered message
+MINIFY_MODE = minify_mode()
+if MINIFY_MODE != MODE_OFF:
+    TEMPLATE_MAP = {name: minify_html(source, template_source=True) for name, source in TEMPLATE_MAP.items()}
+    app.jinja_env.loader = MinifyingLoader(app.jinja_env.loader, metrics=metrics)
+
+def finalize_html(html):
+    """Apply post-render minification and record the message size before and after"""
+    before = len(html.encode('utf-8'))
+    if MINIFY_MODE == MODE_FULL:
+        with stage('minify'):
+            html = minify_html(html)
+    metrics.observe('html_bytes', before, stage='rendered')
+    metrics.observe('html_bytes', len(html.encode('utf-8')), stage='sent')
+    return html
+
+# Default lane per template when the caller does not send a priority
+TEMPLATE_LANES = {
+    'password_reset': LANE_CRITICAL,
+    'welcome': LANE_TRANSACTIONAL,
+    'volunteer_hours_approved': LANE_TRANSACTIONAL,
+    'volunteer_hours_rejected': LANE_TRANSACTIONAL,
+    'tutoring_session_confirmation': LANE_TRANSACTIONAL
+}
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+LOGO_PATH = os.path.join(os.path.dirname(__file__), 'assets', 'novakinetix-logo.png')
+
+# Localized variants in templates/<locale>/<name>.html, negotiated with a fallback chain
+template_localizer = TemplateLocalizer.from_env(TEMPLATE_DIR)
+
+# Messages handed to the SMTP relay per connection when sending a batch
+BATCH_SEND_CHUNK = int(os.environ.get('BATCH_SEND_CHUNK', 50))
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+def get_render_pool():
+    """Create the batch render pool on first use so worker processes start after boot"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = RenderPool.from_env(TEMPLATE_MAP, TEMPLATE_DIR, logo=load_logo_bytes(),
+                                               minify=MINIFY_MODE, metrics=metrics, signer=dkim_signer)
+        return _render_pool
+
+def resolve_batch_template(name, locale=None):
+    """Batch jobs may name an in-module template or a file in templates/, in any locale"""
+    if name in TEMPLATE_MAP:
+        return (template_localizer.resolve(name, locale) if locale else None) or name
+    if name and os.path.exists(os.path.join(TEMPLATE_DIR, f'{name}.html')):
+        return (template_localizer.resolve(name, locale) if locale else None) or f'{name}.html'
+    return None
+
+_preview_cache = None
+_preview_cache_lock = threading.Lock()
+
+def get_preview_cache():
+    """Create the preview cache on first use; its version hashes every loaded template"""
+    global _preview_cache
+    with _preview_cache_lock:
+        if _preview_cache is None:
+            _preview_cache = PreviewCache(templates_version(TEMPLATE_MAP, TEMPLATE_DIR, salt=MINIFY_MODE),
+                                          max_entries=int(os.environ.get('PREVIEW_CACHE_SIZE', 64)),
+                                          metrics=metrics)
+        return _preview_cache
+
+_compiled_templates = {}
+
+def get_compiled_template(name, locale=None):
+    """Compile an in-module template once per negotiated locale; render_template_string
+    would recompile it per call"""
+    locale = locale or template_localizer.default_locale
+    key = (name, locale)
+    template = _compiled_templates.get(key)
+    if template is None and name in TEMPLATE_MAP:
+        localized = template_localizer.resolve(name, locale)
+        if localized:
+            template = app.jinja_env.get_template(localized)
+        else:
+            template = app.jinja_env.from_string(TEMPLATE_MAP[name])
+        _compiled_templates[key] = template
+    return template
+
+def render_compiled(template, data, locale=None):
+    """Render with the same context processors render_template_string would apply"""
+    context = dict(data)
+    context['locale'] = locale or template_localizer.default_locale
+    app.update_template_context(context)
+    return template.render(context)
+
+_logo_cache = {}
+
+def load_logo_bytes():
+    """Read the logo from disk once per process"""
+    if 'data' not in _logo_cache:
+        data = None
+        if os.path.exists(LOGO_PATH):
+            with open(LOGO_PATH, 'rb') as f:
+                data = f.read()
+        else:
+            logger.warning("Logo file not found at: %s", LOGO_PATH)
+        _logo_cache['data'] = data
+    return _logo_cache['data']
+
+def get_fanout_builder():
+    """Builder for single messages with attachments; the logo part is serialized once"""
+    if 'builder' not in _logo_cache:
+        logo = load_logo_bytes()
+        _logo_cache['builder'] = FanoutMessageBuilder([logo_part(logo)] if logo else [])
+    return _logo_cache['builder']
+
+def record_send(template, status, latency_ms=None, count=1):
+    """Add to the dashboard aggregates; a stats failure must never fail the send"""
+    try:
+        send_stats.record(template, status, latency_ms, count)
+    except Exception as e:
+        logger.warning("Could not record send stats: %s", e)
+
 def attach_logo_to_message(msg):
     """Attach the NOVAKINETIX ACADEMY logo to the email message"""
     try:
-        logo_path = os.path.join(os.path.dirname(__file__), 'assets', 'novakinetix-logo.png')
-        if os.path.exists(logo_path):
-            with open(logo_path, 'rb') as f:
-                logo_data = f.read()
-            
-            logo_attachment = MIMEImage(logo_data)
-            logo_attachment.add_header('Content-ID', '<novakinetix-logo>')
-            logo_attachment.add_header('Content-Disposition', 'inline', filename='novakinetix-logo.png')
-            msg.attach(logo_attachment)
-            logger.info("Logo attached successfully")
-        else:
-            logger.warning("Logo file not found at: %s", logo_path)
+        logo_data = load_logo_bytes()
+        if logo_data:
+            msg.attach('novakinetix-logo.png', 'image/png', logo_data, 'inline',
+                       headers=[('Content-ID', '<novakinetix-logo>')])
+            logger.info("Logo attached successfully", extra={'sampled': True})
     except Exception as e:
-        logger.error("Error attaching logo: %s", str(e))
+        logger.error("Error attaching logo: %s", e)
 
 class EmailService:
     def __init__(self, mail):
         self.mail = mail
         self.logger = logging.getLogger(__name__)
-        self.logo_base64 = self._load_logo()
+        self._logo_base64 = None
         self.email_queue = []
     
+    @property
+    def logo_base64(self):
+        """Encoded logo, read from disk on first use rather than at import"""
+        if self._logo_base64 is None:
+            self._logo_base64 = self._load_logo()
+        return self._logo_base64
+    
     def _load_logo(self):
         """Load and encode the logo for email templates"""
         try:
@@ -266,7 +469,7 @@ class EmailService:
                 self.logger.warning("Logo file not found, using placeholder")
                 return ""
         except Exception as e:
-            self.logger.error(f"Error loading logo: {str(e)}")
+            self.logger.error("Error loading logo: %s", e)
             return ""
     
     def _load_template(self, template_name):
@@ -277,10 +480,10 @@ class EmailService:
                 with open(template_path, 'r', encoding='utf-8') as template_file:
                     return template_file.read()
             else:
-                self.logger.error(f"Template {template_name} not found")
+                self.logger.error("Template %s not found", template_name)
                 return None
         except Exception as e:
-            self.logger.error(f"Error loading template {template_name}: {str(e)}")
+            self.logger.error("Error loading template %s: %s", template_name, e)
             return None
     
     def _render_template(self, template_name, data):
@@ -297,7 +500,7 @@ class EmailService:
             else:
                 return None
         except Exception as e:
-            self.logger.error(f"Error rendering template {template_name}: {str(e)}")
+            self.logger.error("Error rendering template %s: %s", template_name, e)
             return None
     
     def _validate_email(self, email):
@@ -327,6 +530,15 @@ class EmailService:
                 if not self._validate_email(email):
                     return {"success": False, "error": f"Invalid email address: {email}"}
             
+            # Drop suppressed recipients before rendering anything for them
+            suppressed = [email for email in recipients if suppression_list.is_suppressed(email)]
+            if suppressed:
+                metrics.incr('suppressed_total', value=len(suppressed), source='service')
+                recipients = [email for email in recipients if email not in suppressed]
+                if not recipients:
+                    return {"success": True, "message": "All recipients are suppressed; email not sent",
+                            "suppressed": suppressed}
+            
             # Sanitize inputs
             subject = self._sanitize_input(subject)
             
@@ -355,10 +567,16 @@ class EmailService:
                 msg.body = text_content
             
             # Send email
-            self.mail.send(msg)
+            send_started = time.perf_counter()
+            send_message(msg)
+            record_send(template or 'custom', 'sent', (time.perf_counter() - send_started) * 1000)
             
             # Log success
-            self.logger.info(f"Email sent successfully to {recipients}")
+            self.logger.info("Email sent successfully to %s", recipients, extra={
+                'sampled': True,
+                'template': template,
+                'send_ms': round((time.perf_counter() - send_started) * 1000, 2)
+            })
             
             # Add to queue for tracking
             self.email_queue.append({
@@ -372,7 +590,8 @@ class EmailService:
             return {"success": True, "message": "Email sent successfully"}
             
         except Exception as e:
-            self.logger.error(f"Error sending email: {str(e)}")
+            self.logger.error("Error sending email: %s", e)
+            record_send(template or 'custom', 'failed')
             return {"success": False, "error": str(e)}
     
     def _html_to_text(self, html_content):
@@ -392,7 +611,7 @@ class EmailService:
             text = re.sub(r'\s+', ' ', text).strip()
             return text
         except Exception as e:
-            self.logger.error(f"Error converting HTML to text: {str(e)}")
+            self.logger.error("Error converting HTML to text: %s", e)
             return ""
     
     def send_welcome_email(self, user_data):
@@ -476,6 +695,45 @@ class EmailService:
 # Initialize email service
 email_service = EmailService(mail)
 
+# Allocation tracing for the admin memory endpoint (off until started) and the long-lived
+# structures it reports on
+memory_tracer = MemoryTracer()
+memory_tracer.register('email_queue', lambda: len(email_service.email_queue))
+memory_tracer.register('compiled_templates', lambda: len(_compiled_templates))
+memory_tracer.register('preview_cache', lambda: len(_preview_cache) if _preview_cache is not None else 0)
+memory_tracer.register('attachment_memory_bytes', lambda: attachment_store.memory_used)
+memory_tracer.register('header_cache', lambda: encode_header_value.cache_info().currsize
+                       + encode_address.cache_info().currsize)
+memory_tracer.register('metrics_series', lambda: sum(len(series) for series in metrics.snapshot().values()))
+memory_tracer.register('archive_queue', lambda: message_archive.pending if message_archive is not None else 0)
+
+def warm_up():
+    """Compile every template and load shared assets now instead of on the first request"""
+    started = time.perf_counter()
+    with app.app_context():
+        for locale in template_localizer.locales:
+            for name in TEMPLATE_MAP:
+                get_compiled_template(name, locale)
+        app.jinja_env.get_template('base_email.html')
+    load_logo_bytes()
+    email_service.logo_base64  # first access reads and encodes the logo
+    suppression_list.load()
+    logger.info("Warm-up finished in %.1f ms", (time.perf_counter() - started) * 1000)
+
+def warm_app(preload=None):
+    """Warm up the module-level app and return it; gunicorn loads "app:warm_app()".
+
+    The app and its services (relay pool, suppression list, outbox poller, ...) are built
+    once at import, so every call returns the same app. With --preload this runs once in
+    the master, so compiled templates and the encoded logo are built before forking and
+    shared copy-on-write by every worker. Set PRELOAD_ASSETS=false to leave everything lazy.
+    """
+    if preload is None:
+        preload = os.environ.get('PRELOAD_ASSETS', 'true').lower() == 'true'
+    if preload:
+        warm_up()
+    return app
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -486,7 +744,22 @@ def health_check():
         'version': '1.0.0'
     })
 
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness endpoint: relay pool health when MAIL_RELAYS is set, otherwise the cached
+    SMTP connectivity probe"""
+    smtp = relay_pool.status() if relay_pool is not None else smtp_probe.status()
+    return jsonify({
+        'status': 'ready' if smtp['ok'] else 'not_ready',
+        'smtp': smtp,
+        'timestamp': datetime.utcnow().isoformat()
+    }), 200 if smtp['ok'] else 503
+
+def _send_email_lane(data):
+    return resolve_lane(data.get('priority'), TEMPLATE_LANES.get(data.get('template'), LANE_TRANSACTIONAL))
+
 @app.route('/api/send-email', methods=['POST'])
+@admission.guard(_send_email_lane)
 def send_email():
     """Send email endpoint"""
     try:
@@ -500,43 +773,15 @@ def send_email():
             if field not in data:
                 return jsonify({'error': f'Missing required field: {field}'}), 400
         
-        # Get template
-        template_map = {
-            'welcome': WELCOME_EMAIL_TEMPLATE,
-            'password_reset': PASSWORD_RESET_TEMPLATE,
-            'volunteer_hours_approved': VOLUNTEER_HOURS_APPROVED_TEMPLATE,
-            'volunteer_hours_rejected': VOLUNTEER_HOURS_REJECTED_TEMPLATE,
-            'tutoring_session_confirmation': TUTORING_SESSION_CONFIRMATION_TEMPLATE
-        }
-        
-        template = template_map.get(data['template'])
-        if not template:
-            return jsonify({'error': f'Invalid template: {data["template"]}'}), 400
-        
-        # Render email content
-        html_content = render_template_string(template, **data['template_data'])
-        
-        # Create message
-        msg = Message(
-            subject=data['subject'],
-            recipients=[data['to']],
-            html=html_content
-        )
-        
-        # Attach logo
-        attach_logo_to_message(msg)
-        
-        # Send email
-        mail.send(msg)
-        
-        logger.info(f"Email sent successfully to {data['to']}")
-        return jsonify({'message': 'Email sent successfully'}), 200
+        # Callers may override the template's default lane with "priority"
+        return send_email_internal(data)
         
     except Exception as e:
-        logger.error(f"Error sending email: {str(e)}")
+        logger.error("Error sending email: %s", e)
         return jsonify({'error': 'Failed to send email'}), 500
 
 @app.route('/api/send-welcome-email', methods=['POST'])
+@admission.guard(LANE_TRANSACTIONAL)
 def send_welcome_email():
     """Send welcome email"""
     try:
@@ -554,18 +799,20 @@ def send_welcome_email():
         
         email_data = {
             'to': data['email'],
-            'subject': 'Welcome to NOVAKINETIX ACADEMY!',
+            'subject': template_localizer.subject('welcome', data.get('locale')),
             'template': 'welcome',
-            'template_data': template_data
+            'template_data': template_data,
+            'locale': data.get('locale')
         }
         
-        return send_email_internal(email_data)
+        return send_email_internal(email_data, lane=LANE_TRANSACTIONAL)
         
     except Exception as e:
-        logger.error(f"Error sending welcome email: {str(e)}")
+        logger.error("Error sending welcome email: %s", e)
         return jsonify({'error': 'Failed to send welcome email'}), 500
 
 @app.route('/api/send-password-reset', methods=['POST'])
+@admission.guard(LANE_CRITICAL)
 def send_password_reset():
     """Send password reset email"""
     try:
@@ -582,55 +829,632 @@ def send_password_reset():
         
         email_data = {
             'to': data['email'],
-            'subject': 'Reset Your NOVAKINETIX ACADEMY Password',
+            'subject': template_localizer.subject('password_reset', data.get('locale')),
             'template': 'password_reset',
-            'template_data': template_data
+            'template_data': template_data,
+            'locale': data.get('locale')
         }
         
-        return send_email_internal(email_data)
+        return send_email_internal(email_data, lane=LANE_CRITICAL)
         
     except Exception as e:
-        logger.error(f"Error sending password reset email: {str(e)}")
+        logger.error("Error sending password reset email: %s", e)
         return jsonify({'error': 'Failed to send password reset email'}), 500
 
-def send_email_internal(email_data):
+def deliver_message(msg, lane=LANE_TRANSACTIONAL):
+    """Hand a message to the SMTP relay through its priority lane"""
+    return lane_scheduler.run(lane, request_profiler.wrap(_send_in_app_context), msg)
+
+def _send_in_app_context(msg):
+    """Lane workers run outside the request, so push an app context for Flask-Mail"""
+    started = time.perf_counter()
+    try:
+        with app.app_context():
+            send_message(msg)
+    except Exception:
+        lane_scheduler.record_delivery(time.perf_counter() - started, errors=1)
+        raise
+    lane_scheduler.record_delivery(time.perf_counter() - started)
+
+def send_message(msg):
+    """Send a Flask-Mail message through the relay pool, DKIM-signed when configured"""
+    if mail.state.suppress or (relay_pool is None and dkim_signer is None and message_archive is None):
+        mail.send(msg)
+        return
+    # mail.send checks this itself; the serialized path has to as well
+    if msg.has_bad_headers():
+        raise BadHeaderError('Header values must not contain line breaks')
+    if msg.date is None:
+        msg.date = time.time()
+    payload = msg.as_bytes()
+    if dkim_signer is not None:
+        payload = dkim_signer.sign(payload)
+    envelope_from = sanitize_address(msg.sender)
+    recipients = list(sanitize_addresses(msg.send_to))
+    if relay_pool is not None:
+        relay_pool.send(envelope_from, recipients, payload)
+    else:
+        with mail.connect() as conn:
+            conn.host.sendmail(envelope_from, recipients, payload)
+    if message_archive is not None:
+        message_archive.archive(recipients, payload)
+
+def check_send_limits(to, idempotency_key):
+    """Apply the dedupe window and recipient throttle; returns (response, claimed_key)"""
+    claimed_key = None
+    if idempotency_key:
+        claimed_key = f'idempotency:{idempotency_key}'
+        if not shared_state.add(claimed_key, ttl=IDEMPOTENCY_TTL):
+            metrics.incr('send_rejected_total', reason='duplicate')
+            return (jsonify({'message': 'Duplicate request; email already sent', 'duplicate': True}), 200), None
+    
+    if RECIPIENT_RATE_LIMIT:
+        limit, window = RECIPIENT_RATE_LIMIT
+        key = f'recipient:{to.strip().lower()}'
+        if shared_state.incr(key, ttl=window) > limit:
+            if claimed_key:
+                shared_state.delete(claimed_key)
+            metrics.incr('send_rejected_total', reason='recipient_rate')
+            retry_after = math.ceil(shared_state.ttl(key) or window)
+            response = jsonify({'error': 'Too many emails to this recipient', 'retry_after': retry_after})
+            return (response, 429, {'Retry-After': str(retry_after)}), None
+    return None, claimed_key
+
+def send_email_internal(email_data, lane=None):
     """Internal function to send email"""
+    claimed_key = None
+    template_name = None
     try:
-        # Get template
-        template_map = {
-            'welcome': WELCOME_EMAIL_TEMPLATE,
-            'password_reset': PASSWORD_RESET_TEMPLATE,
-            'volunteer_hours_approved': VOLUNTEER_HOURS_APPROVED_TEMPLATE,
-            'volunteer_hours_rejected': VOLUNTEER_HOURS_REJECTED_TEMPLATE,
-            'tutoring_session_confirmation': TUTORING_SESSION_CONFIRMATION_TEMPLATE
-        }
-        
-        template = template_map.get(email_data['template'])
+        started = time.perf_counter()
+        locale = template_localizer.negotiate(email_data.get('locale'))
+        template = get_compiled_template(email_data['template'], locale)
         if not template:
             return jsonify({'error': f'Invalid template: {email_data["template"]}'}), 400
+        template_name = email_data['template']
         
-        # Render email content
-        html_content = render_template_string(template, **email_data['template_data'])
+        if lane is None:
+            lane = resolve_lane(email_data.get('priority'),
+                                TEMPLATE_LANES.get(email_data['template'], LANE_TRANSACTIONAL))
         
-        # Create message
-        msg = Message(
-            subject=email_data['subject'],
-            recipients=[email_data['to']],
-            html=html_content
-        )
+        with stage('validate'):
+            valid = email_service._validate_email(email_data['to'])
+        if not valid:
+            return jsonify({'error': f'Invalid email address: {email_data["to"]}'}), 400
+        if has_line_break(email_data['to'], email_data['subject']):
+            return jsonify({'error': 'Header values must not contain line breaks'}), 400
         
-        # Attach logo
-        attach_logo_to_message(msg)
+        with stage('suppression'):
+            suppressed = suppression_list.is_suppressed(email_data['to'])
+        if suppressed:
+            metrics.incr('suppressed_total', source='send')
+            record_send(template_name, 'suppressed')
+            logger.info("Skipped suppressed recipient %s", email_data['to'], extra={'sampled': True})
+            return jsonify({'message': 'Recipient is suppressed; email not sent', 'suppressed': True}), 200
         
-        # Send email
-        mail.send(msg)
+        if email_data.get('attachments'):
+            try:
+                with stage('attachments'):
+                    attachments = attachment_store.parts(email_data['attachments'])
+            except AttachmentError as e:
+                return jsonify({'error': str(e)}), 400
+        else:
+            attachments = []
+        
+        idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+        if idempotency_key or RECIPIENT_RATE_LIMIT:
+            with stage('limits'):
+                rejected, claimed_key = check_send_limits(email_data['to'], idempotency_key)
+            if rejected:
+                record_send(template_name, 'rejected')
+                return rejected
         
-        logger.info(f"Email sent successfully to {email_data['to']}")
+        # Render email content
+        with stage('render'):
+            html_content = render_compiled(template, email_data['template_data'], locale)
+        html_content = finalize_html(html_content)
+        
+        if attachments:
+            # Streamed from the encoded-attachment cache rather than built by Flask-Mail
+            sender = _default_sender()
+            boundary = new_boundary()
+            msg = StreamedMessage(get_fanout_builder().build(sender, email_data['to'], email_data['subject'],
+                                                             html_content, mixed_boundary=boundary),
+                                  boundary, attachments)
+            if dkim_signer is not None:
+                msg = dkim_signer.sign(msg)
+            rendered_at = time.perf_counter()
+            with stage('smtp'):
+                failures = lane_scheduler.run(lane, request_profiler.wrap(_send_raw_chunk), sender,
+                                              [(email_data['to'], msg)])
+            if failures:
+                raise RuntimeError(failures[0]['error'])
+            finished = time.perf_counter()
+        else:
+            # Create message
+            msg = Message(
+                subject=email_data['subject'],
+                recipients=[email_data['to']],
+                html=html_content
+            )
+            
+            # Attach logo
+            with stage('logo'):
+                attach_logo_to_message(msg)
+            
+            # Send email
+            rendered_at = time.perf_counter()
+            with stage('smtp'):
+                deliver_message(msg, lane)
+            finished = time.perf_counter()
+        
+        record_send(template_name, 'sent', (finished - started) * 1000)
+        logger.info("Email sent successfully to %s", email_data['to'], extra={
+            'sampled': True,
+            'template': email_data['template'],
+            'lane': lane,
+            'attachments': len(attachments),
+            'render_ms': round((rendered_at - started) * 1000, 2),
+            'send_ms': round((finished - rendered_at) * 1000, 2),
+            'duration_ms': round((finished - started) * 1000, 2)
+        })
         return jsonify({'message': 'Email sent successfully'}), 200
         
     except Exception as e:
-        logger.error(f"Error sending email: {str(e)}")
+        logger.error("Error sending email: %s", e)
+        if template_name:
+            record_send(template_name, 'failed')
+        if claimed_key:
+            # Nothing was sent, so a retry with the same key must be allowed through
+            shared_state.delete(claimed_key)
         return jsonify({'error': 'Failed to send email'}), 500
 
+def _default_sender():
+    sender = mail.default_sender
+    if isinstance(sender, tuple):
+        return formataddr(sender)
+    return sender
+
+def _send_raw_chunk(sender, rendered):
+    """Send pre-serialized messages over one SMTP connection, returning the failures.
+
+    Never raises: an error that escapes the send fails every message of this chunk only.
+    """
+    started = time.perf_counter()
+    errors = len(rendered)
+    try:
+        try:
+            failed = _send_raw_messages(sender, rendered)
+        except Exception as e:
+            logger.error("Error sending batch chunk: %s", e)
+            return [{'to': to, 'error': str(e)} for to, _ in rendered]
+        errors = len(failed)
+        if message_archive is not None and not mail.state.suppress:
+            _archive_sent(rendered, failed)
+        return failed
+    finally:
+        if rendered:
+            latency = (time.perf_counter() - started) / len(rendered)
+            lane_scheduler.record_delivery(latency, len(rendered), errors)
+
+def _archive_sent(rendered, failed):
+    unsent = [failure['to'] for failure in failed]
+    for to, payload in rendered:
+        if to in unsent:
+            unsent.remove(to)
+        else:
+            message_archive.archive(to, payload)
+
+def _send_raw_messages(sender, rendered):
+    failed = []
+    envelope_from = parseaddr(sender)[1]
+    if relay_pool is not None and not mail.state.suppress:
+        return relay_pool.send_many(envelope_from, rendered)
+    attempted = 0
+    try:
+        with app.app_context():
+            with mail.connect() as conn:
+                for to, payload in rendered:
+                    attempted += 1
+                    try:
+                        if conn.host:
+                            send_payload(conn.host, envelope_from, [to], payload)
+                    except Exception as e:
+                        failed.append({'to': to, 'error': str(e)})
+    except (OSError, smtplib.SMTPException) as e:
+        # Connecting or QUIT failed; messages the server already accepted stay sent
+        failed.extend({'to': to, 'error': str(e)} for to, _ in rendered[attempted:])
+    return failed
+
+def deliver_batch(items, sender, lane, defaults=None, attachments=(), boundary=None):
+    """Validate, render and send templated messages; returns one {'to', 'status', 'error'}
+    per item, in order, with status 'sent', 'failed', 'suppressed' or 'invalid' (rejected
+    before rendering)"""
+    started = time.perf_counter()
+    defaults = defaults or {}
+    results = [None] * len(items)
+    jobs = []
+    job_items = []
+    outcomes = Counter()
+    with stage('validate'):
+        for index, item in enumerate(items):
+            to = item.get('to')
+            name = item.get('template', defaults.get('template'))
+            subject = item.get('subject', defaults.get('subject'))
+            locale = template_localizer.negotiate(item.get('locale', defaults.get('locale')))
+            template = resolve_batch_template(name, locale)
+            if not to or not email_service._validate_email(to):
+                results[index] = {'to': to, 'status': 'invalid', 'error': 'Invalid email address'}
+            elif has_line_break(to, subject):
+                results[index] = {'to': to, 'status': 'invalid', 'error': 'Header values must not contain line breaks'}
+            elif suppression_list.is_suppressed(to):
+                results[index] = {'to': to, 'status': 'suppressed', 'error': None}
+                if template:
+                    outcomes[name, 'suppressed'] += 1
+            elif not subject or not template:
+                results[index] = {'to': to, 'status': 'invalid', 'error': 'Missing subject or unknown template'}
+            else:
+                jobs.append({
+                    'sender': sender,
+                    'to': to,
+                    'subject': subject,
+                    'template': template,
+                    'template_data': item.get('template_data', defaults.get('template_data', {})),
+                    'locale': locale,
+                    'mixed_boundary': boundary,
+                    'attachments': attachments if dkim_signer is not None else None
+                })
+                job_items.append((index, name))
+    suppressed = sum(1 for result in results if result and result['status'] == 'suppressed')
+    if suppressed:
+        metrics.incr('suppressed_total', value=suppressed, source='batch')
+    
+    # Render across the process pool, then hand chunks of bytes to the lane workers
+    render_started = time.perf_counter()
+    rendered = []
+    rendered_items = []
+    with stage('render'):
+        rendered_jobs = get_render_pool().render(jobs)
+    for (to, payload, error), (index, name) in zip(rendered_jobs, job_items):
+        if error:
+            results[index] = {'to': to, 'status': 'failed', 'error': error}
+            outcomes[name, 'failed'] += 1
+            continue
+        rendered.append((to, StreamedMessage(payload, boundary, attachments) if attachments else payload))
+        rendered_items.append((index, name))
+    
+    send_started = time.perf_counter()
+    with stage('smtp'):
+        chunks = list(zip(chunked(rendered, BATCH_SEND_CHUNK), chunked(rendered_items, BATCH_SEND_CHUNK)))
+        send_chunk = request_profiler.wrap(_send_raw_chunk)
+        futures = [lane_scheduler.submit(lane, send_chunk, sender, chunk) for chunk, _ in chunks]
+        for future, (chunk, chunk_items) in zip(futures, chunks):
+            # Failures are reported by address; repeated addresses are matched in order
+            try:
+                failures = future.result()
+            except Exception as e:
+                failures = [{'to': to, 'error': str(e)} for to, _ in chunk]
+            unmatched = {}
+            for failure in failures:
+                unmatched.setdefault(failure['to'], []).append(failure['error'])
+            for (to, _), (index, name) in zip(chunk, chunk_items):
+                if unmatched.get(to):
+                    results[index] = {'to': to, 'status': 'failed', 'error': unmatched[to].pop(0)}
+                    outcomes[name, 'failed'] += 1
+                else:
+                    results[index] = {'to': to, 'status': 'sent', 'error': None}
+                    outcomes[name, 'sent'] += 1
+    finished = time.perf_counter()
+    
+    for (name, status), count in outcomes.items():
+        record_send(name, status, count=count)
+    counts = Counter(result['status'] for result in results)
+    logger.info("Batch processed: %d sent, %d failed, %d suppressed",
+                counts['sent'], counts['failed'] + counts['invalid'], counts['suppressed'], extra={
+        'lane': lane,
+        'render_ms': round((send_started - render_started) * 1000, 2),
+        'send_ms': round((finished - send_started) * 1000, 2),
+        'duration_ms': round((finished - started) * 1000, 2)
+    })
+    return results
+
+def deliver_outbox(messages):
+    """Send a batch of claimed outbox rows, one deliver_batch per priority lane.
+
+    Raises only before anything is sent; afterwards every row gets its own result, and an
+    error in one lane fails that lane's rows without touching rows already delivered.
+    """
+    sender = _default_sender()
+    if not sender:
+        raise RuntimeError('No default sender configured')
+    results = [None] * len(messages)
+    by_lane = {}
+    for index, message in enumerate(messages):
+        by_lane.setdefault(resolve_lane(message.get('priority'), LANE_BULK), []).append(index)
+    with app.app_context():
+        for lane, indices in by_lane.items():
+            try:
+                delivered = deliver_batch([messages[index] for index in indices], sender, lane)
+            except Exception as e:
+                logger.error("Error delivering outbox rows: %s", e, extra={'lane': lane})
+                delivered = [{'to': messages[index].get('to'), 'status': 'failed', 'error': str(e)}
+                             for index in indices]
+            for index, result in zip(indices, delivered):
+                results[index] = result
+    return results
+
+# Outbox pull mode when OUTBOX_DSN is set (None otherwise); started in each worker by the
+# gunicorn post_worker_init hook
+outbox_poller = OutboxPoller.from_env(deliver_outbox, metrics=metrics)
+
+@app.route('/api/send-batch', methods=['POST'])
+@admission.guard(lambda data: resolve_lane(data.get('priority'), LANE_BULK))
+def send_batch():
+    """Render and send a personalized batch of templated emails"""
+    try:
+        data = request.get_json()
+        
+        if not data or not data.get('messages'):
+            return jsonify({'error': 'No messages provided'}), 400
+        if has_line_break(data.get('subject')):
+            return jsonify({'error': 'Header values must not contain line breaks'}), 400
+        
+        sender = _default_sender()
+        if not sender:
+            return jsonify({'error': 'No default sender configured'}), 500
+        
+        # Attachments are shared by every message in the batch, so they are encoded once
+        boundary = None
+        attachments = []
+        if data.get('attachments'):
+            try:
+                with stage('attachments'):
+                    attachments = attachment_store.parts(data['attachments'])
+            except AttachmentError as e:
+                return jsonify({'error': str(e)}), 400
+            boundary = new_boundary()
+        
+        lane = resolve_lane(data.get('priority'), LANE_BULK)
+        results = deliver_batch(data['messages'], sender, lane, defaults=data,
+                                attachments=attachments, boundary=boundary)
+        sent = sum(1 for result in results if result['status'] == 'sent')
+        failed = [{'to': result['to'], 'error': result['error']} for result in results
+                  if result['status'] in ('failed', 'invalid')]
+        suppressed = [result['to'] for result in results if result['status'] == 'suppressed']
+        return jsonify({'message': 'Batch processed', 'sent': sent, 'failed': failed,
+                        'suppressed': suppressed}), 200
+        
+    except Exception as e:
+        logger.error("Error sending batch: %s", e)
+        return jsonify({'error': 'Failed to send batch'}), 500
+
+@app.route('/api/attachments', methods=['POST'])
+@admin_required
+def upload_attachment():
+    """Store the raw request body as an attachment, returning the id to send it by"""
+    try:
+        attachment_id, size = attachment_store.save_stream(request.stream)
+    except AttachmentError as e:
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        logger.error("Error storing attachment: %s", e)
+        return jsonify({'error': 'Failed to store attachment'}), 500
+    if not size:
+        return jsonify({'error': 'Empty attachment'}), 400
+    return jsonify({'message': 'Attachment stored', 'id': attachment_id, 'size': size})
+
+@app.route('/api/suppressions', methods=['POST'])
+@admin_required
+def add_suppressions():
+    """Bulk-add addresses to the suppression list"""
+    data = request.get_json(silent=True) or {}
+    emails = data.get('emails')
+    if not isinstance(emails, list) or not emails:
+        return jsonify({'error': 'emails must be a non-empty list'}), 400
+    
+    invalid = [email for email in emails
+               if not isinstance(email, str) or not email_service._validate_email(email.strip())]
+    if invalid:
+        return jsonify({'error': 'Invalid email addresses', 'invalid': invalid[:100]}), 400
+    
+    added = suppression_list.add_many(emails, reason=data.get('reason'))
+    logger.info("Added %d suppressed addresses", added, extra={'reason': data.get('reason')})
+    return jsonify({'message': 'Suppressions added', 'added': added, 'total': suppression_list.count()})
+
+@app.route('/api/suppressions/<path:email>', methods=['GET'])
+@admin_required
+def get_suppression(email):
+    """Check whether one address is suppressed"""
+    return jsonify({'email': email, 'suppressed': suppression_list.is_suppressed(email)})
+
+@app.route('/api/suppressions/<path:email>', methods=['DELETE'])
+@admin_required
+def remove_suppression(email):
+    """Lift the suppression for one address"""
+    if not suppression_list.remove(email):
+        return jsonify({'error': 'Address is not suppressed'}), 404
+    return jsonify({'message': 'Suppression removed', 'email': email})
+
+@app.route('/admin/bounces/ingest', methods=['POST'])
+@admin_required
+def ingest_bounces():
+    """Process DSNs that arrived since the last pass"""
+    if bounce_ingestor is None:
+        return jsonify({'error': 'Bounce ingestion is not configured'}), 404
+    try:
+        processed = bounce_ingestor.ingest()
+    except Exception as e:
+        logger.error("Error ingesting bounces: %s", e)
+        return jsonify({'error': 'Failed to ingest bounces'}), 500
+    return jsonify({'message': 'Bounces ingested', 'processed': processed})
+
+@app.route('/api/delivery-status/<path:email>', methods=['GET'])
+@admin_required
+def get_delivery_status(email):
+    """Latest DSN outcome and bounce counts for one recipient"""
+    if bounce_ingestor is None:
+        return jsonify({'error': 'Bounce ingestion is not configured'}), 404
+    status = bounce_ingestor.store.get(email)
+    if status is None:
+        return jsonify({'error': 'No delivery status recorded'}), 404
+    return jsonify(status)
+
+@app.route('/api/archive', methods=['GET'])
+@admin_required
+def find_archived():
+    """Archived messages sent to one recipient, newest first"""
+    if message_archive is None:
+        return jsonify({'error': 'Message archive is not configured'}), 404
+    to = request.args.get('to')
+    if not to:
+        return jsonify({'error': 'Missing "to" parameter'}), 400
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({'to': to, 'messages': message_archive.find(to, limit=limit)})
+
+@app.route('/api/archive/<path:message_id>', methods=['GET'])
+@admin_required
+def get_archived(message_id):
+    """One archived message, exactly as it was sent"""
+    if message_archive is None:
+        return jsonify({'error': 'Message archive is not configured'}), 404
+    record = message_archive.get(message_id)
+    if record is None:
+        return jsonify({'error': 'Message not found in archive'}), 404
+    return app.response_class(record['message'], mimetype='message/rfc822', headers={
+        'X-Archived-At': datetime.fromtimestamp(record['sent_at']).isoformat()
+    })
+
+@app.route('/api/stats', methods=['GET'])
+@admin_required
+def get_send_stats():
+    """Send counts per template, status, hour and day, with latency quantiles"""
+    try:
+        return jsonify(send_stats.snapshot())
+    except Exception as e:
+        logger.error("Error reading send stats: %s", e)
+        return jsonify({'error': 'Failed to read send stats'}), 500
+
+@app.route('/api/preview/<template>', methods=['GET'])
+@admin_required
+def preview_template(template):
+    """Render a template with sample data, overridden by ?data=<json>, as it would be sent"""
+    if template not in TEMPLATE_MAP:
+        return jsonify({'error': f'Invalid template: {template}'}), 404
+    try:
+        supplied = json.loads(request.args.get('data') or '{}')
+    except ValueError:
+        return jsonify({'error': 'data must be a JSON object'}), 400
+    if not isinstance(supplied, dict):
+        return jsonify({'error': 'data must be a JSON object'}), 400
+    
+    locale = template_localizer.negotiate(request.args.get('locale'))
+    data = dict(SAMPLE_DATA.get(template, {}), **supplied)
+    cache = get_preview_cache()
+    etag = cache.etag(template, locale, data)
+    if request.if_none_match.contains(etag):
+        cache.record_not_modified()
+        response = app.response_class(status=304)
+    else:
+        html = cache.get(etag)
+        if html is None:
+            try:
+                html = render_compiled(get_compiled_template(template, locale), data, locale)
+            except Exception as e:
+                logger.error("Error rendering preview of %s: %s", template, e)
+                return jsonify({'error': 'Failed to render preview'}), 500
+            if MINIFY_MODE == MODE_FULL:
+                html = minify_html(html)
+            # Browsers cannot resolve the cid: reference, so inline the logo
+            html = html.replace('cid:novakinetix-logo', f'data:image/png;base64,{email_service.logo_base64}')
+            cache.put(etag, html)
+        response = app.response_class(html, mimetype='text/html')
+    response.set_etag(etag)
+    # Cache privately but revalidate every time, so template deploys show up at once
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/admin/profile', methods=['POST'])
+@admin_required
+def arm_profiler():
+    """Profile the next N send requests with cProfile or stack sampling.
+
+    cProfile covers the request thread and the lane jobs it submits (SMTP sends), not the
+    render process pool or other background threads; "sample" mode sees the request and
+    every lane worker.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        request_profiler.arm(
+            data.get('mode', 'cprofile'),
+            int(data.get('requests', 10)),
+            interval_ms=float(data.get('interval_ms', 5))
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'message': 'Profiler armed', 'mode': request_profiler.mode,
+                    'requests': request_profiler.remaining})
+
+@app.route('/admin/profile', methods=['GET'])
+@admin_required
+def get_profile():
+    """Aggregated profile of the requests captured so far"""
+    limit = request.args.get('limit', 30, type=int)
+    return jsonify(request_profiler.report(limit=limit))
+
+@app.route('/admin/profile', methods=['DELETE'])
+@admin_required
+def reset_profiler():
+    """Disarm the profiler and discard collected data"""
+    request_profiler.reset()
+    return jsonify({'message': 'Profiler reset'})
+
+@app.route('/admin/memory', methods=['POST'])
+@admin_required
+def start_memory_trace():
+    """Start tracemalloc and take the baseline snapshot"""
+    data = request.get_json(silent=True) or {}
+    try:
+        frames = int(data.get('frames', 1))
+        memory_tracer.start(frames)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'message': 'Memory tracing started', 'frames': frames, 'pid': os.getpid()})
+
+@app.route('/admin/memory', methods=['GET'])
+@admin_required
+def get_memory_report():
+    """Top allocation sites by growth between snapshots, plus sizes of internal structures"""
+    try:
+        report = memory_tracer.report(
+            limit=request.args.get('limit', 20, type=int),
+            group_by=request.args.get('group_by', 'lineno'),
+            since=request.args.get('since', 'last')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(report)
+
+@app.route('/admin/memory', methods=['DELETE'])
+@admin_required
+def stop_memory_trace():
+    """Stop tracemalloc and discard its snapshots"""
+    memory_tracer.stop()
+    return jsonify({'message': 'Memory tracing stopped', 'pid': os.getpid()})
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Service metrics, including per-lane queue depth and latency and relay health"""
+    snapshot = metrics.snapshot()
+    snapshot['lanes'] = lane_scheduler.stats()
+    snapshot['admission'] = admission.stats()
+    if lane_scheduler.limiter is not None:
+        snapshot['concurrency'] = lane_scheduler.limiter.stats()
+    if relay_pool is not None:
+        snapshot['relays'] = relay_pool.stats()
+    return jsonify(snapshot)
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=False) 
\ No newline at end of file
+    if outbox_poller is not None:
+        outbox_poller.start()
+    if relay_pool is None:
+        smtp_probe.start()
+    warm_app().run(host='0.0.0.0', port=5000, debug=False) 
\ No newline at end of file
@@ -0,0 +1,296 @@
+"""
+Archive of sent messages, for compliance and support ("what exactly did this student get?").
+Every message accepted by the relay is queued and appended by a background thread to the
+current segment file as its own compressed frame: a zstd frame when the zstandard package is
+installed, a gzip member otherwise. A segment therefore stays a valid .zst/.gz file that
+zstdcat/zcat can read, and rotates once it reaches segment_bytes. Segment names include the
+host and pid, so gunicorn workers never append to the same file.
+
+An SQLite index next to the segments maps each message ID and recipient to (segment, offset,
+length). Recipients are stored as 64-bit hashes, which keeps the index small and keeps
+addresses out of it. A lookup reads and decompresses only that one frame. Sending only pays
+for a queue put: the message is serialized, compressed and written by the archive thread,
+and the index rows for each drained batch go in with one transaction. If the queue is full,
+the message is dropped and counted, so a slow disk cannot hold up delivery.
+"""
+
+import os
+import re
+import gzip
+import json
+import time
+import queue
+import socket
+import sqlite3
+import hashlib
+import logging
+import threading
+from email.utils import make_msgid
+
+try:
+    import zstandard
+except ImportError:  # gzip is used instead
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_LIMIT = 50
+
+# Most queued messages written per index transaction
+WRITE_BATCH = 256
+
+CODECS = ('zstd', 'gzip')
+EXTENSIONS = {'zstd': '.zst', 'gzip': '.gz'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS archived (
+    message_id TEXT NOT NULL,
+    recipient_key INTEGER NOT NULL,
+    segment_id INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    sent_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS archived_message ON archived (message_id);
+CREATE INDEX IF NOT EXISTS archived_recipient ON archived (recipient_key, sent_at);
+"""
+
+_MESSAGE_ID = re.compile(rb'^Message-ID:[ \t]*(.+?)[ \t]*\r?$', re.IGNORECASE | re.MULTILINE)
+
+
+def recipient_key(address):
+    """Signed 64-bit hash of a normalized address (fits an SQLite INTEGER)"""
+    digest = hashlib.blake2b(address.strip().lower().encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def normalize_message_id(message_id):
+    return message_id.strip().strip('<>')
+
+
+def message_id_of(payload):
+    """Message-ID from the header block of serialized message bytes, or None"""
+    end = payload.find(b'\r\n\r\n')
+    if end < 0:
+        end = payload.find(b'\n\n')
+    match = _MESSAGE_ID.search(payload, 0, end if end >= 0 else len(payload))
+    return normalize_message_id(match.group(1).decode('ascii', 'replace')) if match else None
+
+
+def compress(codec, data):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def decompress(codec, frame):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Reading .zst segments needs the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(frame)
+    return gzip.decompress(frame)
+
+
+def codec_of(segment_name):
+    return 'zstd' if segment_name.endswith(EXTENSIONS['zstd']) else 'gzip'
+
+
+class MessageArchive:
+    """Appends sent messages to compressed segments and looks them up by ID or recipient"""
+
+    def __init__(self, directory, codec=None, segment_bytes=DEFAULT_SEGMENT_BYTES,
+                 queue_size=DEFAULT_QUEUE_SIZE, metrics=None):
+        codec = codec or ('zstd' if zstandard is not None else 'gzip')
+        if codec not in CODECS:
+            raise ValueError(f"Unknown archive codec: {codec}")
+        if codec == 'zstd' and zstandard is None:
+            raise RuntimeError("ARCHIVE_CODEC=zstd needs the zstandard package")
+        self.directory = directory
+        self.codec = codec
+        self.segment_bytes = segment_bytes
+        self.metrics = metrics
+        self.index_path = os.path.join(directory, 'index.sqlite3')
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._segment = None
+        self._segment_id = None
+        self._segment_size = 0
+        self._sequence = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, metrics=None):
+        """Build from ARCHIVE_DIR, ARCHIVE_CODEC, ARCHIVE_SEGMENT_BYTES and ARCHIVE_QUEUE_SIZE
+        (None when ARCHIVE_DIR is not set)"""
+        directory = os.environ.get('ARCHIVE_DIR')
+        if not directory:
+            return None
+        return cls(
+            directory,
+            codec=os.environ.get('ARCHIVE_CODEC') or None,
+            segment_bytes=int(os.environ.get('ARCHIVE_SEGMENT_BYTES', DEFAULT_SEGMENT_BYTES)),
+            queue_size=int(os.environ.get('ARCHIVE_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)),
+            metrics=metrics
+        )
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def archive(self, recipients, message, sent_at=None):
+        """Queue a sent message (bytes or anything with as_bytes()); never blocks.
+        Returns False if the queue was full and the message was dropped."""
+        if isinstance(recipients, str):
+            recipients = [recipients]
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((list(recipients), message, sent_at or time.time()))
+        except queue.Full:
+            self._record('dropped')
+            return False
+        return True
+
+    @property
+    def pending(self):
+        """Messages queued and not yet written"""
+        return self._queue.qsize()
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is written and indexed; False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def get(self, message_id):
+        """The archived message with this Message-ID, as {'message_id', 'recipients',
+        'sent_at', 'message'}, or None"""
+        row = self.connection().execute(
+            'SELECT s.name, a.offset, a.length FROM archived a JOIN segments s ON s.id = a.segment_id '
+            'WHERE a.message_id = ? ORDER BY a.sent_at DESC LIMIT 1',
+            (normalize_message_id(message_id),)).fetchone()
+        if row is None:
+            return None
+        name, offset, length = row
+        with open(os.path.join(self.directory, name), 'rb') as f:
+            f.seek(offset)
+            frame = f.read(length)
+        header, _, message = decompress(codec_of(name), frame).partition(b'\n')
+        record = json.loads(header)
+        record['message'] = message
+        return record
+
+    def find(self, recipient, limit=DEFAULT_LIMIT):
+        """Newest archived messages to a recipient, as [{'message_id', 'sent_at'}]"""
+        rows = self.connection().execute(
+            'SELECT message_id, sent_at FROM archived WHERE recipient_key = ? ORDER BY sent_at DESC LIMIT ?',
+            (recipient_key(recipient), limit)).fetchall()
+        return [{'message_id': message_id, 'sent_at': sent_at} for message_id, sent_at in rows]
+
+    def close(self):
+        """Write what is queued, stop the archive thread and close the segment"""
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            self._queue.put(None)
+            thread.join()
+        self._thread = None
+
+    def _ensure_writer(self):
+        # A forked worker inherits the queue but not the thread (or the segment file)
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._segment = None
+            self._thread = threading.Thread(target=self._run, name='message-archive', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            while len(items) < WRITE_BATCH:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            messages = [item for item in items if item is not None]
+            stopping = len(messages) < len(items)
+            try:
+                self._write(messages)
+            except Exception as e:
+                logger.error("Failed to archive %d messages: %s", len(messages), e)
+                self._record('error', len(messages))
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+            if stopping:
+                if self._segment is not None:
+                    self._segment.close()
+                    self._segment = None
+                return
+
+    def _write(self, items):
+        if not items:
+            return
+        rows = []
+        for recipients, message, sent_at in items:
+            payload = message if isinstance(message, bytes) else message.as_bytes()
+            message_id = message_id_of(payload) or normalize_message_id(make_msgid())
+            header = json.dumps({'message_id': message_id, 'recipients': recipients, 'sent_at': sent_at})
+            frame = compress(self.codec, header.encode('utf-8') + b'\n' + payload)
+            if self._segment is None or (self._segment_size and self._segment_size + len(frame) > self.segment_bytes):
+                self._rotate()
+            offset = self._segment_size
+            self._segment.write(frame)
+            self._segment_size += len(frame)
+            rows.extend((message_id, recipient_key(to), self._segment_id, offset, len(frame), sent_at)
+                        for to in recipients)
+        # Frames must be readable before the index points at them
+        self._segment.flush()
+        conn = self.connection()
+        conn.execute('BEGIN')
+        try:
+            conn.executemany('INSERT INTO archived (message_id, recipient_key, segment_id, offset, length, sent_at) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', rows)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        self._record('written', len(items))
+
+    def _rotate(self):
+        if self._segment is not None:
+            self._segment.close()
+        self._sequence += 1
+        name = (f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{socket.gethostname()}-{os.getpid()}-"
+                f"{self._sequence:04d}{EXTENSIONS[self.codec]}")
+        self._segment = open(os.path.join(self.directory, name), 'ab')
+        self._segment_size = self._segment.tell()
+        self._segment_id = self.connection().execute('INSERT INTO segments (name) VALUES (?)', (name,)).lastrowid
+        if self.metrics:
+            self.metrics.incr('archive_segments_total')
+
+    def _record(self, result, count=1):
+        if self.metrics:
+            self.metrics.incr('archive_messages_total', value=count, result=result)
@@ -0,0 +1,433 @@
+"""
+File attachments (volunteer-hour certificates, tutoring receipts) for outgoing mail.
+Files are read and base64-encoded in fixed-size chunks, so a large PDF is never held in
+memory whole, and the encoded body is cached on disk under the SHA-256 of its content:
+sending the same certificate to a thousand recipients encodes it once. Small encoded
+bodies are also kept in a bounded in-memory LRU. Messages that carry attachments are
+written to the SMTP connection chunk by chunk instead of as one bytes object.
+
+The on-disk cache is swept after every cache miss: encoded bodies not used for
+ATTACHMENT_CACHE_MAX_AGE seconds are deleted, then the least recently used ones until the
+cache fits in ATTACHMENT_CACHE_MAX_BYTES. A swept body is simply encoded again on next use.
+"""
+
+import os
+import re
+import time
+import base64
+import hashlib
+import smtplib
+import tempfile
+import mimetypes
+import threading
+from collections import OrderedDict
+from email.utils import encode_rfc2231
+
+from fanout import CRLF
+
+# 57 input bytes encode to one full 76-character base64 line
+LINE_BYTES = 57
+ENCODE_CHUNK = LINE_BYTES * 1152
+READ_CHUNK = 64 * 1024
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_MEMORY_BYTES = 16 * 1024 * 1024
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+DEFAULT_CACHE_AGE = 7 * 24 * 3600
+# Bodies used this recently are never swept: a part may still be streaming from them
+SWEEP_GRACE = 60
+
+UPLOADS = 'uploads'
+ENCODED = '.encoded'
+
+_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+_CONTENT_TYPE = re.compile(r'^[\w.+-]+/[\w.+-]+$')
+
+
+class AttachmentError(ValueError):
+    """An attachment reference that cannot be sent (missing, outside the directory, too large)"""
+
+
+def _read_full(read, size):
+    """Read exactly size bytes unless the stream ends; streams may return short reads"""
+    buffer = read(size)
+    if not buffer or len(buffer) == size:
+        return buffer
+    pieces = [buffer]
+    remaining = size - len(buffer)
+    while remaining:
+        piece = read(remaining)
+        if not piece:
+            break
+        pieces.append(piece)
+        remaining -= len(piece)
+    return b''.join(pieces)
+
+
+def encode_stream(read, write, chunk_size=ENCODE_CHUNK, raw_write=None, max_bytes=None):
+    """Base64-encode a stream into CRLF-terminated 76-character lines.
+
+    chunk_size must be a multiple of 57 so every chunk ends on a line boundary. Returns
+    (sha256 hex digest, input size); raw_write, if given, also receives the raw bytes.
+    """
+    if chunk_size % LINE_BYTES:
+        raise ValueError('chunk_size must be a multiple of 57')
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = _read_full(read, chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+        if max_bytes is not None and size > max_bytes:
+            raise AttachmentError(f'Attachment exceeds {max_bytes} bytes')
+        digest.update(chunk)
+        if raw_write:
+            raw_write(chunk)
+        write(base64.encodebytes(chunk).replace(b'\n', CRLF))
+    return digest.hexdigest(), size
+
+
+def file_digest(path):
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def part_headers(filename, content_type):
+    """MIME headers of one base64 attachment part"""
+    filename = re.sub(r'["\\\r\n]', '', filename) or 'attachment'
+    try:
+        filename.encode('ascii')
+        disposition = f'attachment; filename="{filename}"'
+    except UnicodeEncodeError:
+        disposition = f"attachment; filename*={encode_rfc2231(filename, 'utf-8')}"
+    return (f'Content-Type: {content_type}\r\n'
+            f'MIME-Version: 1.0\r\n'
+            f'Content-Transfer-Encoding: base64\r\n'
+            f'Content-Disposition: {disposition}\r\n'
+            f'\r\n').encode('ascii')
+
+
+class EncodedPart:
+    """One attachment part: its headers plus a base64 body held in memory or in the cache"""
+
+    def __init__(self, digest, size, headers, path, data=None):
+        self.digest = digest
+        self.size = size
+        self.headers = headers
+        self.path = path
+        self.data = data
+
+    def chunks(self):
+        yield self.headers
+        if self.data is not None:
+            yield self.data
+            return
+        with open(self.path, 'rb') as f:
+            while True:
+                chunk = f.read(READ_CHUNK)
+                if not chunk:
+                    break
+                yield chunk
+
+
+class StreamedMessage:
+    """An open multipart/mixed message (from FanoutMessageBuilder.build) plus its attachments"""
+
+    def __init__(self, head, boundary, parts):
+        self.head = head
+        self.boundary = boundary
+        self.parts = parts
+
+    def chunks(self):
+        yield self.head
+        for part in self.parts:
+            yield CRLF + b'--' + self.boundary + CRLF
+            yield from part.chunks()
+        yield CRLF + b'--' + self.boundary + b'--' + CRLF
+
+    def as_bytes(self):
+        return b''.join(self.chunks())
+
+
+def _reset(client):
+    try:
+        client.rset()
+    except smtplib.SMTPServerDisconnected:
+        pass
+
+
+def sendmail_chunks(client, envelope_from, recipients, chunks):
+    """smtplib's sendmail, but writing the DATA section chunk by chunk.
+
+    Chunks must use CRLF line endings; leading dots are stuffed across chunk boundaries.
+    Returns the refused recipients like sendmail does.
+    """
+    if isinstance(recipients, str):
+        recipients = [recipients]
+    client.ehlo_or_helo_if_needed()
+    code, response = client.mail(envelope_from)
+    if code != 250:
+        if code == 421:
+            client.close()
+        else:
+            _reset(client)
+        raise smtplib.SMTPSenderRefused(code, response, envelope_from)
+    refused = {}
+    for recipient in recipients:
+        code, response = client.rcpt(recipient)
+        if code not in (250, 251):
+            refused[recipient] = (code, response)
+    if len(refused) == len(recipients):
+        _reset(client)
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    code, response = client.docmd('data')
+    if code != 354:
+        _reset(client)
+        raise smtplib.SMTPDataError(code, response)
+    at_line_start = True
+    for chunk in chunks:
+        if not chunk:
+            continue
+        stuffed = chunk.replace(b'\n.', b'\n..')
+        if at_line_start and chunk[:1] == b'.':
+            stuffed = b'.' + stuffed
+        client.send(stuffed)
+        at_line_start = chunk.endswith(b'\n')
+    client.send(b'.\r\n' if at_line_start else b'\r\n.\r\n')
+    code, response = client.getreply()
+    if code != 250:
+        _reset(client)
+        raise smtplib.SMTPDataError(code, response)
+    return refused
+
+
+def send_payload(client, envelope_from, recipients, payload):
+    """Send pre-serialized bytes with sendmail, or stream a StreamedMessage"""
+    if isinstance(payload, StreamedMessage):
+        return sendmail_chunks(client, envelope_from, recipients, payload.chunks())
+    return client.sendmail(envelope_from, recipients, payload)
+
+
+class AttachmentStore:
+    """Resolves attachment references under one directory and caches their encoded bodies.
+
+    A reference is {"path": "certificates/42.pdf"} (relative to the directory) or
+    {"id": "<sha256>"} for a file uploaded with save_stream, plus optional "filename"
+    and "content_type".
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, memory_bytes=DEFAULT_MEMORY_BYTES,
+                 cache_bytes=DEFAULT_CACHE_BYTES, cache_age=DEFAULT_CACHE_AGE, metrics=None):
+        self.directory = os.path.realpath(directory)
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.cache_bytes = cache_bytes
+        self.cache_age = cache_age
+        self.metrics = metrics
+        self._digests = OrderedDict()
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, metrics=None):
+        """Build from ATTACHMENT_DIR, ATTACHMENT_MAX_BYTES, ATTACHMENT_MEMORY_CACHE_BYTES,
+        ATTACHMENT_CACHE_MAX_BYTES and ATTACHMENT_CACHE_MAX_AGE"""
+        default_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'attachments')
+        return cls(
+            os.environ.get('ATTACHMENT_DIR', default_dir),
+            max_bytes=int(os.environ.get('ATTACHMENT_MAX_BYTES', DEFAULT_MAX_BYTES)),
+            memory_bytes=int(os.environ.get('ATTACHMENT_MEMORY_CACHE_BYTES', DEFAULT_MEMORY_BYTES)),
+            cache_bytes=int(os.environ.get('ATTACHMENT_CACHE_MAX_BYTES', DEFAULT_CACHE_BYTES)),
+            cache_age=float(os.environ.get('ATTACHMENT_CACHE_MAX_AGE', DEFAULT_CACHE_AGE)),
+            metrics=metrics
+        )
+
+    def _subdir(self, name):
+        path = os.path.join(self.directory, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _encoded_path(self, digest):
+        return os.path.join(self.directory, ENCODED, f'{digest}.b64')
+
+    def _ingest(self, read, raw_dir=None):
+        """Hash and encode a stream in one pass; returns (digest, size, raw path or None)"""
+        encoded_dir = self._subdir(ENCODED)
+        fd, encoded_tmp = tempfile.mkstemp(dir=encoded_dir, suffix='.tmp')
+        raw_file = raw_tmp = None
+        try:
+            if raw_dir:
+                raw_fd, raw_tmp = tempfile.mkstemp(dir=raw_dir, suffix='.tmp')
+                raw_file = os.fdopen(raw_fd, 'wb')
+            with os.fdopen(fd, 'wb') as encoded:
+                started = time.perf_counter()
+                digest, size = encode_stream(read, encoded.write, raw_write=raw_file and raw_file.write,
+                                             max_bytes=self.max_bytes)
+            if raw_file:
+                raw_file.close()
+            # Identical content may already be cached; os.replace keeps either copy atomic
+            os.replace(encoded_tmp, self._encoded_path(digest))
+            raw_path = None
+            if raw_tmp:
+                raw_path = os.path.join(raw_dir, digest)
+                os.replace(raw_tmp, raw_path)
+            if self.metrics:
+                self.metrics.observe('attachment_encode_ms', (time.perf_counter() - started) * 1000)
+            return digest, size, raw_path
+        except BaseException:
+            if raw_file:
+                raw_file.close()
+            for path in (encoded_tmp, raw_tmp):
+                if path and os.path.exists(path):
+                    os.unlink(path)
+            raise
+
+    def save_stream(self, stream):
+        """Store an uploaded file under its content hash; returns (id, size)"""
+        digest, size, _ = self._ingest(stream.read, raw_dir=self._subdir(UPLOADS))
+        return digest, size
+
+    def resolve(self, ref):
+        """Absolute path of the file a reference names, confined to the directory"""
+        if not isinstance(ref, dict):
+            raise AttachmentError('Attachment must be an object with "path" or "id"')
+        if ref.get('id'):
+            if not _DIGEST.match(str(ref['id'])):
+                raise AttachmentError(f'Invalid attachment id: {ref["id"]}')
+            path = os.path.join(self.directory, UPLOADS, ref['id'])
+        elif ref.get('path'):
+            path = os.path.realpath(os.path.join(self.directory, str(ref['path'])))
+            if not path.startswith(self.directory + os.sep):
+                raise AttachmentError(f'Attachment path is outside the attachment directory: {ref["path"]}')
+        else:
+            raise AttachmentError('Attachment must have "path" or "id"')
+        if not os.path.isfile(path):
+            raise AttachmentError(f'Attachment not found: {ref.get("path") or ref.get("id")}')
+        return path
+
+    def part(self, ref):
+        """The encoded part for one reference, encoding the file only on a cache miss"""
+        path = self.resolve(ref)
+        filename = ref.get('filename') or (os.path.basename(path) if ref.get('path') else 'attachment')
+        content_type = ref.get('content_type') or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        if not _CONTENT_TYPE.match(content_type):
+            raise AttachmentError(f'Invalid content type: {content_type}')
+
+        stat = os.stat(path)
+        if stat.st_size > self.max_bytes:
+            raise AttachmentError(f'Attachment exceeds {self.max_bytes} bytes: {filename}')
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = ref['id'] if ref.get('id') else self._digests.get(key)
+        if digest is None:
+            # Hashing is much cheaper than encoding, and another worker may have encoded it
+            digest = file_digest(path)
+        with self._lock:
+            data = self._memory.get(digest)
+            if data is not None:
+                self._memory.move_to_end(digest)
+        encoded_path = self._encoded_path(digest)
+
+        if data is not None or self._touch(encoded_path):
+            self._record('hit')
+        else:
+            with open(path, 'rb') as f:
+                digest, _, _ = self._ingest(f.read)
+            encoded_path = self._encoded_path(digest)
+            self._record('miss')
+            self.sweep()
+        with self._lock:
+            self._digests[key] = digest
+            self._digests.move_to_end(key)
+            if len(self._digests) > 4096:
+                self._digests.popitem(last=False)
+        if data is None:
+            data = self._remember(digest, encoded_path)
+        return EncodedPart(digest, stat.st_size, part_headers(filename, content_type), encoded_path, data)
+
+    def parts(self, refs):
+        """Encoded parts for a list of references (an empty list for None)"""
+        if refs is None:
+            return []
+        if not isinstance(refs, list):
+            raise AttachmentError('attachments must be a list')
+        return [self.part(ref) for ref in refs]
+
+    def _touch(self, encoded_path):
+        """Mark a cached body as used (its mtime orders the sweep); False if it is gone"""
+        try:
+            os.utime(encoded_path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def sweep(self, now=None):
+        """Delete encoded bodies past cache_age, then the least recently used ones until the
+        cache fits in cache_bytes. Returns the number of files deleted."""
+        now = time.time() if now is None else now
+        entries = []
+        try:
+            names = os.listdir(os.path.join(self.directory, ENCODED))
+        except FileNotFoundError:
+            return 0
+        for name in names:
+            if not name.endswith('.b64'):
+                continue
+            path = os.path.join(self.directory, ENCODED, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, path in entries:
+            if now - mtime < SWEEP_GRACE:
+                break
+            if now - mtime < self.cache_age and total <= self.cache_bytes:
+                break
+            try:
+                os.unlink(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        if removed and self.metrics:
+            self.metrics.incr('attachment_cache_evicted_total', removed)
+        return removed
+
+    @property
+    def memory_used(self):
+        """Bytes of encoded bodies held in memory"""
+        return self._memory_used
+
+    def _remember(self, digest, encoded_path):
+        """Keep small encoded bodies in memory, evicting least recently used ones"""
+        size = os.path.getsize(encoded_path)
+        if size > self.memory_bytes // 8:
+            return None
+        with open(encoded_path, 'rb') as f:
+            data = f.read()
+        with self._lock:
+            if digest not in self._memory:
+                self._memory[digest] = data
+                self._memory_used += len(data)
+            while self._memory_used > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_used -= len(evicted)
+            used = self._memory_used
+        if self.metrics:
+            self.metrics.set_gauge('attachment_memory_bytes', used)
+        return data
+
+    def _record(self, result):
+        if self.metrics:
+            self.metrics.incr('attachment_cache_total', result=result)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Benchmark: DKIM signing cost per message
+Builds N personalized welcome emails with the inline logo and prints the time per message
+for building alone, signing with a full body hash per message, signing with the batch's
+shared body canonicalized once, and the RSA signature alone; then signs the same batch
+through the render pool with 1..N processes.
+
+Usage: python benchmarks/bench_dkim.py --messages 2000 --key dkim.pem --max-processes 4
+Without --key a 2048-bit key is generated with the openssl command-line tool.
+"""
+
+import os
+import sys
+import time
+import hashlib
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from dkim import DKIMSigner, SharedBody, load_private_key, rsa_sign
+from fanout import FanoutMessageBuilder, logo_part
+from render_pool import RenderPool
+
+LOGO_PATH = os.path.join(os.path.dirname(__file__), '..', 'assets', 'novakinetix-logo.png')
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), '..', 'templates')
+TEMPLATES = {
+    'greeting': '{% extends "base_email.html" %}{% block content %}<p>Dear {{ user_name }},</p>{% endblock %}'
+}
+SENDER = 'NOVAKINETIX ACADEMY <noreply@novakinetix.academy>'
+SUBJECT = 'Welcome to NOVAKINETIX ACADEMY!'
+
+
+def timed(fn, count):
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--key', help='PEM RSA private key (default: a generated 2048-bit key)')
+    parser.add_argument('--max-processes', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    if args.key:
+        with open(args.key, 'rb') as f:
+            key_pem = f.read()
+    else:
+        key_pem = subprocess.run(['openssl', 'genrsa', '2048'], capture_output=True, check=True).stdout
+    logo = None
+    if os.path.exists(LOGO_PATH):
+        with open(LOGO_PATH, 'rb') as f:
+            logo = f.read()
+
+    start = time.perf_counter()
+    load_private_key.__wrapped__(key_pem)
+    parse_us = (time.perf_counter() - start) * 1e6
+    signer = DKIMSigner('novakinetix.academy', 'mail', key_pem)
+    start = time.perf_counter()
+    signer.key
+    cached_us = (time.perf_counter() - start) * 1e6
+    print(f"key parse {parse_us:.0f} us, cached lookup {cached_us:.1f} us")
+
+    count = args.messages
+    builder = FanoutMessageBuilder([logo_part(logo)] if logo else [])
+    htmls = [f'<p>Dear User {i},</p>' * 40 for i in range(count)]
+
+    def build():
+        return [builder.build(SENDER, f'user{i}@example.com', SUBJECT, html) for i, html in enumerate(htmls)]
+
+    messages = build()
+    shared = SharedBody(builder.tail)
+    digest = hashlib.sha256(b'headers').digest()
+    rows = [
+        ('build', timed(build, count)),
+        ('sign, full body hash', timed(lambda: [signer.sign(m) for m in messages], count)),
+        ('sign, shared body', timed(lambda: [signer.sign(m, shared) for m in messages], count)),
+        ('rsa only', timed(lambda: [rsa_sign(signer.key, digest) for _ in range(count)], count))
+    ]
+    print(f"{count} messages, {len(messages[0]) / 1024:.0f} KB each")
+    print(f"{'step':>22} {'us/msg':>9}")
+    for name, micros in rows:
+        print(f"{name:>22} {micros:>9.0f}")
+
+    jobs = [{'sender': SENDER, 'to': f'user{i}@example.com', 'subject': SUBJECT, 'template': 'greeting',
+             'template_data': {'user_name': f'User {i}'}} for i in range(count)]
+    print(f"{'processes':>9} {'unsigned msg/s':>15} {'signed msg/s':>13}")
+    processes = 1
+    while processes <= args.max_processes:
+        rates = []
+        for pool_signer in (None, signer):
+            pool = RenderPool(TEMPLATES, TEMPLATE_DIR, logo=logo, processes=processes, min_batch=1,
+                              signer=pool_signer)
+            try:
+                pool.render(jobs[:processes * 2])
+                start = time.perf_counter()
+                pool.render(jobs)
+                rates.append(count / (time.perf_counter() - start))
+            finally:
+                pool.close()
+        print(f"{processes:>9} {rates[0]:>15.0f} {rates[1]:>13.0f}")
+        processes *= 2
+
+
+if __name__ == '__main__':
+    main()
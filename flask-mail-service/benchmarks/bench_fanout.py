@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Benchmark: fan-out builder vs. per-message Flask-Mail Message construction
+Builds N personalized welcome emails with the inline logo both ways and prints the time per message
+
+Usage: python benchmarks/bench_fanout.py --sizes 1000 10000
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import Flask, render_template_string
+from flask_mail import Mail, Message
+from fanout import FanoutMessageBuilder, logo_part
+
+LOGO_PATH = os.path.join(os.path.dirname(__file__), '..', 'assets', 'novakinetix-logo.png')
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), '..', 'templates')
+TEMPLATE = '{% extends "base_email.html" %}{% block content %}<p>Dear {{ user_name }},</p>{% endblock %}'
+SENDER = 'NOVAKINETIX ACADEMY <noreply@novakinetix.academy>'
+SUBJECT = 'Welcome to NOVAKINETIX ACADEMY!'
+
+
+def bench_message(app, htmls, logo):
+    """Current path: one flask_mail.Message per recipient, logo re-encoded every time"""
+    with app.app_context():
+        start = time.perf_counter()
+        total = 0
+        for i, html in enumerate(htmls):
+            msg = Message(subject=SUBJECT, sender=SENDER, recipients=[f'user{i}@example.com'], html=html)
+            msg.attach('novakinetix-logo.png', 'image/png', logo, 'inline',
+                       headers=[('Content-ID', '<novakinetix-logo>')])
+            total += len(msg.as_bytes())
+        return time.perf_counter() - start, total
+
+
+def bench_fanout(htmls, logo):
+    """Fan-out path: logo serialized once, per-recipient headers and HTML spliced in"""
+    start = time.perf_counter()
+    builder = FanoutMessageBuilder([logo_part(logo)])
+    total = 0
+    for i, html in enumerate(htmls):
+        total += len(builder.build(SENDER, f'user{i}@example.com', SUBJECT, html))
+    return time.perf_counter() - start, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    args = parser.parse_args()
+
+    app = Flask(__name__, template_folder=TEMPLATE_DIR)
+    Mail(app)
+    with open(LOGO_PATH, 'rb') as f:
+        logo = f.read()
+
+    print(f"{'recipients':>10} {'method':>8} {'seconds':>9} {'us/msg':>9} {'MB':>8}")
+    for size in args.sizes:
+        with app.app_context():
+            htmls = [render_template_string(TEMPLATE, user_name=f'User {i}') for i in range(size)]
+        results = {
+            'message': bench_message(app, htmls, logo),
+            'fanout': bench_fanout(htmls, logo)
+        }
+        for method, (elapsed, total) in results.items():
+            print(f"{size:>10} {method:>8} {elapsed:>9.2f} {elapsed / size * 1e6:>9.0f} {total / 1e6:>8.1f}")
+        speedup = results['message'][0] / results['fanout'][0]
+        print(f"{size:>10} {'speedup':>8} {speedup:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
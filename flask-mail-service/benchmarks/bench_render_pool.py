@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the batch render pool
+Renders a personalized volunteer-hours batch with 1..N processes and prints messages per second
+
+Usage: python benchmarks/bench_render_pool.py --messages 5000 --max-processes 8
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from render_pool import RenderPool
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), '..', 'templates')
+LOGO_PATH = os.path.join(os.path.dirname(__file__), '..', 'assets', 'novakinetix-logo.png')
+
+
+def make_jobs(count):
+    return [{
+        'sender': 'noreply@novakinetix.academy',
+        'to': f'intern{i}@example.com',
+        'subject': 'Your Volunteer Hours Have Been Approved!',
+        'template': 'volunteer_hours_approved.html',
+        'template_data': {
+            'intern_name': f'Intern {i}',
+            'hours': 2.5,
+            'activity_type': 'tutoring',
+            'description': 'Math tutoring session',
+            'activity_date': '2024-01-15',
+            'approved_by': 'Admin',
+            'approval_date': 'January 16, 2024'
+        }
+    } for i in range(count)]
+
+
+def run(processes, jobs, logo):
+    pool = RenderPool({}, TEMPLATE_DIR, logo=logo, processes=processes, min_batch=1)
+    try:
+        # Warm the pool so process start-up is not counted
+        pool.render(jobs[:processes * 2])
+        start = time.perf_counter()
+        results = pool.render(jobs)
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.close()
+    total_bytes = sum(len(payload) for _, payload, _ in results if payload)
+    return elapsed, total_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--max-processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--no-logo', action='store_true', help='render without the inline logo part')
+    args = parser.parse_args()
+
+    logo = None
+    if not args.no_logo and os.path.exists(LOGO_PATH):
+        with open(LOGO_PATH, 'rb') as f:
+            logo = f.read()
+
+    jobs = make_jobs(args.messages)
+    baseline = None
+    print(f"{'processes':>9} {'seconds':>9} {'msg/s':>9} {'speedup':>8} {'MB':>8}")
+    processes = 1
+    while processes <= args.max_processes:
+        elapsed, total_bytes = run(processes, jobs, logo)
+        rate = len(jobs) / elapsed
+        baseline = baseline or rate
+        print(f"{processes:>9} {elapsed:>9.2f} {rate:>9.0f} {rate / baseline:>7.2f}x {total_bytes / 1e6:>8.1f}")
+        processes *= 2
+
+
+if __name__ == '__main__':
+    main()
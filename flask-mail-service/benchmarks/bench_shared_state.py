@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-operation cost of the cross-worker shared state
+Times incr (throttle counter), add (dedupe claim) and get against the SQLite-backed store,
+from one process and from several processes at once, next to an in-process dict as the
+floor. A send with both a throttle and an Idempotency-Key costs one add plus one incr.
+
+Usage: python benchmarks/bench_shared_state.py --ops 20000 --processes 1 4 8
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from shared_state import SharedState
+
+
+class LocalState:
+    """Per-process dict with a lock: what a single worker would use without sharing"""
+
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def incr(self, key, amount=1, ttl=None):
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+            return self.values[key]
+
+    def add(self, key, ttl=None):
+        with self.lock:
+            if key in self.values:
+                return False
+            self.values[key] = 1
+            return True
+
+    def get(self, key):
+        return self.values.get(key)
+
+
+def run_ops(state, operation, ops, worker):
+    keys = [f'recipient:user{worker}-{i % 500}@example.com' for i in range(ops)]
+    start = time.perf_counter()
+    if operation == 'incr':
+        for key in keys:
+            state.incr(key, ttl=3600)
+    elif operation == 'add':
+        for i, key in enumerate(keys):
+            state.add(f'idempotency:{worker}-{i}', ttl=3600)
+    else:
+        for key in keys:
+            state.get(key)
+    return time.perf_counter() - start
+
+
+def _worker(path, operation, ops, worker, results):
+    results.put(run_ops(SharedState(path), operation, ops, worker))
+
+
+def bench_processes(path, operation, ops, processes):
+    """Wall time per operation with all processes hammering the same store"""
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    workers = [context.Process(target=_worker, args=(path, operation, ops, i, results))
+               for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    elapsed = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    return max(elapsed) / ops, processes * ops / max(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ops', type=int, default=20000, help='operations per process')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--path', help='database path (default: a fresh file on /dev/shm or in /tmp)')
+    args = parser.parse_args()
+
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    print(f"{'backend':>8} {'op':>5} {'procs':>6} {'us/op':>9} {'total ops/s':>12}")
+    for operation in ('incr', 'add', 'get'):
+        elapsed = run_ops(LocalState(), operation, args.ops, 0)
+        print(f"{'dict':>8} {operation:>5} {1:>6} {elapsed / args.ops * 1e6:>9.2f} {args.ops / elapsed:>12.0f}")
+        for processes in args.processes:
+            with tempfile.TemporaryDirectory(dir=directory) as tmp:
+                path = args.path or os.path.join(tmp, 'state.sqlite3')
+                SharedState(path).get('warm')  # create the schema before the workers race for it
+                per_op, throughput = bench_processes(path, operation, args.ops, processes)
+            print(f"{'sqlite':>8} {operation:>5} {processes:>6} {per_op * 1e6:>9.2f} {throughput:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark: service cold start
+Starts fresh interpreters and measures how long `import app` takes, how long
+warm_app() takes with and without preloading, and the latency of the first
+and second send requests afterwards. With preloading the first-request cost moves into
+the gunicorn master, where it is paid once for all workers.
+
+Usage: python benchmarks/bench_startup.py --runs 5 --importtime 15
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Runs in a fresh interpreter; prints one JSON line of timings
+CHILD = r"""
+import json, sys, time
+started = time.perf_counter()
+import app as mail_app
+imported = time.perf_counter()
+mail_app.warm_app(preload=PRELOAD)
+booted = time.perf_counter()
+
+mail_app.mail.state.suppress = True
+mail_app.mail.state.default_sender = 'noreply@novakinetix.academy'
+client = mail_app.app.test_client()
+payload = {'email': 'student@example.com', 'name': 'Ada'}
+timings = []
+for _ in range(2):
+    t0 = time.perf_counter()
+    response = client.post('/api/send-welcome-email', json=payload)
+    timings.append((time.perf_counter() - t0) * 1000)
+    assert response.status_code == 200, response.get_json()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'boot_ms': (booted - imported) * 1000,
+    'first_request_ms': timings[0],
+    'second_request_ms': timings[1]
+}))
+"""
+
+
+def run_child(preload):
+    env = dict(os.environ, LOG_LEVEL='WARNING')
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD.replace('PRELOAD', str(preload))],
+        cwd=SERVICE_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def import_profile(top):
+    """Slowest modules by cumulative import time, from python -X importtime"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            cwd=SERVICE_DIR, env=dict(os.environ, LOG_LEVEL='WARNING'),
+                            capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Only direct imports of app.py (one level of indent) are actionable here
+        if name.startswith('    ') or not name.startswith('   '):
+            continue
+        rows.append((int(cumulative) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--importtime', type=int, default=0, metavar='N',
+                        help='also list the N slowest imports made by app.py')
+    args = parser.parse_args()
+
+    fields = ['import_ms', 'boot_ms', 'first_request_ms', 'second_request_ms']
+    print(f"{'mode':>8} " + ' '.join(f"{field:>18}" for field in fields))
+    for preload in (False, True):
+        samples = [run_child(preload) for _ in range(args.runs)]
+        medians = [statistics.median(sample[field] for sample in samples) for field in fields]
+        print(f"{'preload' if preload else 'lazy':>8} " + ' '.join(f"{value:>18.1f}" for value in medians))
+
+    if args.importtime:
+        print(f"\n{'ms':>8}  module (direct imports of app.py)")
+        for ms, name in import_profile(args.importtime):
+            print(f"{ms:>8.1f}  {name}")
+
+
+if __name__ == '__main__':
+    main()
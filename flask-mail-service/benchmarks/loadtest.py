@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Load test: HTTP throughput and latency of the send endpoints
+Starts a local SMTP sink (with optional artificial latency), boots the service against it
+under each worker configuration, and drives each endpoint at each concurrency level for a
+fixed duration. Prints requests/second and p50/p95/p99 latency per endpoint, concurrency
+and worker configuration, plus how many requests admission control shed with 429.
+
+Worker configurations are WORKERSxTHREADS for gunicorn (using gunicorn.conf.py), or
+"flask" for the single-process development server.
+
+Usage: python benchmarks/loadtest.py --workers 1x4 2x8 --concurrency 1 8 32 \
+           --endpoints send-email send-batch --duration 10 --smtp-latency 0.05 --json results.json
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import subprocess
+import http.client
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, SERVICE_DIR)
+
+from smtp_sink import SMTPSink
+
+WELCOME_DATA = {
+    'user_name': 'Load Test',
+    'user_email': 'load@example.com',
+    'login_url': 'https://novakinetix.academy/login',
+    'site_url': 'https://novakinetix.academy'
+}
+
+
+def endpoint_payloads(batch_size):
+    """Request path and JSON body for each endpoint under test"""
+    return {
+        'send-email': ('/api/send-email', {
+            'to': 'load@example.com',
+            'subject': 'Load test',
+            'template': 'welcome',
+            'template_data': WELCOME_DATA
+        }),
+        'send-welcome-email': ('/api/send-welcome-email', {'email': 'load@example.com', 'name': 'Load Test'}),
+        'send-password-reset': ('/api/send-password-reset', {
+            'email': 'load@example.com',
+            'reset_url': 'https://novakinetix.academy/reset?token=load'
+        }),
+        'send-batch': ('/api/send-batch', {
+            'template': 'welcome',
+            'subject': 'Load test',
+            'messages': [{'to': f'load{i}@example.com', 'template_data': dict(WELCOME_DATA, user_name=f'User {i}')}
+                         for i in range(batch_size)]
+        })
+    }
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_service(config, port, smtp_port):
+    """Boot the service in a subprocess pointed at the SMTP sink"""
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        MAIL_SERVER='127.0.0.1',
+        MAIL_PORT=str(smtp_port),
+        MAIL_USE_TLS='false',
+        MAIL_USERNAME='',
+        MAIL_PASSWORD='',
+        MAIL_DEFAULT_SENDER='noreply@novakinetix.academy',
+        LOG_LEVEL='WARNING'
+    )
+    env.pop('MAIL_RELAYS', None)
+    if config == 'flask':
+        command = [sys.executable, '-c',
+                   f"import app; app.warm_app().run(host='127.0.0.1', port={port}, threaded=True)"]
+    else:
+        workers, threads = config.lower().split('x')
+        env.update(WEB_CONCURRENCY=workers, GUNICORN_THREADS=threads)
+        command = [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py',
+                   '--bind', f'127.0.0.1:{port}', '--log-level', 'warning']
+    process = subprocess.Popen(command, cwd=SERVICE_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Service exited during start-up ({config})")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Service did not become healthy ({config})")
+
+
+def stop_service(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def drive(port, path, payload, concurrency, duration):
+    """Send requests from `concurrency` keep-alive clients for `duration` seconds"""
+    body = json.dumps(payload).encode('utf-8')
+    headers = {'Content-Type': 'application/json'}
+    latencies = []
+    errors = [0]
+    shed = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client():
+        conn = None
+        local = []
+        local_errors = 0
+        local_shed = 0
+        while time.perf_counter() < stop_at:
+            if conn is None:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            started = time.perf_counter()
+            response = None
+            try:
+                conn.request('POST', path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+                if response.status == 429:
+                    local_shed += 1
+                if response.getheader('Connection', '').lower() == 'close':
+                    conn.close()
+                    conn = None
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = None
+            if ok:
+                local.append((time.perf_counter() - started) * 1000)
+            elif response is None or response.status != 429:
+                local_errors += 1
+        if conn is not None:
+            conn.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+            shed[0] += local_shed
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'shed': shed[0],
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': latencies[-1] if latencies else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', nargs='+', default=['1x4', '2x4'], help='WORKERSxTHREADS or "flask"')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--endpoints', nargs='+', default=['send-email', 'send-welcome-email'],
+                        choices=['send-email', 'send-welcome-email', 'send-password-reset', 'send-batch'])
+    parser.add_argument('--duration', type=float, default=10, help='seconds per measurement')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds of unmeasured load before each endpoint')
+    parser.add_argument('--smtp-latency', type=float, default=0.0, help='seconds the sink waits per message')
+    parser.add_argument('--batch-size', type=int, default=100, help='messages per send-batch request')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    payloads = endpoint_payloads(args.batch_size)
+    results = []
+    with SMTPSink(latency=args.smtp_latency) as sink:
+        print(f"SMTP sink on port {sink.port} (latency {args.smtp_latency * 1000:.0f} ms)")
+        print(f"{'workers':>8} {'endpoint':>20} {'conc':>5} {'req/s':>9} {'p50 ms':>9} "
+              f"{'p95 ms':>9} {'p99 ms':>9} {'errors':>7} {'shed':>7}")
+        for config in args.workers:
+            port = free_port()
+            process = start_service(config, port, sink.port)
+            try:
+                for endpoint in args.endpoints:
+                    path, payload = payloads[endpoint]
+                    if args.warmup:
+                        drive(port, path, payload, max(args.concurrency), args.warmup)
+                    for concurrency in args.concurrency:
+                        row = drive(port, path, payload, concurrency, args.duration)
+                        row.update(workers=config, endpoint=endpoint, concurrency=concurrency)
+                        results.append(row)
+                        print(f"{config:>8} {endpoint:>20} {concurrency:>5} {row['rps']:>9.1f} "
+                              f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} "
+                              f"{row['errors']:>7} {row['shed']:>7}")
+            finally:
+                stop_service(process)
+        print(f"SMTP sink accepted {sink.messages} messages ({sink.bytes / 1e6:.1f} MB)")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,368 @@
+"""
+Incremental bounce ingestion from a Maildir or mbox.
+Delivery status notifications (RFC 3464 multipart/report messages) are parsed into
+per-recipient events, which update a delivery-status table and feed hard bounces (and
+repeated soft bounces) into the suppression list.
+
+Each message is parsed once:
+- Maildir: only new/ is listed, and processed messages are moved to cur/ with the seen flag.
+- mbox: the byte offset reached is stored with the status updates in the same SQLite
+  transaction, and the next pass seeks straight to it.
+
+Run it next to the service with `python bounces.py --maildir /var/mail/bounces --follow`
+(or trigger a pass with POST /admin/bounces/ingest).
+"""
+
+import os
+import time
+import email
+import logging
+import sqlite3
+import threading
+from email import policy
+from email.parser import HeaderParser
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOFT_BOUNCE_LIMIT = 5
+
+KIND_HARD = 'hard'
+KIND_SOFT = 'soft'
+KIND_DELIVERED = 'delivered'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS delivery_status (
+    email TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    action TEXT,
+    status TEXT,
+    diagnostic TEXT,
+    remote_mta TEXT,
+    original_message_id TEXT,
+    hard_bounces INTEGER NOT NULL DEFAULT 0,
+    soft_bounces INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ingest_checkpoint (
+    source TEXT PRIMARY KEY,
+    inode INTEGER,
+    offset INTEGER NOT NULL
+);
+"""
+
+
+def _field_value(value):
+    """Strip the type prefix from "rfc822; user@example.com" style DSN fields"""
+    if value is None:
+        return None
+    value = str(value)
+    if ';' in value:
+        value = value.split(';', 1)[1]
+    return value.strip().strip('<>').strip() or None
+
+
+def classify(action, status):
+    """Hard bounce, soft bounce or delivered, from a DSN Action and Status pair"""
+    action = (action or '').lower()
+    if action in ('delivered', 'relayed', 'expanded'):
+        return KIND_DELIVERED
+    if action == 'failed' and (status or '').startswith('5'):
+        return KIND_HARD
+    return KIND_SOFT
+
+
+def _status_blocks(part):
+    """Header blocks of a message/delivery-status part: per-message first, then per-recipient"""
+    payload = part.get_payload()
+    if isinstance(payload, list):
+        return payload
+    # Not split into header blocks by the parser; split the raw text on blank lines instead
+    text = payload if isinstance(payload, str) else ''
+    chunks = [chunk for chunk in text.replace('\r\n', '\n').split('\n\n') if chunk.strip()]
+    return [HeaderParser().parsestr(chunk) for chunk in chunks]
+
+
+def parse_dsn(message):
+    """Per-recipient delivery events from an RFC 3464 report, or [] if it is not a DSN"""
+    if message.get_content_type() != 'multipart/report':
+        return []
+
+    original_message_id = None
+    events = []
+    for part in message.walk():
+        content_type = part.get_content_type()
+        if content_type in ('text/rfc822-headers', 'message/rfc822') and original_message_id is None:
+            payload = part.get_payload()
+            headers = payload[0] if isinstance(payload, list) else HeaderParser().parsestr(payload or '')
+            original_message_id = headers.get('Message-ID')
+        elif content_type == 'message/delivery-status':
+            blocks = _status_blocks(part)
+            reporting_mta = _field_value(blocks[0].get('Reporting-MTA')) if blocks else None
+            for block in blocks[1:]:
+                recipient = _field_value(block.get('Final-Recipient') or block.get('Original-Recipient'))
+                if not recipient:
+                    continue
+                action = (block.get('Action') or '').strip().lower()
+                status = (block.get('Status') or '').strip().split(' ')[0]
+                events.append({
+                    'email': recipient.lower(),
+                    'kind': classify(action, status),
+                    'action': action,
+                    'status': status,
+                    'diagnostic': _field_value(block.get('Diagnostic-Code')),
+                    'remote_mta': _field_value(block.get('Remote-MTA')) or reporting_mta
+                })
+    for event in events:
+        event['original_message_id'] = original_message_id
+    return events
+
+
+def db_path():
+    """BOUNCE_DB, or bounces.sqlite3 next to the service, wherever it was started from;
+    the app and the ingestion sidecar must agree on it"""
+    return os.environ.get('BOUNCE_DB') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bounces.sqlite3')
+
+
+class DeliveryStatusStore:
+    """Latest delivery status and bounce counts per recipient, plus ingestion checkpoints"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def apply(self, conn, events):
+        """Upsert events inside the caller's transaction; returns the updated rows"""
+        now = datetime.now(timezone.utc).isoformat()
+        rows = []
+        for event in events:
+            conn.execute(
+                """
+                INSERT INTO delivery_status (email, kind, action, status, diagnostic, remote_mta,
+                                             original_message_id, hard_bounces, soft_bounces, updated_at)
+                VALUES (:email, :kind, :action, :status, :diagnostic, :remote_mta, :original_message_id,
+                        :hard, :soft, :now)
+                ON CONFLICT(email) DO UPDATE SET
+                    kind = excluded.kind,
+                    action = excluded.action,
+                    status = excluded.status,
+                    diagnostic = excluded.diagnostic,
+                    remote_mta = excluded.remote_mta,
+                    original_message_id = excluded.original_message_id,
+                    hard_bounces = hard_bounces + excluded.hard_bounces,
+                    soft_bounces = CASE WHEN excluded.kind = 'delivered' THEN 0
+                                        ELSE soft_bounces + excluded.soft_bounces END,
+                    updated_at = excluded.updated_at
+                """,
+                dict(event, hard=int(event['kind'] == KIND_HARD), soft=int(event['kind'] == KIND_SOFT), now=now)
+            )
+            rows.append(self.get(event['email'], conn))
+        return rows
+
+    def get(self, email, conn=None):
+        conn = conn or self.connection()
+        row = conn.execute('SELECT * FROM delivery_status WHERE email = ?', (email.strip().lower(),)).fetchone()
+        return dict(row) if row else None
+
+    def checkpoint(self, conn, source):
+        row = conn.execute('SELECT inode, offset FROM ingest_checkpoint WHERE source = ?', (source,)).fetchone()
+        return (row['inode'], row['offset']) if row else (None, 0)
+
+    def save_checkpoint(self, conn, source, inode, offset):
+        conn.execute('INSERT OR REPLACE INTO ingest_checkpoint (source, inode, offset) VALUES (?, ?, ?)',
+                     (source, inode, offset))
+
+
+def split_mbox(data):
+    """Yield (end_offset, message_bytes) for each complete message in an mbox chunk.
+
+    The chunk starts at a "From " separator. A message counts as complete once the next
+    separator follows it, or it ends with the blank line mbox writers append; a
+    half-written tail is left for the next pass.
+    """
+    starts = [0] if data.startswith(b'From ') else []
+    search_from = 0
+    while True:
+        index = data.find(b'\n\nFrom ', search_from)
+        if index < 0:
+            break
+        starts.append(index + 2)
+        search_from = index + 2
+    for current, following in zip(starts, starts[1:] + [None]):
+        if following is None:
+            if not data.endswith(b'\n\n'):
+                return
+            following = len(data)
+        yield following, data[current:following]
+
+
+class BounceIngestor:
+    """Reads new DSNs from a Maildir or mbox and records the per-recipient outcomes"""
+
+    def __init__(self, store, maildir=None, mbox=None, suppression_list=None,
+                 soft_bounce_limit=DEFAULT_SOFT_BOUNCE_LIMIT, metrics=None):
+        if not maildir and not mbox:
+            raise ValueError("BounceIngestor needs a maildir or an mbox path")
+        self.store = store
+        self.maildir = maildir
+        self.mbox = mbox
+        self.suppression_list = suppression_list
+        self.soft_bounce_limit = soft_bounce_limit
+        self.metrics = metrics
+
+    @classmethod
+    def from_env(cls, suppression_list=None, metrics=None):
+        """Build from BOUNCE_MAILDIR or BOUNCE_MBOX (None when neither is set)"""
+        maildir = os.environ.get('BOUNCE_MAILDIR')
+        mbox = os.environ.get('BOUNCE_MBOX')
+        if not maildir and not mbox:
+            return None
+        return cls(
+            DeliveryStatusStore(db_path()),
+            maildir=maildir,
+            mbox=mbox,
+            suppression_list=suppression_list,
+            soft_bounce_limit=int(os.environ.get('SOFT_BOUNCE_LIMIT', DEFAULT_SOFT_BOUNCE_LIMIT)),
+            metrics=metrics
+        )
+
+    def _record(self, conn, raw):
+        """Parse one message and apply its events; returns the addresses to suppress"""
+        message = email.message_from_bytes(raw, policy=policy.compat32)
+        events = parse_dsn(message)
+        if self.metrics:
+            self.metrics.incr('dsn_messages_total', result='parsed' if events else 'not_dsn')
+        suppress = []
+        for row in self.store.apply(conn, events):
+            if self.metrics:
+                self.metrics.incr('bounces_total', kind=row['kind'])
+            if row['kind'] == KIND_HARD:
+                suppress.append((row['email'], 'hard_bounce'))
+            elif row['kind'] == KIND_SOFT and row['soft_bounces'] >= self.soft_bounce_limit:
+                suppress.append((row['email'], 'soft_bounce_limit'))
+        return suppress
+
+    def _suppress(self, addresses):
+        if not addresses or self.suppression_list is None:
+            return
+        by_reason = {}
+        for address, reason in addresses:
+            by_reason.setdefault(reason, []).append(address)
+        for reason, emails in by_reason.items():
+            self.suppression_list.add_many(emails, reason=reason)
+
+    def ingest_maildir(self, limit=None):
+        """Process messages in new/ and move each to cur/ once its events are committed"""
+        new_dir = os.path.join(self.maildir, 'new')
+        cur_dir = os.path.join(self.maildir, 'cur')
+        os.makedirs(cur_dir, exist_ok=True)
+        entries = sorted((entry for entry in os.scandir(new_dir) if entry.is_file()),
+                         key=lambda entry: entry.stat().st_mtime)
+        processed = 0
+        suppress = []
+        conn = self.store.connection()
+        for entry in entries[:limit]:
+            try:
+                with open(entry.path, 'rb') as f:
+                    raw = f.read()
+            except FileNotFoundError:
+                continue  # taken by a concurrent ingestor
+            target = os.path.join(cur_dir, entry.name if ':2,' in entry.name else entry.name + ':2,S')
+            # The move happens under the write lock, so a concurrent ingestor that read the
+            # same file finds it gone and rolls back instead of counting it twice
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                found = self._record(conn, raw)
+                os.rename(entry.path, target)
+            except FileNotFoundError:
+                conn.execute('ROLLBACK')
+                continue
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            try:
+                conn.execute('COMMIT')
+            except BaseException:
+                os.rename(target, entry.path)  # leave it for the next pass
+                raise
+            suppress.extend(found)
+            processed += 1
+        self._suppress(suppress)
+        return processed
+
+    def ingest_mbox(self):
+        """Process messages appended to the mbox since the stored offset"""
+        try:
+            stat = os.stat(self.mbox)
+        except FileNotFoundError:
+            return 0
+        conn = self.store.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            inode, offset = self.store.checkpoint(conn, self.mbox)
+            if inode != stat.st_ino or offset > stat.st_size:
+                offset = 0  # rotated or truncated
+            processed = 0
+            suppress = []
+            with open(self.mbox, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+            consumed = 0
+            for end, raw in split_mbox(data):
+                suppress.extend(self._record(conn, raw.split(b'\n', 1)[1] if b'\n' in raw else b''))
+                consumed = end
+                processed += 1
+            self.store.save_checkpoint(conn, self.mbox, stat.st_ino, offset + consumed)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        self._suppress(suppress)
+        return processed
+
+    def ingest(self):
+        """One pass over the configured source; returns the number of messages processed"""
+        started = time.perf_counter()
+        processed = self.ingest_maildir() if self.maildir else self.ingest_mbox()
+        if self.metrics:
+            self.metrics.observe('bounce_ingest_ms', (time.perf_counter() - started) * 1000)
+        if processed:
+            logger.info("Ingested %d bounce messages", processed)
+        return processed
+
+
+if __name__ == '__main__':
+    import argparse
+    from suppression import SuppressionList
+
+    parser = argparse.ArgumentParser(description='Ingest DSN bounces into the delivery-status store')
+    parser.add_argument('--maildir', default=os.environ.get('BOUNCE_MAILDIR'))
+    parser.add_argument('--mbox', default=os.environ.get('BOUNCE_MBOX'))
+    parser.add_argument('--db', default=db_path())
+    parser.add_argument('--follow', action='store_true', help='keep polling for new bounces')
+    parser.add_argument('--interval', type=float, default=float(os.environ.get('BOUNCE_POLL_INTERVAL', 30)))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    ingestor = BounceIngestor(DeliveryStatusStore(args.db), maildir=args.maildir, mbox=args.mbox,
+                              suppression_list=SuppressionList.from_env(),
+                              soft_bounce_limit=int(os.environ.get('SOFT_BOUNCE_LIMIT', DEFAULT_SOFT_BOUNCE_LIMIT)))
+    while True:
+        ingestor.ingest()
+        if not args.follow:
+            break
+        time.sleep(args.interval)
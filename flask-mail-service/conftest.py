@@ -0,0 +1,20 @@
+"""
+pytest setup: the suite gets its own shared state instead of the default under /dev/shm
+"""
+
+import os
+import shutil
+import tempfile
+
+_directory = None
+
+
+def pytest_configure(config):
+    global _directory
+    _directory = tempfile.mkdtemp(prefix='flask-mail-tests-')
+    os.environ['SHARED_STATE_PATH'] = os.path.join(_directory, 'shared-state.sqlite3')
+
+
+def pytest_unconfigure(config):
+    os.environ.pop('SHARED_STATE_PATH', None)
+    shutil.rmtree(_directory, ignore_errors=True)
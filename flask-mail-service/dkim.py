@@ -0,0 +1,257 @@
+"""
+DKIM signing (RFC 6376, rsa-sha256, relaxed/relaxed) for outgoing mail.
+The private key is read and parsed once per process. In a fan-out batch every message
+ends in the same bytes (the shared logo part, the attachments, the closing boundaries),
+so a SharedBody canonicalizes that tail once and each message only canonicalizes its
+own personalized part before hashing; identical personalized parts share one body hash.
+Large batches are signed inside the render pool's worker processes (see render_pool.py),
+so the RSA operations run in parallel instead of on the request thread.
+"""
+
+import os
+import re
+import time
+import base64
+import hashlib
+from itertools import chain, islice
+from functools import lru_cache
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import Prehashed
+
+CRLF = b'\r\n'
+
+SIGNED_HEADERS = ('from', 'to', 'subject', 'date', 'message-id', 'mime-version', 'content-type')
+
+# Body hashes remembered per SharedBody for identical personalized parts
+BODY_MEMO_SIZE = 1024
+
+_WSP = re.compile(rb'[ \t]+')
+_TRAILING_WSP = re.compile(rb' (?=\r\n)')
+_FOLD = re.compile(rb'\r\n(?=[ \t])')
+_EOL = re.compile(rb'\r?\n')
+
+
+class DKIMError(ValueError):
+    """The DKIM key or configuration is unusable"""
+
+
+@lru_cache(maxsize=8)
+def load_private_key(pem):
+    """Parse a PEM RSA private key once per process"""
+    try:
+        key = serialization.load_pem_private_key(pem, password=None)
+    except (TypeError, ValueError) as e:
+        raise DKIMError(f'DKIM key must be an unencrypted PEM RSA private key: {e}') from e
+    if not isinstance(key, rsa.RSAPrivateKey):
+        raise DKIMError('DKIM key is not an RSA private key')
+    return key
+
+
+def rsa_sign(key, digest):
+    """PKCS#1 v1.5 signature of a SHA-256 digest"""
+    return key.sign(digest, padding.PKCS1v15(), Prehashed(hashes.SHA256()))
+
+
+def relaxed_lines(data):
+    """Relaxed body canonicalization of complete CRLF-terminated lines"""
+    return _TRAILING_WSP.sub(b'', _WSP.sub(b' ', data))
+
+
+def relaxed_header(name, value):
+    """Relaxed canonical form of one header (value without the trailing CRLF)"""
+    value = _WSP.sub(b' ', _FOLD.sub(b'', value)).strip(b' ')
+    return name.strip().lower() + b':' + value + CRLF
+
+
+def parse_headers(head):
+    """[(name, value)] from a CRLF header block; folded values keep their line breaks"""
+    headers = []
+    for line in head.split(CRLF):
+        if line[:1] in (b' ', b'\t') and headers:
+            name, value = headers[-1]
+            headers[-1] = (name, value + CRLF + line)
+        elif line:
+            name, _, value = line.partition(b':')
+            headers.append((name, value))
+    return headers
+
+
+class RelaxedBody:
+    """Incremental relaxed body canonicalization, writing canonical bytes to write.
+
+    Only complete lines are canonicalized; empty lines are held back until more content
+    follows, since trailing empty lines are not part of the canonical body.
+    """
+
+    def __init__(self, write):
+        self.write = write
+        self._pending = b''
+        self._blank = b''
+
+    def update(self, chunk):
+        data = self._pending + chunk
+        end = data.rfind(CRLF) + 2
+        if end < 2:
+            self._pending = data
+            return
+        self._pending = data[end:]
+        self._emit(relaxed_lines(data[:end]))
+
+    def _emit(self, lines):
+        content = lines.rstrip(CRLF)
+        if content:
+            self.write(self._blank + content + CRLF)
+            self._blank = lines[len(content) + 2:]
+        else:
+            self._blank += lines
+
+    def finish(self):
+        if self._pending:
+            self._emit(relaxed_lines(self._pending + CRLF))
+            self._pending = b''
+
+
+def body_hash(chunks):
+    """Relaxed-canonical SHA-256 of a body given as byte chunks"""
+    digest = hashlib.sha256()
+    canonical = RelaxedBody(digest.update)
+    for chunk in chunks:
+        canonical.update(chunk)
+    canonical.finish()
+    return digest.digest()
+
+
+class SharedBody:
+    """Body hashes for messages that all end in the same bytes.
+
+    tail is what every body ends with and must start at a line break (the fan-out
+    builder's tail starts with the CRLF before its next delimiter); extra is any further
+    shared bytes streamed after the message, such as attachment parts.
+    """
+
+    def __init__(self, tail, extra=()):
+        if not tail.startswith(CRLF):
+            raise ValueError('shared tail must start with CRLF')
+        self.tail = tail
+        parts = []
+        canonical = RelaxedBody(parts.append)
+        canonical.update(tail[2:])
+        for chunk in extra:
+            canonical.update(chunk)
+        canonical.finish()
+        if not parts:
+            raise ValueError('shared tail has no content')
+        self._canonical = b''.join(parts)
+        self._memo = {}
+
+    def body_hash(self, personal):
+        """Hash of personal + the shared bytes"""
+        digest = self._memo.get(personal)
+        if digest is None:
+            state = hashlib.sha256(relaxed_lines(personal + CRLF))
+            state.update(self._canonical)
+            digest = state.digest()
+            if len(self._memo) >= BODY_MEMO_SIZE:
+                self._memo.clear()
+            self._memo[personal] = digest
+        return digest
+
+
+def _split(message):
+    end = message.find(CRLF + CRLF)
+    if end < 0:
+        raise ValueError('message has no header/body separator')
+    return message[:end + 2], message[end + 4:]
+
+
+class DKIMSigner:
+    """Signs serialized messages for one domain and selector"""
+
+    def __init__(self, domain, selector, key_pem, headers=SIGNED_HEADERS, metrics=None):
+        self.domain = domain
+        self.selector = selector
+        self.key_pem = key_pem
+        self.headers = tuple(name.lower() for name in headers)
+        self.metrics = metrics
+        # Parse now so a bad key fails at boot rather than on the first send
+        load_private_key(key_pem)
+
+    @classmethod
+    def from_env(cls, metrics=None):
+        """Build from DKIM_DOMAIN, DKIM_SELECTOR and DKIM_PRIVATE_KEY_PATH; None when unset"""
+        domain = os.environ.get('DKIM_DOMAIN')
+        selector = os.environ.get('DKIM_SELECTOR')
+        path = os.environ.get('DKIM_PRIVATE_KEY_PATH')
+        if not (domain and selector and path):
+            return None
+        with open(path, 'rb') as f:
+            key_pem = f.read()
+        headers = os.environ.get('DKIM_HEADERS')
+        return cls(domain, selector, key_pem,
+                   headers=[name.strip() for name in headers.split(':')] if headers else SIGNED_HEADERS,
+                   metrics=metrics)
+
+    def __getstate__(self):
+        # Render pool children get the key bytes and parse them once themselves
+        state = dict(self.__dict__)
+        state['metrics'] = None
+        return state
+
+    @property
+    def key(self):
+        return load_private_key(self.key_pem)
+
+    def signature_header(self, head, digest, timestamp=None):
+        """The DKIM-Signature header line for a header block and body hash"""
+        started = time.perf_counter()
+        present = {}
+        for name, value in parse_headers(head):
+            present[name.strip().lower().decode('ascii', 'replace')] = (name, value)
+        signed = [name for name in self.headers if name in present]
+        if 'from' not in signed:
+            raise ValueError('message has no From header')
+        tags = [
+            'v=1', 'a=rsa-sha256', 'c=relaxed/relaxed', f'd={self.domain}', f's={self.selector}',
+            f't={int(timestamp or time.time())}', f'h={":".join(signed)}',
+            'bh=' + base64.b64encode(digest).decode('ascii'), 'b='
+        ]
+        value = ';\r\n\t'.join(tags).encode('ascii')
+        canonical = b''.join(relaxed_header(*present[name]) for name in signed)
+        canonical += relaxed_header(b'DKIM-Signature', b' ' + value)[:-2]
+        signature = base64.b64encode(rsa_sign(self.key, hashlib.sha256(canonical).digest()))
+        folded = b'\r\n\t'.join(signature[i:i + 64] for i in range(0, len(signature), 64))
+        if self.metrics:
+            self.metrics.observe('dkim_sign_ms', (time.perf_counter() - started) * 1000)
+        return b'DKIM-Signature: ' + value + folded + CRLF
+
+    def sign(self, message, shared=None):
+        """Prepend a DKIM-Signature to message bytes or an attachments.StreamedMessage.
+
+        With shared (a SharedBody), message is a fan-out message ending in shared.tail and
+        only its personalized part is hashed here.
+        """
+        if not isinstance(message, bytes):
+            head, body = _split(message.head)
+            if shared is None:
+                digest = body_hash(chain([body], islice(message.chunks(), 1, None)))
+            else:
+                digest = shared.body_hash(body[:len(body) - len(shared.tail)])
+            return type(message)(self.signature_header(head, digest) + message.head,
+                                 message.boundary, message.parts)
+
+        if message.count(b'\n') != message.count(CRLF):
+            message = _EOL.sub(CRLF, message)
+        head, body = _split(message)
+        if shared is not None and body.endswith(shared.tail):
+            digest = shared.body_hash(body[:len(body) - len(shared.tail)])
+        else:
+            digest = body_hash([body])
+        return self.signature_header(head, digest) + message
+
+    def dns_record(self):
+        """The TXT record to publish at <selector>._domainkey.<domain>"""
+        spki = self.key.public_key().public_bytes(serialization.Encoding.DER,
+                                                  serialization.PublicFormat.SubjectPublicKeyInfo)
+        return f'v=DKIM1; k=rsa; p={base64.b64encode(spki).decode("ascii")}'
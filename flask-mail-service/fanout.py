@@ -0,0 +1,144 @@
+"""
+Fan-out message builder for personalized batches.
+Parts that are identical for every recipient (the inline logo, shared attachments) are
+serialized to wire bytes once; each message is then assembled by splicing a small
+per-recipient header block and the recipient's HTML part around those cached bytes.
+Messages that carry file attachments wrap that multipart/related body in a
+multipart/mixed envelope whose attachment parts are appended by the sender (see
+attachments.py).
+"""
+
+import base64
+import uuid
+from functools import lru_cache
+from email.header import Header
+from email.mime.image import MIMEImage
+from email.policy import SMTP
+from email.utils import formataddr, formatdate, make_msgid, parseaddr
+
+CRLF = b'\r\n'
+
+
+class HeaderInjectionError(ValueError):
+    """A header name or value contained a line break, which would start a new header"""
+
+
+def has_line_break(*values):
+    """True if any of the string values contains CR or LF"""
+    return any(isinstance(value, str) and ('\r' in value or '\n' in value) for value in values)
+
+
+def new_boundary():
+    return f'=============={uuid.uuid4().hex}=='.encode('ascii')
+
+
+@lru_cache(maxsize=256)
+def encode_header_value(value):
+    """RFC 2047-encode a header value only when it is not plain ASCII"""
+    try:
+        value.encode('ascii')
+        return value
+    except UnicodeEncodeError:
+        return Header(value, 'utf-8').encode(linesep='\r\n')
+
+
+@lru_cache(maxsize=256)
+def encode_address(value):
+    """Like encode_header_value for an address header, but encodes only the display name:
+    "Ada Lövelace <ada@example.com>" must keep its <addr-spec> readable by mail servers"""
+    try:
+        value.encode('ascii')
+        return value
+    except UnicodeEncodeError:
+        name, address = parseaddr(value)
+        if not address or not address.isascii():
+            return encode_header_value(value)
+        return formataddr((Header(name, 'utf-8').encode(linesep='\r\n'), address))
+
+
+def serialize_part(part):
+    """Serialize a MIME part (headers and body) with CRLF line endings"""
+    return part.as_bytes(policy=SMTP)
+
+
+def logo_part(logo_bytes, content_id='novakinetix-logo', filename='novakinetix-logo.png'):
+    """The inline logo referenced as cid:novakinetix-logo by the templates"""
+    part = MIMEImage(logo_bytes, 'png')
+    part.add_header('Content-ID', f'<{content_id}>')
+    part.add_header('Content-Disposition', 'inline', filename=filename)
+    return part
+
+
+def html_part_bytes(html):
+    """Base64-encode a rendered HTML body as a text/html part"""
+    body = base64.encodebytes(html.encode('utf-8')).replace(b'\n', CRLF)
+    return (b'Content-Type: text/html; charset="utf-8"\r\n'
+            b'MIME-Version: 1.0\r\n'
+            b'Content-Transfer-Encoding: base64\r\n'
+            b'\r\n' + body)
+
+
+class FanoutMessageBuilder:
+    """Builds multipart/related messages that share pre-serialized invariant parts"""
+
+    def __init__(self, shared_parts=(), subtype='related'):
+        self.boundary = new_boundary()
+        delimiter = b'--' + self.boundary + CRLF
+        # Everything after the HTML part is the same for every recipient
+        self._tail = b''.join(CRLF + delimiter + serialize_part(part).rstrip(CRLF) for part in shared_parts)
+        self._tail += CRLF + b'--' + self.boundary + b'--' + CRLF
+        self._content_type = (
+            b'Content-Type: multipart/' + subtype.encode('ascii') +
+            b'; boundary="' + self.boundary + b'"\r\n'
+        )
+        self._static_headers = b'MIME-Version: 1.0\r\n' + self._content_type
+        self._delimiter = delimiter
+
+    @property
+    def shared_size(self):
+        return len(self._tail)
+
+    @property
+    def tail(self):
+        """The bytes every message from this builder ends with (before any attachments)"""
+        return self._tail
+
+    def build(self, sender, to, subject, html, date=None, message_id=None, extra_headers=None,
+              mixed_boundary=None):
+        """Return the wire bytes of one personalized message.
+
+        With mixed_boundary the message is multipart/mixed and is returned open: the caller
+        appends the attachment parts and the closing delimiter. Raises HeaderInjectionError
+        if a header name or value contains a line break.
+        """
+        supplied = [('Subject', subject), ('From', sender), ('To', to), ('Date', date), ('Message-ID', message_id)]
+        supplied.extend((extra_headers or {}).items())
+        for name, value in supplied:
+            if has_line_break(name, value):
+                raise HeaderInjectionError(f'{name!r} header contains a line break')
+
+        headers = [
+            ('Subject', encode_header_value(subject)),
+            ('From', encode_address(sender)),
+            ('To', to),
+            ('Date', date or formatdate(localtime=True)),
+            ('Message-ID', message_id or make_msgid())
+        ]
+        if extra_headers:
+            headers.extend((name, encode_header_value(value)) for name, value in extra_headers.items())
+
+        head = ''.join(f'{name}: {value}\r\n' for name, value in headers).encode('utf-8')
+        if mixed_boundary:
+            head += (b'MIME-Version: 1.0\r\n'
+                     b'Content-Type: multipart/mixed; boundary="' + mixed_boundary + b'"\r\n'
+                     b'\r\n'
+                     b'--' + mixed_boundary + CRLF + self._content_type)
+        else:
+            head += self._static_headers
+        return b''.join((
+            head,
+            CRLF,
+            self._delimiter,
+            html_part_bytes(html).rstrip(CRLF),
+            self._tail
+        ))
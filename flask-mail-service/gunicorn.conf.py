@@ -0,0 +1,36 @@
+"""
+Gunicorn settings for the mail service.
+The app is loaded once in the master (preload_app) so templates are compiled and assets
+read before the workers fork; each worker starts with them already in memory.
+"""
+
+import gc
+import os
+
+wsgi_app = 'app:warm_app()'
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+
+
+def pre_fork(server, worker):
+    # Move everything loaded so far out of the collector's generations; otherwise the
+    # first collection in each worker touches (and so copies) every shared page
+    if preload_app:
+        gc.freeze()
+
+
+def post_worker_init(worker):
+    # Background pollers must run in the workers, not in the preloading master
+    import app
+    if app.outbox_poller is not None:
+        app.outbox_poller.start()
+    # Probe now so /ready has a result by the time the load balancer asks
+    if app.relay_pool is None:
+        app.smtp_probe.start()
+    # Tracing state is per worker; MEMORY_TRACE_FRAMES traces every worker from the start,
+    # so an /admin/memory report is meaningful whichever worker answers it
+    if os.environ.get('MEMORY_TRACE_FRAMES'):
+        app.memory_tracer.start(int(os.environ['MEMORY_TRACE_FRAMES']))
@@ -0,0 +1,203 @@
+"""
+Locale-aware template resolution and formatting.
+A requested locale such as "es-MX" is negotiated once against the locales that have
+templates (subdirectories of templates/, plus the default), walking a fallback chain
+es-MX -> es -> default. Localized variants live at templates/<locale>/<name>.html and
+shadow the default template of the same name; the resolved name for each (template,
+locale) pair is cached, so adding locales does not add per-request work. Date and number
+formats are built once per locale at import and exposed to templates as the `localdate`
+and `localnumber` filters.
+"""
+
+import os
+import re
+import threading
+from functools import lru_cache
+from datetime import date, datetime
+from jinja2 import pass_context
+
+# The language of the un-prefixed templates, and the locale used when a caller sends none
+BASE_LOCALE = 'en'
+DEFAULT_LOCALE = BASE_LOCALE
+
+_LOCALE = re.compile(r'^[a-z]{2,3}(-[a-z0-9]{2,8})*$')
+
+
+class LocaleFormats:
+    """Precomputed date and number conventions for one locale"""
+
+    def __init__(self, code, months, date_long, date_short, decimal, group, min_grouping=4):
+        self.code = code
+        self.months = months
+        self.date_long = date_long
+        self.date_short = date_short
+        self.decimal = decimal
+        self.group = group
+        self.min_grouping = min_grouping
+
+    def format_date(self, value, style='long'):
+        """Format a date, datetime or ISO date string; other strings are returned unchanged"""
+        if isinstance(value, str):
+            try:
+                value = date.fromisoformat(value[:10])
+            except ValueError:
+                return value
+        if not isinstance(value, (date, datetime)):
+            return value
+        pattern = self.date_short if style == 'short' else self.date_long
+        return pattern.format(day=value.day, day2=f'{value.day:02d}', month=self.months[value.month - 1],
+                              month2=f'{value.month:02d}', year=value.year)
+
+    def format_number(self, value, decimals=None):
+        """Group digits and use the locale's decimal mark; non-numbers are returned unchanged"""
+        if isinstance(value, str):
+            try:
+                value = float(value) if '.' in value else int(value)
+            except ValueError:
+                return value
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            return value
+        if decimals is None:
+            decimals = 0 if float(value).is_integer() else 2
+        text = f'{abs(value):.{decimals}f}'
+        whole, _, fraction = text.partition('.')
+        if len(whole) >= self.min_grouping:
+            whole = f'{int(whole):,}'.replace(',', self.group)
+        if fraction:
+            fraction = fraction.rstrip('0')
+        text = whole + (self.decimal + fraction if fraction else '')
+        return '-' + text if value < 0 else text
+
+
+FORMATS = {
+    'en': LocaleFormats(
+        'en',
+        ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September',
+         'October', 'November', 'December'],
+        date_long='{month} {day}, {year}', date_short='{month2}/{day2}/{year}',
+        decimal='.', group=','
+    ),
+    'es': LocaleFormats(
+        'es',
+        ['enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio', 'julio', 'agosto', 'septiembre',
+         'octubre', 'noviembre', 'diciembre'],
+        date_long='{day} de {month} de {year}', date_short='{day2}/{month2}/{year}',
+        # Spanish only groups numbers of five or more digits
+        decimal=',', group='.', min_grouping=5
+    )
+}
+
+# Subjects the service itself writes (callers of /api/send-email pass their own)
+SUBJECTS = {
+    'en': {
+        'welcome': 'Welcome to NOVAKINETIX ACADEMY!',
+        'password_reset': 'Reset Your NOVAKINETIX ACADEMY Password'
+    },
+    'es': {
+        'welcome': '¡Bienvenido a NOVAKINETIX ACADEMY!',
+        'password_reset': 'Restablece tu contraseña de NOVAKINETIX ACADEMY'
+    }
+}
+
+
+def normalize_locale(value):
+    """"es_MX" / "ES-mx" -> "es-mx"; None for anything that is not a locale tag"""
+    if not value or not isinstance(value, str):
+        return None
+    value = value.strip().replace('_', '-').lower()
+    return value if _LOCALE.match(value) else None
+
+
+def locale_chain(value, default=DEFAULT_LOCALE):
+    """Fallback chain for a locale tag: es-mx -> ["es-mx", "es", default]"""
+    chain = []
+    value = normalize_locale(value)
+    while value:
+        chain.append(value)
+        value = value.rpartition('-')[0]
+    if default not in chain:
+        chain.append(default)
+    return chain
+
+
+@lru_cache(maxsize=64)
+def formats_for(locale):
+    """Formats for a negotiated locale, falling back along its chain (memoized per locale)"""
+    for code in locale_chain(locale):
+        if code in FORMATS:
+            return FORMATS[code]
+    return FORMATS[DEFAULT_LOCALE]
+
+
+@pass_context
+def localdate(context, value, style='long'):
+    return formats_for(context.get('locale')).format_date(value, style)
+
+
+@pass_context
+def localnumber(context, value, decimals=None):
+    return formats_for(context.get('locale')).format_number(value, decimals)
+
+
+def install_filters(env):
+    """Register the locale filters on a Jinja environment"""
+    env.filters['localdate'] = localdate
+    env.filters['localnumber'] = localnumber
+    return env
+
+
+class TemplateLocalizer:
+    """Negotiates locales and maps (template, locale) to the template name to render"""
+
+    def __init__(self, template_dir, default_locale=DEFAULT_LOCALE):
+        self.template_dir = template_dir
+        self.default_locale = default_locale
+        self.locales = {BASE_LOCALE, default_locale}
+        if os.path.isdir(template_dir):
+            self.locales.update(entry for entry in os.listdir(template_dir)
+                                if os.path.isdir(os.path.join(template_dir, entry)) and normalize_locale(entry) == entry)
+        self._negotiated = {}
+        self._resolved = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, template_dir):
+        """Build from DEFAULT_LOCALE"""
+        return cls(template_dir, normalize_locale(os.environ.get('DEFAULT_LOCALE')) or DEFAULT_LOCALE)
+
+    def negotiate(self, requested):
+        """The best available locale for a requested tag (the default when nothing matches)"""
+        if not requested:
+            return self.default_locale
+        locale = self._negotiated.get(requested)
+        if locale is None:
+            locale = next((code for code in locale_chain(requested, self.default_locale) if code in self.locales),
+                          self.default_locale)
+            with self._lock:
+                # Only well-formed tags are remembered, so junk input cannot grow the cache
+                if normalize_locale(requested) and len(self._negotiated) < 1024:
+                    self._negotiated[requested] = locale
+        return locale
+
+    def resolve(self, name, locale):
+        """Template file to render name in a negotiated locale, or None to use the default"""
+        key = (name, locale)
+        if key in self._resolved:
+            return self._resolved[key]
+        resolved = None
+        for code in locale_chain(locale, BASE_LOCALE):
+            if code == BASE_LOCALE:
+                break
+            candidate = f'{code}/{name}.html'
+            if os.path.exists(os.path.join(self.template_dir, candidate)):
+                resolved = candidate
+                break
+        with self._lock:
+            self._resolved[key] = resolved
+        return resolved
+
+    def subject(self, key, locale):
+        for code in locale_chain(locale, self.default_locale):
+            if key in SUBJECTS.get(code, {}):
+                return SUBJECTS[code][key]
+        return SUBJECTS[DEFAULT_LOCALE][key]
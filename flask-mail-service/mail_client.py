@@ -0,0 +1,321 @@
+"""
+Python client for the mail service, for back-office scripts (roster imports, term-end
+reports) that would otherwise make one HTTP request per email.
+Individual send() calls are queued and coalesced into /api/send-batch requests: a batch
+goes out once max_batch messages are waiting or batch_window seconds after its first
+message, whichever comes first. Batches are submitted by a small pool of threads, at
+most max_inflight at a time, over keep-alive connections; while they are all busy new
+sends keep accumulating, so a slow service gets fewer, larger batches. Each send()
+returns a Future that a background thread resolves from the batch response. 429
+responses are retried after their Retry-After. A batch is re-sent on a fresh connection
+only if sending it failed; once it has been sent, a lost response is reported as an
+error rather than risking the batch being delivered twice.
+
+    with MailClient('http://mail-service:5000') as client:
+        futures = [client.send(row['email'], 'welcome', {'user_name': row['name']},
+                               subject='Welcome!') for row in roster]
+    failed = [f.result() for f in futures if f.result()['status'] == 'failed']
+
+Only the standard library is used.
+"""
+
+import os
+import json
+import time
+import queue
+import select
+import socket
+import logging
+import threading
+import http.client
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_WINDOW = 0.05
+DEFAULT_MAX_BATCH = 100
+DEFAULT_MAX_INFLIGHT = 4
+DEFAULT_TIMEOUT = 30
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_MAX_RETRY_WAIT = 30
+
+# Reconnect rather than reuse a connection idle this long; gunicorn closes idle
+# keep-alive connections after 2 seconds
+IDLE_TIMEOUT = 1.5
+
+# Errors that mean a reused connection was closed by the server before it read the request
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class MailClientError(Exception):
+    """The service rejected a request or could not be reached"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class MailClient:
+    """Keep-alive client that batches individual sends into /api/send-batch"""
+
+    def __init__(self, base_url, batch_window=DEFAULT_BATCH_WINDOW, max_batch=DEFAULT_MAX_BATCH,
+                 max_inflight=DEFAULT_MAX_INFLIGHT, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES,
+                 max_retry_wait=DEFAULT_MAX_RETRY_WAIT, headers=None):
+        url = urlsplit(base_url)
+        if url.scheme not in ('http', 'https'):
+            raise ValueError(f'Unsupported URL: {base_url}')
+        self._connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.host = url.hostname
+        self.port = url.port
+        self.prefix = url.path.rstrip('/')
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_inflight = max_inflight
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_retry_wait = max_retry_wait
+        self.headers = dict(headers or {})
+        self.stats = {'batches': 0, 'messages': 0, 'retries': 0, 'connections': 0}
+
+        self._pending = []
+        self._unfinished = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._connections = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_inflight)
+        self._executor = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix='mail-client')
+        self._batcher = threading.Thread(target=self._run_batcher, name='mail-client-batcher', daemon=True)
+        self._batcher.start()
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """Build from MAIL_SERVICE_URL, MAIL_CLIENT_BATCH_WINDOW, MAIL_CLIENT_MAX_BATCH and
+        MAIL_CLIENT_MAX_INFLIGHT"""
+        return cls(
+            os.environ.get('MAIL_SERVICE_URL', 'http://localhost:5000'),
+            batch_window=float(os.environ.get('MAIL_CLIENT_BATCH_WINDOW', DEFAULT_BATCH_WINDOW)),
+            max_batch=int(os.environ.get('MAIL_CLIENT_MAX_BATCH', DEFAULT_MAX_BATCH)),
+            max_inflight=int(os.environ.get('MAIL_CLIENT_MAX_INFLIGHT', DEFAULT_MAX_INFLIGHT)),
+            **kwargs
+        )
+
+    def send(self, to, template, template_data=None, subject=None, locale=None, priority=None):
+        """Queue one templated email; the Future resolves to {'to', 'status', 'error'} with
+        status 'sent', 'failed' or 'suppressed', or raises MailClientError if the batch
+        request itself failed"""
+        message = {'to': to, 'template': template, 'template_data': template_data or {}}
+        if subject is not None:
+            message['subject'] = subject
+        if locale is not None:
+            message['locale'] = locale
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('MailClient is closed')
+            self._pending.append((priority, message, future, time.monotonic()))
+            self._unfinished += 1
+            self._cond.notify_all()
+        return future
+
+    def post(self, path, body):
+        """POST JSON to any endpoint on a pooled connection, returning (status, json)"""
+        status, _, data = self._request('POST', path, body)
+        return status, data
+
+    def flush(self, timeout=None):
+        """Wait until every message queued so far has a result; False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._unfinished:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self):
+        """Send whatever is queued, wait for it, and close the connections"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._batcher.join()
+        self._executor.shutdown(wait=True)
+        while True:
+            try:
+                connection, _ = self._connections.get_nowait()
+            except queue.Empty:
+                break
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run_batcher(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                # Give the batch until batch_window after its first message to fill up
+                deadline = self._pending[0][3] + self.batch_window
+                while len(self._pending) < self.max_batch and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            # Wait for a free slot outside the lock; sends queued meanwhile join the batch
+            self._slots.acquire()
+            with self._cond:
+                batch = self._take_batch()
+            self._executor.submit(self._submit_batch, *batch)
+
+    def _take_batch(self):
+        """Up to max_batch pending messages sharing the first one's priority"""
+        priority = self._pending[0][0]
+        taken, kept = [], []
+        for item in self._pending:
+            if item[0] == priority and len(taken) < self.max_batch:
+                taken.append(item)
+            else:
+                kept.append(item)
+        self._pending = kept
+        return priority, [(message, future) for _, message, future, _ in taken]
+
+    def _submit_batch(self, priority, items):
+        try:
+            body = {'messages': [message for message, _ in items]}
+            if priority:
+                body['priority'] = priority
+            try:
+                status, data = self._post_with_retry('/api/send-batch', body)
+                if status != 200:
+                    raise MailClientError(data.get('error') or f'HTTP {status}', status)
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                return
+            self._count(batches=1, messages=len(items))
+            for (message, future), result in zip(items, match_results(items, data)):
+                future.set_result(result)
+        finally:
+            self._slots.release()
+            with self._cond:
+                self._unfinished -= len(items)
+                self._cond.notify_all()
+
+    def _post_with_retry(self, path, body):
+        for attempt in range(self.max_retries + 1):
+            status, headers, data = self._request('POST', path, body)
+            if status != 429 or attempt == self.max_retries:
+                return status, data
+            self._count(retries=1)
+            try:
+                wait = float(headers.get('Retry-After', 1))
+            except ValueError:
+                wait = 1.0
+            logger.info("Mail service is shedding load; retrying in %.1fs", wait)
+            time.sleep(min(wait, self.max_retry_wait))
+        return status, data
+
+    def _request(self, method, path, body=None):
+        payload = json.dumps(body).encode('utf-8') if body is not None else None
+        headers = dict(self.headers, Accept='application/json')
+        if payload is not None:
+            headers['Content-Type'] = 'application/json'
+        connection = None
+        try:
+            connection, reused = self._get_connection()
+            try:
+                connection.request(method, self.prefix + path, body=payload, headers=headers)
+            except STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                # The server closed the idle connection before the request was sent
+                connection.close()
+                connection, reused = self._new_connection(), False
+                connection.request(method, self.prefix + path, body=payload, headers=headers)
+            # Not retried from here on: the server may already have acted on the request
+            response = connection.getresponse()
+            raw = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            if connection is not None:
+                connection.close()
+            raise MailClientError(f'Request to {path} failed: {e}') from e
+        if response.will_close:
+            connection.close()
+        else:
+            self._connections.put((connection, time.monotonic()))
+        try:
+            data = json.loads(raw) if raw else {}
+        except ValueError:
+            data = {'error': raw[:200].decode('utf-8', 'replace')}
+        return response.status, response.headers, data
+
+    def _get_connection(self):
+        while True:
+            try:
+                connection, idle_since = self._connections.get_nowait()
+            except queue.Empty:
+                return self._new_connection(), False
+            if time.monotonic() - idle_since < IDLE_TIMEOUT and not connection_dropped(connection):
+                return connection, True
+            connection.close()
+
+    def _count(self, **amounts):
+        with self._cond:
+            for name, amount in amounts.items():
+                self.stats[name] += amount
+
+    def _new_connection(self):
+        self._count(connections=1)
+        connection = self._connection_class(self.host, self.port, timeout=self.timeout)
+        connection.connect()
+        # Requests are small; don't let Nagle hold the body back behind the headers
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return connection
+
+
+def connection_dropped(connection):
+    """True if an idle connection is unusable: the server has closed it (or sent
+    something unrequested), which shows as the socket being readable"""
+    if connection.sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([connection.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+def match_results(items, data):
+    """Per-message results from a /api/send-batch response, in the order of items.
+
+    The response lists failures and suppressions by address, so repeated addresses are
+    matched to messages in order.
+    """
+    failures = defaultdict(list)
+    for failure in data.get('failed', []):
+        failures[failure.get('to')].append(failure.get('error'))
+    suppressed = defaultdict(int)
+    for to in data.get('suppressed', []):
+        suppressed[to] += 1
+    results = []
+    for message, _ in items:
+        to = message['to']
+        if failures.get(to):
+            results.append({'to': to, 'status': 'failed', 'error': failures[to].pop(0)})
+        elif suppressed.get(to):
+            suppressed[to] -= 1
+            results.append({'to': to, 'status': 'suppressed', 'error': None})
+        else:
+            results.append({'to': to, 'status': 'sent', 'error': None})
+    return results
@@ -0,0 +1,131 @@
+"""
+On-demand allocation tracing for tracking down slow memory growth in a worker.
+An admin starts tracemalloc, lets traffic run, and asks for a report: the allocation
+sites whose traced size changed most since the previous report (or since tracing
+started), plus the current size of the service's long-lived structures (the email
+queue, template and preview caches, attachment cache) and the process RSS. Tracing is
+off until started and tracemalloc is stopped again afterwards, so a worker that is not
+being investigated pays nothing beyond one attribute check; structure sizes are read
+only when a report is requested. Tracing state is per process: every report carries the
+pid, so reports from different gunicorn workers are not mistaken for one another.
+"""
+
+import os
+import linecache
+import threading
+import tracemalloc
+
+DEFAULT_FRAMES = 1
+MAX_FRAMES = 25
+DEFAULT_LIMIT = 20
+
+GROUP_BY = ('lineno', 'filename', 'traceback')
+
+# Allocations made by the tracing machinery itself are not interesting
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>')
+)
+
+
+def rss_bytes():
+    """Resident set size of this process, or None where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _site(stat, group_by):
+    frames = stat.traceback
+    if group_by == 'filename':
+        return frames[0].filename
+    if group_by == 'traceback':
+        return [f'{frame.filename}:{frame.lineno}' for frame in frames]
+    return f'{frames[0].filename}:{frames[0].lineno}'
+
+
+class MemoryTracer:
+    """Starts and stops tracemalloc and diffs snapshots of it on request"""
+
+    def __init__(self):
+        self._sizes = {}
+        self._start = None
+        self._previous = None
+        self._lock = threading.Lock()
+
+    def register(self, name, size):
+        """Report size() (a length or byte count) under name in every report"""
+        self._sizes[name] = size
+
+    @property
+    def tracing(self):
+        return self._start is not None
+
+    def start(self, frames=DEFAULT_FRAMES):
+        """Start tracing, keeping `frames` frames per allocation, and take the baseline snapshot"""
+        if not 1 <= frames <= MAX_FRAMES:
+            raise ValueError(f"frames must be between 1 and {MAX_FRAMES}")
+        with self._lock:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            tracemalloc.start(frames)
+            self._start = self._previous = self._snapshot()
+
+    def stop(self):
+        """Stop tracing and free the traces and snapshots"""
+        with self._lock:
+            self._start = self._previous = None
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+    def sizes(self):
+        """Current size of every registered structure"""
+        result = {}
+        for name, size in self._sizes.items():
+            try:
+                result[name] = size()
+            except Exception as e:
+                result[name] = f'error: {e}'
+        return result
+
+    def report(self, limit=DEFAULT_LIMIT, group_by='lineno', since='last'):
+        """Top allocation sites by growth since the last report (since='last') or since
+        tracing started (since='start'), with structure sizes and RSS"""
+        if group_by not in GROUP_BY:
+            raise ValueError(f"group_by must be one of {', '.join(GROUP_BY)}")
+        if since not in ('last', 'start'):
+            raise ValueError("since must be 'last' or 'start'")
+        result = {'pid': os.getpid(), 'tracing': self.tracing, 'rss_bytes': rss_bytes(), 'sizes': self.sizes()}
+        with self._lock:
+            if self._start is None:
+                return result
+            snapshot = self._snapshot()
+            baseline = self._start if since == 'start' else self._previous
+            self._previous = snapshot
+        stats = snapshot.compare_to(baseline, group_by)
+        current, peak = tracemalloc.get_traced_memory()
+        result.update({
+            'traced_bytes': current,
+            'peak_traced_bytes': peak,
+            'tracemalloc_overhead_bytes': tracemalloc.get_tracemalloc_memory(),
+            'since': since,
+            'top': [
+                {
+                    'site': _site(stat, group_by),
+                    'size_diff': stat.size_diff,
+                    'size': stat.size,
+                    'count_diff': stat.count_diff,
+                    'count': stat.count
+                }
+                for stat in stats[:limit]
+            ]
+        })
+        return result
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(_IGNORED)
@@ -0,0 +1,119 @@
+"""
+HTML minification for outgoing email bodies.
+Collapses whitespace, drops comments (keeping Outlook conditional comments) and tidies
+class/style attributes, while leaving <pre>, <textarea> and <script> content untouched
+and keeping a single space between inline elements. Template sources can be minified
+once at load time through MinifyingLoader so static sections cost nothing per render.
+"""
+
+import os
+import re
+from jinja2 import BaseLoader
+
+MODE_OFF = 'off'
+MODE_STATIC = 'static'   # minify template sources once at load time
+MODE_FULL = 'full'       # also minify every rendered message
+
+_PRESERVE = re.compile(r'<(pre|textarea|script)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_STYLE_BLOCK = re.compile(r'(<style\b[^>]*>)(.*?)(</style\s*>)', re.IGNORECASE | re.DOTALL)
+_COMMENT = re.compile(r'<!--(?!\[if|<!\[endif|\s*\[endif).*?-->', re.DOTALL)
+_JINJA = re.compile(r'\{\{.*?\}\}|\{%.*?%\}|\{#.*?#\}', re.DOTALL)
+_TAG = re.compile(r'<(/?)([a-zA-Z!][a-zA-Z0-9]*)[^>]*>')
+_BETWEEN_TAGS = re.compile(r'(<[^>]+>)\s+(?=<)')
+_WHITESPACE = re.compile(r'\s+')
+_ATTR = re.compile(r'\s(class|style)\s*=\s*"([^"]*)"', re.IGNORECASE)
+_DEFAULT_TYPE = re.compile(r'\s+type\s*=\s*"text/(?:css|javascript)"', re.IGNORECASE)
+_CSS_PUNCT = re.compile(r'\s*([{};,>])\s*')
+
+# Whitespace next to these tags never renders, so it can be dropped entirely
+BLOCK_TAGS = frozenset((
+    '!doctype', 'html', 'head', 'body', 'meta', 'title', 'link', 'style', 'div', 'p', 'table',
+    'thead', 'tbody', 'tfoot', 'tr', 'td', 'th', 'ul', 'ol', 'li', 'h1', 'h2', 'h3', 'h4', 'h5',
+    'h6', 'br', 'hr', 'center', 'blockquote', 'section', 'header', 'footer', 'dl', 'dt', 'dd'
+))
+
+
+def _stash(pattern, text, store, marker):
+    """Replace matches with placeholders so later passes leave them alone"""
+    def keep(match):
+        store.append(match.group(0))
+        return f'\x00{marker}{len(store) - 1}\x00'
+    return pattern.sub(keep, text)
+
+
+def _restore(text, store, marker):
+    for index in range(len(store) - 1, -1, -1):
+        text = text.replace(f'\x00{marker}{index}\x00', store[index])
+    return text
+
+
+def _minify_css(css):
+    css = _WHITESPACE.sub(' ', css)
+    css = _CSS_PUNCT.sub(r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+def _tidy_attribute(match):
+    name, value = match.group(1), _WHITESPACE.sub(' ', match.group(2)).strip()
+    if name.lower() == 'style':
+        value = re.sub(r'\s*([:;])\s*', r'\1', value).rstrip(';')
+    return f' {name}="{value}"'
+
+
+def _drop_block_whitespace(match):
+    tag = match.group(1)
+    following = match.string[match.end():match.end() + 40]
+    names = [_TAG.match(tag), _TAG.match(following)]
+    if any(m and m.group(2).lower() in BLOCK_TAGS for m in names):
+        return tag
+    return tag + ' '
+
+
+def minify_html(html, template_source=False):
+    """Minify an HTML document; set template_source when the text still contains Jinja syntax"""
+    if not html:
+        return html
+
+    preserved = []
+    jinja = []
+    text = html
+    if template_source:
+        text = _stash(_JINJA, text, jinja, 'J')
+    text = _stash(_PRESERVE, text, preserved, 'P')
+
+    text = _COMMENT.sub('', text)
+    text = _STYLE_BLOCK.sub(lambda m: m.group(1) + _minify_css(m.group(2)) + m.group(3), text)
+    text = _DEFAULT_TYPE.sub('', text)
+    text = _ATTR.sub(_tidy_attribute, text)
+    text = _WHITESPACE.sub(' ', text)
+    text = _BETWEEN_TAGS.sub(_drop_block_whitespace, text)
+
+    text = _restore(text, preserved, 'P')
+    if template_source:
+        text = _restore(text, jinja, 'J')
+    return text.strip()
+
+
+def minify_mode():
+    """Configured mode from MINIFY_HTML: off, static or full"""
+    mode = os.environ.get('MINIFY_HTML', MODE_OFF).lower()
+    return mode if mode in (MODE_STATIC, MODE_FULL) else MODE_OFF
+
+
+class MinifyingLoader(BaseLoader):
+    """Wraps a Jinja loader and minifies template sources once, before compilation"""
+
+    def __init__(self, loader, metrics=None):
+        self.loader = loader
+        self.metrics = metrics
+
+    def get_source(self, environment, template):
+        source, filename, uptodate = self.loader.get_source(environment, template)
+        minified = minify_html(source, template_source=True)
+        if self.metrics:
+            self.metrics.set_gauge('template_bytes', len(source.encode('utf-8')), template=template, stage='source')
+            self.metrics.set_gauge('template_bytes', len(minified.encode('utf-8')), template=template, stage='minified')
+        return minified, filename, uptodate
+
+    def list_templates(self):
+        return self.loader.list_templates()
@@ -0,0 +1,374 @@
+"""
+Outbox pull mode: instead of calling the HTTP API once per email, producers INSERT rows
+into an outbox table and the service drains it.
+
+    INSERT INTO outbox (recipient, template, subject, template_data)
+    VALUES ('student@example.com', 'welcome', 'Welcome!', '{"user_name": "Sam"}');
+
+Each worker polls the table and claims up to batch_size ready rows in one UPDATE, so two
+workers (or two hosts) never claim the same row; a claim that is not finished within the
+lease (a worker died mid-batch) becomes claimable again. Claimed rows go through the same
+render-and-send pipeline as /api/send-batch, and their outcomes are written back in one
+transaction: sent rows with a single UPDATE, failures with one executemany. Failed sends
+are retried with exponential backoff until max_attempts; invalid rows fail at once.
+A full batch is followed immediately by the next poll, an empty or partial one waits
+interval seconds, so the service sets its own pace however fast rows are inserted.
+
+OUTBOX_DSN is either sqlite:///path/to/outbox.sqlite3 or a postgresql:// DSN (which needs
+psycopg2; claims there use FOR UPDATE SKIP LOCKED).
+"""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+
+try:
+    import psycopg2
+except ImportError:  # only needed for a postgresql:// OUTBOX_DSN
+    psycopg2 = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_INTERVAL = 1.0
+DEFAULT_LEASE = 300
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_BACKOFF = 60
+
+STATUS_PENDING = 'pending'
+STATUS_CLAIMED = 'claimed'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+STATUS_SUPPRESSED = 'suppressed'
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recipient TEXT NOT NULL,
+    template TEXT NOT NULL,
+    subject TEXT,
+    template_data TEXT NOT NULL DEFAULT '{}',
+    locale TEXT,
+    priority TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,
+    claimed_by TEXT,
+    claimed_at REAL,
+    last_error TEXT,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_ready ON outbox (status, available_at, id);
+"""
+
+POSTGRES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id BIGSERIAL PRIMARY KEY,
+    recipient TEXT NOT NULL,
+    template TEXT NOT NULL,
+    subject TEXT,
+    template_data TEXT NOT NULL DEFAULT '{}',
+    locale TEXT,
+    priority TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at DOUBLE PRECISION NOT NULL DEFAULT 0,
+    claimed_by TEXT,
+    claimed_at DOUBLE PRECISION,
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    finished_at DOUBLE PRECISION
+);
+CREATE INDEX IF NOT EXISTS outbox_ready ON outbox (status, available_at, id);
+"""
+
+COLUMNS = ('id', 'recipient', 'template', 'subject', 'template_data', 'locale', 'priority', 'attempts')
+
+# Ready rows, and rows whose claim has outlived the lease, oldest first
+CLAIM_SQL = """
+UPDATE outbox SET status = 'claimed', claimed_by = {p}, claimed_at = {p}, attempts = attempts + 1
+WHERE id IN (
+    SELECT id FROM outbox
+    WHERE (status = 'pending' AND available_at <= {p}) OR (status = 'claimed' AND claimed_at <= {p})
+    ORDER BY id LIMIT {p}{lock}
+)
+RETURNING """ + ', '.join(COLUMNS)
+
+
+class OutboxStore:
+    """Claims and completes outbox rows; subclasses supply the connection and paramstyle"""
+
+    placeholder = '?'
+    claim_lock = ''
+
+    def connection(self):
+        raise NotImplementedError
+
+    def _sql(self, query):
+        return query.replace('?', self.placeholder)
+
+    def claim(self, limit, owner, lease=DEFAULT_LEASE):
+        """Atomically claim up to limit ready rows for owner; returns them as dicts"""
+        now = time.time()
+        query = CLAIM_SQL.format(p=self.placeholder, lock=self.claim_lock)
+        conn = self.connection()
+        with self._transaction(conn) as cursor:
+            cursor.execute(query, (owner, now, now, now - lease, limit))
+            rows = [dict(zip(COLUMNS, row)) for row in cursor.fetchall()]
+        return sorted(rows, key=lambda row: row['id'])
+
+    def finish(self, owner, results):
+        """Record outcomes [(id, status, error, available_at)] for rows owner still holds"""
+        now = time.time()
+        sent = [row_id for row_id, status, _, _ in results if status == STATUS_SENT]
+        others = [(status, error, available_at or 0, now if status != STATUS_PENDING else None, row_id, owner)
+                  for row_id, status, error, available_at in results if status != STATUS_SENT]
+        conn = self.connection()
+        with self._transaction(conn) as cursor:
+            if sent:
+                marks = ', '.join([self.placeholder] * len(sent))
+                cursor.execute(self._sql(
+                    f"UPDATE outbox SET status = 'sent', last_error = NULL, finished_at = ?, claimed_by = NULL "
+                    f"WHERE claimed_by = ? AND status = 'claimed' AND id IN ({marks})"), [now, owner] + sent)
+            if others:
+                cursor.executemany(self._sql(
+                    "UPDATE outbox SET status = ?, last_error = ?, available_at = ?, finished_at = ?, claimed_by = NULL "
+                    "WHERE id = ? AND claimed_by = ? AND status = 'claimed'"), others)
+
+    def enqueue(self, recipient, template, subject=None, template_data=None, locale=None, priority=None):
+        """Insert one row; producers usually INSERT directly"""
+        conn = self.connection()
+        with self._transaction(conn) as cursor:
+            cursor.execute(self._sql(
+                'INSERT INTO outbox (recipient, template, subject, template_data, locale, priority) '
+                'VALUES (?, ?, ?, ?, ?, ?)'),
+                (recipient, template, subject, json.dumps(template_data or {}), locale, priority))
+
+    def counts(self):
+        """Number of rows per status"""
+        with self._transaction(self.connection()) as cursor:
+            cursor.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status')
+            return dict(cursor.fetchall())
+
+
+class _Transaction:
+    """Cursor in a transaction that commits on success and rolls back on error. SQLite
+    connections are in autocommit mode and get an explicit BEGIN; psycopg2 opens one
+    implicitly."""
+
+    def __init__(self, conn, begin=None):
+        self.conn = conn
+        self.begin = begin
+
+    def __enter__(self):
+        self.cursor = self.conn.cursor()
+        if self.begin:
+            self.cursor.execute(self.begin)
+        return self.cursor
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self.begin:
+                self.cursor.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+            elif exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            self.cursor.close()
+
+
+class SQLiteOutbox(OutboxStore):
+    """Outbox table in a local SQLite file (WAL, one connection per thread)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SQLITE_SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _transaction(self, conn):
+        # Take the write lock up front so the claim's SELECT and UPDATE see the same rows
+        return _Transaction(conn, 'BEGIN IMMEDIATE')
+
+
+class PostgresOutbox(OutboxStore):
+    """Outbox table in PostgreSQL; concurrent claimers skip each other's locked rows"""
+
+    placeholder = '%s'
+    claim_lock = ' FOR UPDATE SKIP LOCKED'
+
+    def __init__(self, dsn):
+        if psycopg2 is None:
+            raise RuntimeError("A postgresql:// OUTBOX_DSN needs the psycopg2 package")
+        self.dsn = dsn
+        self._local = threading.local()
+        self._schema_ready = False
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or conn.closed or self._local.pid != os.getpid():
+            conn = psycopg2.connect(self.dsn)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            if not self._schema_ready:
+                with self._transaction(conn) as cursor:
+                    cursor.execute(POSTGRES_SCHEMA)
+                self._schema_ready = True
+        return conn
+
+    def _transaction(self, conn):
+        return _Transaction(conn)
+
+
+def open_outbox(dsn):
+    """OutboxStore for a sqlite:/// or postgresql:// DSN"""
+    if dsn.startswith('sqlite:///'):
+        return SQLiteOutbox(dsn[len('sqlite:///'):])
+    if dsn.startswith(('postgres://', 'postgresql://')):
+        return PostgresOutbox(dsn)
+    raise ValueError(f"Unsupported OUTBOX_DSN: {dsn}")
+
+
+class OutboxPoller:
+    """Claims outbox rows in batches, hands them to deliver and records the results.
+
+    deliver(messages) gets a list of {'to', 'template', 'subject', 'template_data',
+    'locale', 'priority'} and returns one {'status', 'error'} per message, with status
+    'sent', 'failed', 'suppressed' or 'invalid'. Only rows whose own status is 'failed' are
+    retried, so deliver must report errors per message once it has started sending; it may
+    raise only before anything was sent, in which case the whole batch is retried.
+    """
+
+    def __init__(self, store, deliver, batch_size=DEFAULT_BATCH_SIZE, interval=DEFAULT_INTERVAL,
+                 lease=DEFAULT_LEASE, max_attempts=DEFAULT_MAX_ATTEMPTS, retry_backoff=DEFAULT_RETRY_BACKOFF,
+                 metrics=None):
+        self.store = store
+        self.deliver = deliver
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.metrics = metrics
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, deliver, metrics=None):
+        """Build from OUTBOX_DSN, OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL, OUTBOX_LEASE,
+        OUTBOX_MAX_ATTEMPTS and OUTBOX_RETRY_BACKOFF (None when OUTBOX_DSN is not set)"""
+        dsn = os.environ.get('OUTBOX_DSN')
+        if not dsn:
+            return None
+        return cls(
+            open_outbox(dsn),
+            deliver,
+            batch_size=int(os.environ.get('OUTBOX_BATCH_SIZE', DEFAULT_BATCH_SIZE)),
+            interval=float(os.environ.get('OUTBOX_POLL_INTERVAL', DEFAULT_INTERVAL)),
+            lease=float(os.environ.get('OUTBOX_LEASE', DEFAULT_LEASE)),
+            max_attempts=int(os.environ.get('OUTBOX_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)),
+            retry_backoff=float(os.environ.get('OUTBOX_RETRY_BACKOFF', DEFAULT_RETRY_BACKOFF)),
+            metrics=metrics
+        )
+
+    @staticmethod
+    def owner():
+        return f'{socket.gethostname()}:{os.getpid()}'
+
+    def poll_once(self):
+        """Claim, send and record one batch; returns the number of rows claimed"""
+        started = time.perf_counter()
+        owner = self.owner()
+        rows = self.store.claim(self.batch_size, owner, self.lease)
+        if not rows:
+            return 0
+
+        outcomes = [None] * len(rows)
+        messages = []
+        indices = []
+        for index, row in enumerate(rows):
+            try:
+                data = json.loads(row['template_data'] or '{}')
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                outcomes[index] = {'status': 'invalid', 'error': 'template_data is not a JSON object'}
+                continue
+            messages.append({'to': row['recipient'], 'template': row['template'], 'subject': row['subject'],
+                             'template_data': data, 'locale': row['locale'], 'priority': row['priority']})
+            indices.append(index)
+        if messages:
+            try:
+                delivered = self.deliver(messages)
+            except Exception as e:
+                # deliver raises only before it sends anything, so every row can be retried
+                logger.error("Outbox batch failed: %s", e)
+                delivered = [{'status': 'failed', 'error': str(e)}] * len(messages)
+            for index, outcome in zip(indices, delivered):
+                outcomes[index] = outcome
+
+        results = [self._result(row, outcome) for row, outcome in zip(rows, outcomes)]
+        self.store.finish(owner, results)
+        if self.metrics:
+            for _, status, _, _ in results:
+                self.metrics.incr('outbox_messages_total', status='retry' if status == STATUS_PENDING else status)
+            self.metrics.observe('outbox_batch_ms', (time.perf_counter() - started) * 1000)
+        return len(rows)
+
+    def _result(self, row, outcome):
+        status, error = outcome['status'], outcome.get('error')
+        if status == 'sent':
+            return row['id'], STATUS_SENT, None, None
+        if status == 'suppressed':
+            return row['id'], STATUS_SUPPRESSED, None, None
+        if status == 'failed' and row['attempts'] < self.max_attempts:
+            delay = self.retry_backoff * 2 ** (row['attempts'] - 1)
+            return row['id'], STATUS_PENDING, error, time.time() + delay
+        return row['id'], STATUS_FAILED, error, None
+
+    def run(self):
+        """Poll until stopped; full batches are followed at once by the next poll"""
+        while not self._stopped.is_set():
+            try:
+                claimed = self.poll_once()
+            except Exception as e:
+                logger.error("Outbox poll failed: %s", e)
+                claimed = 0
+            if claimed < self.batch_size:
+                self._stopped.wait(self.interval)
+
+    def start(self):
+        """Start the polling thread in this process if it is not already running"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._stopped.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self.run, name='outbox-poller', daemon=True)
+            self._thread.start()
+        logger.info("Polling outbox every %.1fs in batches of %d", self.interval, self.batch_size)
+
+    def stop(self, wait=True):
+        self._stopped.set()
+        thread = self._thread
+        if wait and thread is not None and thread.is_alive():
+            thread.join()
@@ -0,0 +1,117 @@
+"""
+Rendered-template previews for admins (GET /api/preview/<template>).
+A preview is identified by a strong ETag: a hash of the template version, the template
+name, the locale and a canonical hash of the data. The template version covers every
+template source the service loaded (in-module templates and templates/, after
+minification), so it only changes on deploy. A browser that sends the ETag back in
+If-None-Match gets a 304 without anything being rendered; other repeats are served from
+a small LRU of rendered HTML.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 64
+
+# Data used for any field the caller does not supply
+SAMPLE_DATA = {
+    'welcome': {
+        'user_name': 'Ada Lovelace',
+        'user_email': 'ada@example.com',
+        'login_url': 'https://novakinetix.academy/login'
+    },
+    'password_reset': {
+        'user_name': 'Ada Lovelace',
+        'reset_url': 'https://novakinetix.academy/reset-password?token=preview'
+    },
+    'volunteer_hours_approved': {
+        'user_name': 'Ada Lovelace',
+        'hours_count': 2.5,
+        'hours_date': '2024-05-01',
+        'activity_description': 'Math tutoring session',
+        'total_hours': 1250,
+        'dashboard_url': 'https://novakinetix.academy/dashboard'
+    },
+    'volunteer_hours_rejected': {
+        'user_name': 'Ada Lovelace',
+        'hours_count': 2.5,
+        'hours_date': '2024-05-01',
+        'activity_description': 'Math tutoring session',
+        'rejection_reason': 'Please add the name of the student you tutored.',
+        'dashboard_url': 'https://novakinetix.academy/dashboard'
+    },
+    'tutoring_session_confirmation': {
+        'user_name': 'Ada Lovelace',
+        'tutor_name': 'Grace Hopper',
+        'subject': 'Algebra',
+        'session_date': '2024-05-03',
+        'session_time': '4:00 PM',
+        'duration': 60,
+        'session_url': 'https://novakinetix.academy/sessions/preview'
+    }
+}
+
+
+def data_digest(data):
+    """Hash of JSON data that does not depend on key order or whitespace"""
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def templates_version(sources, template_dir, salt=''):
+    """Hash of the given template sources plus every file under template_dir"""
+    digest = hashlib.sha256(salt.encode('utf-8'))
+    for name in sorted(sources):
+        digest.update(f'\0{name}\0'.encode('utf-8'))
+        digest.update(sources[name].encode('utf-8'))
+    for root, dirs, files in os.walk(template_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            digest.update(f'\0{os.path.relpath(path, template_dir)}\0'.encode('utf-8'))
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+class PreviewCache:
+    """Strong ETags for previews and a small LRU of their rendered HTML"""
+
+    def __init__(self, version, max_entries=DEFAULT_CACHE_SIZE, metrics=None):
+        self.version = version
+        self.max_entries = max_entries
+        self.metrics = metrics
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def etag(self, template, locale, data):
+        key = f'{self.version}:{template}:{locale}:{data_digest(data)}'
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+    def get(self, etag):
+        with self._lock:
+            html = self._entries.get(etag)
+            if html is not None:
+                self._entries.move_to_end(etag)
+        self._record('hit' if html is not None else 'miss')
+        return html
+
+    def put(self, etag, html):
+        with self._lock:
+            self._entries[etag] = html
+            self._entries.move_to_end(etag)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record_not_modified(self):
+        self._record('not_modified')
+
+    def _record(self, result):
+        if self.metrics:
+            self.metrics.incr('preview_total', result=result)
+
+    def __len__(self):
+        return len(self._entries)
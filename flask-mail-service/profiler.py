@@ -0,0 +1,192 @@
+"""
+On-demand profiler for the next N send requests.
+An admin arms it in either "cprofile" mode (deterministic) or "sample" mode (a
+background thread samples the request thread and the mail lane workers at a fixed
+interval); results are aggregated until the admin reads or resets them.
+
+cProfile only sees the thread that enabled it, so lane jobs submitted by a profiled
+request are wrapped with wrap(), which runs them under their own profiler in the lane
+worker and merges the result. Work on other threads (the render process pool, the
+archive writer) is not covered; use "sample" mode for a whole-worker view.
+"""
+
+import io
+import sys
+import logging
+import threading
+from collections import Counter
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+MODES = ('cprofile', 'sample')
+SAMPLED_THREAD_PREFIX = 'mail-lane-'
+
+
+def _stack_key(frame, depth=30):
+    """Collapse a frame into "file:function:line;..." from outermost to innermost"""
+    parts = []
+    while frame is not None and len(parts) < depth:
+        code = frame.f_code
+        parts.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ';'.join(reversed(parts))
+
+
+class _Sampler:
+    """Samples the stacks of one request thread and of the lane workers until stopped"""
+
+    def __init__(self, thread_id, interval, counter, lock):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counter = counter
+        self.lock = lock
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='request-sampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        lane_ids = {t.ident for t in threading.enumerate() if t.name.startswith(SAMPLED_THREAD_PREFIX)}
+        while not self.stopped.wait(self.interval):
+            frames = sys._current_frames()
+            keys = []
+            for ident, frame in frames.items():
+                if ident == self.thread_id:
+                    keys.append('request;' + _stack_key(frame))
+                elif ident in lane_ids:
+                    keys.append('lane;' + _stack_key(frame))
+            with self.lock:
+                self.counter.update(keys)
+
+
+class RequestProfiler:
+    """Profiles the next N requests and aggregates the results"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.mode = None
+            self.remaining = 0
+            self.interval = 0.005
+            self.profiled = 0
+            self._stats = None
+            self._samples = Counter()
+
+    def arm(self, mode, requests, interval_ms=5):
+        """Profile the next `requests` requests in the given mode"""
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        if requests < 1:
+            raise ValueError("requests must be at least 1")
+        self.reset()
+        with self._lock:
+            self.mode = mode
+            self.remaining = requests
+            self.interval = max(interval_ms, 1) / 1000
+        logger.info("Profiler armed: %s for %d requests", mode, requests)
+
+    @property
+    def active(self):
+        return self.remaining > 0
+
+    def start_request(self):
+        """Called at the start of a request; returns a token if this request is profiled"""
+        if not self.remaining:
+            return None
+        with self._lock:
+            if not self.remaining:
+                return None
+            self.remaining -= 1
+            mode = self.mode
+
+        if mode == 'cprofile':
+            profile = self._enable()
+            if profile is None:
+                return None
+            self._local.profiling = True
+            return ('cprofile', profile)
+        return ('sample', _Sampler(threading.get_ident(), self.interval, self._samples, self._lock).start())
+
+    def finish_request(self, token):
+        if token is None:
+            return
+        mode, handle = token
+        if mode == 'cprofile':
+            self._local.profiling = False
+            handle.disable()
+            with self._lock:
+                self._merge(handle)
+                self.profiled += 1
+        else:
+            handle.stop()
+            with self._lock:
+                self.profiled += 1
+
+    def wrap(self, fn):
+        """fn, profiled in whichever thread runs it if the calling request is being cProfiled"""
+        if not getattr(self._local, 'profiling', False):
+            return fn
+
+        @wraps(fn)
+        def profiled(*args, **kwargs):
+            profile = self._enable()
+            if profile is None:
+                return fn(*args, **kwargs)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profile.disable()
+                with self._lock:
+                    self._merge(profile)
+        return profiled
+
+    @staticmethod
+    def _enable():
+        import cProfile  # only loaded once an admin arms the profiler
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler already owns this interpreter (Python 3.12+)
+            return None
+        return profile
+
+    def _merge(self, profile):
+        if self._stats is None:
+            import pstats
+            self._stats = pstats.Stats(profile)
+        else:
+            self._stats.add(profile)
+
+    def report(self, limit=30):
+        """Aggregated profile collected so far"""
+        with self._lock:
+            result = {
+                'mode': self.mode,
+                'profiled_requests': self.profiled,
+                'remaining': self.remaining
+            }
+            if self.mode == 'cprofile' and self._stats is not None:
+                out = io.StringIO()
+                self._stats.stream = out
+                self._stats.sort_stats('cumulative').print_stats(limit)
+                result['profile'] = out.getvalue()
+            elif self.mode == 'sample':
+                total = sum(self._samples.values())
+                result['total_samples'] = total
+                result['stacks'] = [
+                    {'stack': stack, 'samples': count, 'share': round(count / total, 4)}
+                    for stack, count in self._samples.most_common(limit)
+                ]
+            return result
@@ -0,0 +1,268 @@
+"""
+Weighted pool of outbound SMTP relays with failover.
+Sends are spread over the healthy relays with smooth weighted round-robin. A relay that
+fails several times in a row is taken out of rotation; a background thread probes it
+(see smtp_probe.probe_smtp) and puts it back once it answers again. Messages that were
+not delivered because a relay broke are retried on the next relay.
+"""
+
+import os
+import time
+import smtplib
+import logging
+import threading
+from smtp_probe import probe_smtp
+from attachments import send_payload
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_PROBE_INTERVAL = 15
+DEFAULT_TIMEOUT = 10
+
+# The relay accepted the connection but refused this particular message; another relay
+# would most likely refuse it too, so these do not count against the relay's health
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+def parse_relays(spec):
+    """Parse "smtp-a.example.com:587:3,smtp-b.example.com:2525" into [(host, port, weight)]"""
+    relays = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        parts = item.split(':')
+        host = parts[0].strip()
+        port = int(parts[1]) if len(parts) > 1 else 587
+        weight = int(parts[2]) if len(parts) > 2 else 1
+        relays.append((host, port, weight))
+    return relays
+
+
+class Relay:
+    def __init__(self, host, port, weight=1):
+        if weight < 1:
+            raise ValueError(f"Relay {host}:{port} needs a positive weight")
+        self.host = host
+        self.port = port
+        self.weight = weight
+        self.name = f"{host}:{port}"
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.ejected_at = None
+        self.last_error = None
+        self.current_weight = 0
+
+
+class RelayPool:
+    """Delivers serialized messages through a weighted set of SMTP relays"""
+
+    def __init__(self, relays, use_tls=False, use_ssl=False, username=None, password=None,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD, probe_interval=DEFAULT_PROBE_INTERVAL,
+                 timeout=DEFAULT_TIMEOUT, metrics=None):
+        if not relays:
+            raise ValueError("RelayPool needs at least one relay")
+        self.relays = [Relay(host, port, weight) for host, port, weight in relays]
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.username = username
+        self.password = password
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.timeout = timeout
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._prober = None
+        self._stopped = threading.Event()
+        for relay in self.relays:
+            self._record_health(relay)
+
+    @classmethod
+    def from_env(cls, config, metrics=None):
+        """Build a pool from MAIL_RELAYS, or return None to keep the single MAIL_SERVER path"""
+        spec = os.environ.get('MAIL_RELAYS')
+        if not spec:
+            return None
+        return cls(
+            parse_relays(spec),
+            use_tls=config.get('MAIL_USE_TLS', False),
+            use_ssl=config.get('MAIL_USE_SSL', False),
+            username=config.get('MAIL_USERNAME'),
+            password=config.get('MAIL_PASSWORD'),
+            failure_threshold=int(os.environ.get('RELAY_FAILURE_THRESHOLD', DEFAULT_FAILURE_THRESHOLD)),
+            probe_interval=float(os.environ.get('RELAY_PROBE_INTERVAL', DEFAULT_PROBE_INTERVAL)),
+            timeout=float(os.environ.get('RELAY_TIMEOUT', DEFAULT_TIMEOUT)),
+            metrics=metrics
+        )
+
+    def pick(self, exclude=()):
+        """Smooth weighted round-robin over healthy relays not in exclude.
+
+        When every remaining relay is out of rotation the one ejected longest ago is
+        returned anyway, so an outage of all relays degrades to retries instead of refusals.
+        """
+        with self._lock:
+            candidates = [relay for relay in self.relays if relay.name not in exclude]
+            eligible = [relay for relay in candidates if relay.healthy]
+            if not eligible:
+                return min(candidates, key=lambda relay: relay.ejected_at or 0, default=None)
+
+            total = 0
+            chosen = None
+            for relay in eligible:
+                relay.current_weight += relay.weight
+                total += relay.weight
+                if chosen is None or relay.current_weight > chosen.current_weight:
+                    chosen = relay
+            chosen.current_weight -= total
+            return chosen
+
+    def _connect(self, relay):
+        client_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        client = client_class(relay.host, relay.port, timeout=self.timeout)
+        try:
+            if self.use_tls and not self.use_ssl:
+                client.starttls()
+            if self.username and self.password:
+                client.login(self.username, self.password)
+        except BaseException:
+            client.close()
+            raise
+        return client
+
+    def send_many(self, envelope_from, messages):
+        """Send [(to, payload)] over as few connections as possible; to is an address or a list
+        and payload is message bytes or an attachments.StreamedMessage.
+
+        Returns a list of {'to', 'error'} for messages that could not be delivered.
+        """
+        failed = []
+        tried = set()
+        index = 0
+        last_error = None
+        while index < len(messages):
+            relay = self.pick(exclude=tried)
+            if relay is None:
+                error = f"All SMTP relays failed: {last_error}"
+                failed.extend({'to': to, 'error': error} for to, _ in messages[index:])
+                break
+            if tried and self.metrics:
+                self.metrics.incr('relay_failovers_total')
+            tried.add(relay.name)
+
+            try:
+                client = self._connect(relay)
+                try:
+                    while index < len(messages):
+                        to, payload = messages[index]
+                        started = time.perf_counter()
+                        try:
+                            send_payload(client, envelope_from, to, payload)
+                        except MESSAGE_ERRORS as e:
+                            failed.append({'to': to, 'error': str(e)})
+                            self._record_message(relay, started, 'refused')
+                        else:
+                            self._record_message(relay, started, 'sent')
+                        index += 1
+                finally:
+                    try:
+                        client.quit()
+                    except Exception:
+                        client.close()
+                self._mark_success(relay)
+            except (OSError, smtplib.SMTPException) as e:
+                last_error = f"{type(e).__name__}: {e}"
+                self._mark_failure(relay, last_error)
+        return failed
+
+    def send(self, envelope_from, recipients, payload):
+        """Send one message, failing over between relays; raises if no relay accepted it"""
+        failed = self.send_many(envelope_from, [(recipients, payload)])
+        if failed:
+            raise smtplib.SMTPException(failed[0]['error'])
+
+    def _record_message(self, relay, started, status):
+        if self.metrics:
+            self.metrics.incr('relay_messages_total', relay=relay.name, status=status)
+            self.metrics.observe('relay_send_ms', (time.perf_counter() - started) * 1000, relay=relay.name)
+
+    def _record_health(self, relay):
+        if self.metrics:
+            self.metrics.set_gauge('relay_healthy', 1 if relay.healthy else 0, relay=relay.name)
+
+    def _mark_success(self, relay):
+        with self._lock:
+            relay.consecutive_failures = 0
+
+    def _mark_failure(self, relay, error):
+        if self.metrics:
+            self.metrics.incr('relay_errors_total', relay=relay.name)
+        with self._lock:
+            relay.consecutive_failures += 1
+            relay.last_error = error
+            eject = relay.healthy and relay.consecutive_failures >= self.failure_threshold
+            if eject:
+                relay.healthy = False
+                relay.ejected_at = time.monotonic()
+        if eject:
+            logger.warning("SMTP relay %s taken out of rotation after %d failures: %s",
+                           relay.name, relay.consecutive_failures, error)
+            self._record_health(relay)
+            self.start()
+
+    def check_ejected(self):
+        """Probe relays that are out of rotation and restore the ones that answer"""
+        for relay in [relay for relay in self.relays if not relay.healthy]:
+            result = probe_smtp(relay.host, relay.port, self.use_tls, self.use_ssl,
+                                self.username, self.password, self.timeout)
+            if not result['ok']:
+                relay.last_error = result.get('error')
+                continue
+            with self._lock:
+                relay.healthy = True
+                relay.consecutive_failures = 0
+                relay.ejected_at = None
+            logger.info("SMTP relay %s back in rotation", relay.name)
+            self._record_health(relay)
+
+    def _run_prober(self):
+        while not self._stopped.wait(self.probe_interval):
+            try:
+                self.check_ejected()
+            except Exception as e:
+                logger.error("Relay probe crashed: %s", e)
+
+    def start(self):
+        """Start the probe thread (on the first ejection) if it is not already running"""
+        with self._lock:
+            if self._prober is not None and self._prober.is_alive():
+                return
+            self._stopped.clear()
+            self._prober = threading.Thread(target=self._run_prober, name='relay-probe', daemon=True)
+            self._prober.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def status(self):
+        """Readiness: ok while at least one relay is in rotation"""
+        relays = self.stats()
+        healthy = sum(1 for relay in relays.values() if relay['healthy'])
+        result = {'ok': healthy > 0, 'healthy': healthy, 'relays': relays}
+        if not healthy:
+            result['error'] = 'All SMTP relays are out of rotation'
+        return result
+
+    def stats(self):
+        """Weight and health per relay"""
+        with self._lock:
+            return {
+                relay.name: {
+                    'weight': relay.weight,
+                    'healthy': relay.healthy,
+                    'consecutive_failures': relay.consecutive_failures,
+                    'last_error': relay.last_error
+                }
+                for relay in self.relays
+            }
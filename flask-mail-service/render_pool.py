@@ -0,0 +1,195 @@
+"""
+Multi-process render stage for batch sends.
+Jinja rendering and MIME serialization are pure Python, so large batches are split into
+chunks and rendered in a process pool whose children compile every template once at
+start-up and serialize the shared logo part once. Each job comes back as the
+serialized message bytes ready for SMTP, DKIM-signed in the child when a signer is
+configured so the RSA work is spread across the pool as well.
+"""
+
+import os
+import logging
+from jinja2 import Environment, ChoiceLoader, DictLoader, FileSystemLoader
+from fanout import FanoutMessageBuilder, logo_part
+from attachments import StreamedMessage
+from dkim import SharedBody, load_private_key
+from minify import MinifyingLoader, minify_html, MODE_OFF, MODE_FULL
+from locales import install_filters
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNKSIZE = 100
+DEFAULT_MIN_BATCH = 50
+
+# Per-process state, filled in by _init_worker in each pool child
+_env = None
+_builder = None
+_minify = MODE_OFF
+_signer = None
+
+
+def _build_environment(templates, template_dir, minify=MODE_OFF):
+    loader = ChoiceLoader([DictLoader(templates), FileSystemLoader(template_dir)])
+    if minify != MODE_OFF:
+        loader = MinifyingLoader(loader)
+    env = install_filters(Environment(loader=loader, autoescape=True))
+    # Compile everything up front so no job pays for parsing
+    for name in env.list_templates():
+        env.get_template(name)
+    return env
+
+
+def _build_fanout(logo):
+    return FanoutMessageBuilder([logo_part(logo)] if logo else [])
+
+
+def _init_worker(templates, template_dir, logo, minify=MODE_OFF, signer=None):
+    global _env, _builder, _minify, _signer
+    _env = _build_environment(templates, template_dir, minify)
+    _builder = _build_fanout(logo)
+    _minify = minify
+    _signer = signer
+    if signer is not None:
+        # Parse the key before the first job rather than inside it
+        load_private_key(signer.key_pem)
+
+
+def _shared_body(builder, job, bodies):
+    """The SharedBody for a job's batch: the builder tail plus any attachment parts.
+    Bodies are kept per mixed boundary, which is unique to one batch"""
+    key = job.get('mixed_boundary')
+    shared = bodies.get(key)
+    if shared is None:
+        extra = ()
+        if key:
+            extra = StreamedMessage(b'', key, job.get('attachments') or []).chunks()
+            if len(bodies) > 4:
+                bodies.clear()
+        shared = bodies[key] = SharedBody(builder.tail, extra)
+    return shared
+
+
+def _render_job(job, env, builder, minify, sizes, signer=None, bodies=None):
+    """Render one job, returning (to, message bytes, error); HTML sizes are appended to sizes.
+
+    With a signer the message is signed as it will be sent, including the job's
+    attachments (the parts a StreamedMessage appends after it).
+    """
+
+    try:
+        context = dict(job.get('template_data', {}))
+        context['locale'] = job.get('locale')
+        html = env.get_template(job['template']).render(context)
+        before = len(html.encode('utf-8'))
+        if minify == MODE_FULL:
+            html = minify_html(html)
+        sizes.append((before, len(html.encode('utf-8'))))
+        message = builder.build(job['sender'], job['to'], job['subject'], html,
+                                mixed_boundary=job.get('mixed_boundary'))
+        if signer is not None:
+            shared = _shared_body(builder, job, bodies)
+            if job.get('mixed_boundary'):
+                message = signer.sign(StreamedMessage(message, job['mixed_boundary'], []), shared).head
+            else:
+                message = signer.sign(message, shared)
+        return job['to'], message, None
+    except Exception as e:
+        return job['to'], None, str(e)
+
+
+# Per-process SharedBody cache, so a batch's shared bytes are canonicalized once per child
+_bodies = {}
+
+
+def _render_chunk(chunk):
+    sizes = []
+    return [_render_job(job, _env, _builder, _minify, sizes, _signer, _bodies) for job in chunk], sizes
+
+
+def chunked(items, size):
+    """Split a list into consecutive chunks of at most size items"""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class RenderPool:
+    """Renders batches of templated emails to bytes, in-process or across a process pool"""
+
+    def __init__(self, templates, template_dir, logo=None, processes=None,
+                 chunksize=DEFAULT_CHUNKSIZE, min_batch=DEFAULT_MIN_BATCH, minify=MODE_OFF, metrics=None,
+                 signer=None):
+        self.templates = dict(templates)
+        self.template_dir = template_dir
+        self.logo = logo
+        self.minify = minify
+        self.metrics = metrics
+        self.signer = signer
+        self.processes = processes or os.cpu_count() or 1
+        self.chunksize = chunksize
+        self.min_batch = min_batch
+        self._executor = None
+        self._inline_env = None
+        self._inline_builder = None
+        self._inline_bodies = {}
+
+    @classmethod
+    def from_env(cls, templates, template_dir, logo=None, minify=MODE_OFF, metrics=None, signer=None):
+        """Build a pool from RENDER_POOL_PROCESSES, RENDER_POOL_CHUNKSIZE and RENDER_POOL_MIN_BATCH"""
+        processes = int(os.environ.get('RENDER_POOL_PROCESSES', 0)) or None
+        chunksize = int(os.environ.get('RENDER_POOL_CHUNKSIZE', DEFAULT_CHUNKSIZE))
+        min_batch = int(os.environ.get('RENDER_POOL_MIN_BATCH', DEFAULT_MIN_BATCH))
+        return cls(templates, template_dir, logo=logo, processes=processes,
+                   chunksize=chunksize, min_batch=min_batch, minify=minify, metrics=metrics, signer=signer)
+
+    def _get_executor(self):
+        if self._executor is None:
+            # Imported here so web workers that never send a batch skip the cost at boot
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # forkserver children start clean instead of inheriting the lane threads
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context(method),
+                initializer=_init_worker,
+                initargs=(self.templates, self.template_dir, self.logo, self.minify, self.signer)
+            )
+            logger.info("Started render pool with %d processes", self.processes)
+        return self._executor
+
+    def render(self, jobs):
+        """Render jobs (dicts with sender, to, subject, template, template_data and, for
+        messages that will carry attachments, a mixed_boundary and the attachment parts)
+        in order"""
+        if len(jobs) < self.min_batch or self.processes < 2:
+            return self.render_inline(jobs)
+
+        # Aim for several chunks per process so slow chunks don't leave cores idle
+        size = max(1, min(self.chunksize, -(-len(jobs) // (self.processes * 4))))
+        results = []
+        for chunk_results, sizes in self._get_executor().map(_render_chunk, chunked(jobs, size)):
+            results.extend(chunk_results)
+            self._record_sizes(sizes)
+        return results
+
+    def render_inline(self, jobs):
+        """Render in the calling process, for batches too small to amortize IPC"""
+        if self._inline_env is None:
+            self._inline_env = _build_environment(self.templates, self.template_dir, self.minify)
+            self._inline_builder = _build_fanout(self.logo)
+        sizes = []
+        results = [_render_job(job, self._inline_env, self._inline_builder, self.minify, sizes,
+                               self.signer, self._inline_bodies) for job in jobs]
+        self._record_sizes(sizes)
+        return results
+
+    def _record_sizes(self, sizes):
+        if not self.metrics:
+            return
+        for before, after in sizes:
+            self.metrics.observe('html_bytes', before, stage='rendered')
+            self.metrics.observe('html_bytes', after, stage='sent')
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,168 @@
+"""
+Rolling send statistics for the admin dashboard.
+Every completed send adds to a handful of aggregate counters: totals per template and
+status, per-hour and per-day counts, and the buckets of a DDSketch of send latency. The
+counters live in SharedState, so every worker on the host contributes to the same
+figures and hour/day buckets expire on their own. Serving the stats reads only those
+aggregates (a few hundred rows at most), never individual send records.
+"""
+
+import math
+import time
+import threading
+from datetime import datetime, timezone
+
+PREFIX = 'stats:'
+DEFAULT_RELATIVE_ACCURACY = 0.01
+DEFAULT_HOURS = 48
+DEFAULT_DAYS = 31
+DEFAULT_CACHE_TTL = 1.0
+
+STATUSES = ('sent', 'failed', 'suppressed', 'rejected')
+
+# Latencies below this (ms) share a single bucket
+MIN_LATENCY_MS = 0.01
+
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+class DDSketch:
+    """Relative-error quantile sketch: values are counted in logarithmic buckets, so every
+    quantile is within relative_accuracy of the true value and the sketch size depends only
+    on the range of values, not on how many were added"""
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY, min_value=MIN_LATENCY_MS):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.min_value = min_value
+        self.buckets = {}
+        self.count = 0
+
+    def key(self, value):
+        """Bucket index for value; everything at or below min_value shares the lowest bucket"""
+        return math.ceil(math.log(max(value, self.min_value)) / self._log_gamma)
+
+    def value(self, key):
+        """Representative value of a bucket (the point with equal relative error to both edges)"""
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        key = self.key(value)
+        self.buckets[key] = self.buckets.get(key, 0) + count
+        self.count += count
+
+    def add_bucket(self, key, count):
+        self.buckets[key] = self.buckets.get(key, 0) + count
+        self.count += count
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return self.value(key)
+        return self.value(max(self.buckets))
+
+    def summary(self):
+        result = {'count': self.count}
+        for q in QUANTILES:
+            value = self.quantile(q)
+            result[f'p{round(q * 100)}'] = round(value, 2) if value is not None else None
+        return result
+
+
+class SendStats:
+    """Aggregates of completed sends, updated incrementally and read in constant time"""
+
+    def __init__(self, state, relative_accuracy=DEFAULT_RELATIVE_ACCURACY, hours=DEFAULT_HOURS,
+                 days=DEFAULT_DAYS, cache_ttl=DEFAULT_CACHE_TTL):
+        self.state = state
+        self.relative_accuracy = relative_accuracy
+        self.hours = hours
+        self.days = days
+        self.cache_ttl = cache_ttl
+        self._sketch = DDSketch(relative_accuracy)
+        self._cached = None
+        self._cached_at = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, template, status, latency_ms=None, count=1, when=None):
+        """Count `count` sends of template with status, plus one latency sample if given"""
+        current = time.time()
+        when = when or current
+        stamp = datetime.fromtimestamp(when, timezone.utc)
+        hour = stamp.strftime('%Y-%m-%dT%H')
+        day = stamp.strftime('%Y-%m-%d')
+        # Buckets expire a fixed time after the send, not after the latest write to them
+        hour_ttl = self.hours * 3600 - (current - when)
+        day_ttl = self.days * 86400 - (current - when)
+        items = [(f'{PREFIX}total:{template}:{status}', count, None)]
+        if hour_ttl > 0:
+            items.append((f'{PREFIX}hour:{hour}:{status}', count, hour_ttl))
+        if day_ttl > 0:
+            items.append((f'{PREFIX}day:{day}:{status}', count, day_ttl))
+        if latency_ms is not None:
+            bucket = self._sketch.key(latency_ms)
+            items.append((f'{PREFIX}latency:{template}:{bucket}', 1, None))
+            if day_ttl > 0:
+                items.append((f'{PREFIX}latency_day:{day}:{bucket}', 1, day_ttl))
+        self.state.incr_many(items)
+
+    def snapshot(self):
+        """The current aggregates, recomputed at most once per cache_ttl"""
+        now = time.monotonic()
+        with self._lock:
+            if self._cached is not None and now - self._cached_at < self.cache_ttl:
+                return self._cached
+        snapshot = self._build(self.state.scan(PREFIX))
+        with self._lock:
+            self._cached = snapshot
+            self._cached_at = now
+        return snapshot
+
+    def _build(self, rows):
+        totals = {}
+        by_status = dict.fromkeys(STATUSES, 0)
+        hourly = {}
+        daily = {}
+        sketches = {}
+        day_sketches = {}
+        for key, value in rows.items():
+            kind, _, rest = key[len(PREFIX):].partition(':')
+            name, _, last = rest.rpartition(':')
+            if kind == 'total':
+                totals.setdefault(name, {})[last] = value
+                by_status[last] = by_status.get(last, 0) + value
+            elif kind == 'hour':
+                hourly.setdefault(name, {})[last] = value
+            elif kind == 'day':
+                daily.setdefault(name, {})[last] = value
+            elif kind in ('latency', 'latency_day'):
+                target = sketches if kind == 'latency' else day_sketches
+                sketch = target.get(name)
+                if sketch is None:
+                    sketch = target[name] = DDSketch(self.relative_accuracy)
+                sketch.add_bucket(int(last), value)
+
+        overall = DDSketch(self.relative_accuracy)
+        for sketch in sketches.values():
+            for key, count in sketch.buckets.items():
+                overall.add_bucket(key, count)
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        return {
+            'totals': by_status,
+            'templates': {
+                name: dict(counts, latency_ms=sketches[name].summary() if name in sketches else None)
+                for name, counts in sorted(totals.items())
+            },
+            'hourly': dict(sorted(hourly.items())),
+            'daily': dict(sorted(daily.items())),
+            'latency_ms': overall.summary(),
+            'latency_today_ms': day_sketches[today].summary() if today in day_sketches else None,
+            'relative_accuracy': self.relative_accuracy,
+            'generated_at': datetime.now(timezone.utc).isoformat()
+        }
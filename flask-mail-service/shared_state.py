@@ -0,0 +1,158 @@
+"""
+Counters and TTL keys shared by every worker process on the host.
+Backed by a SQLite database in WAL mode, placed on /dev/shm when it exists so it lives in
+memory; every operation is a single atomic statement, so gunicorn workers see one
+consistent set of counters without an external service. Used for per-recipient send
+throttles and Idempotency-Key dedupe windows.
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+DEFAULT_PURGE_INTERVAL = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shared_keys (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL,
+    expires_at REAL
+) WITHOUT ROWID
+"""
+
+# Upsert that restarts an expired counter instead of adding to it
+INCR_SQL = """
+INSERT INTO shared_keys (key, value, expires_at) VALUES (?, ?, ?)
+ON CONFLICT(key) DO UPDATE SET
+    value = CASE WHEN expires_at IS NOT NULL AND expires_at <= ?
+                 THEN excluded.value ELSE value + excluded.value END,
+    expires_at = CASE WHEN expires_at IS NOT NULL AND expires_at <= ?
+                      THEN excluded.expires_at ELSE expires_at END
+"""
+
+
+def default_path(name=None):
+    """Memory-backed when /dev/shm is available, next to the service otherwise.
+
+    /dev/shm is host-wide, so the file is named after the service directory (or name, if
+    given): two deployments on one host never share counters or dedupe keys.
+    """
+    service_dir = os.path.dirname(os.path.abspath(__file__))
+    if not os.path.isdir('/dev/shm'):
+        return os.path.join(service_dir, f'{name or "shared-state"}.sqlite3')
+    if not name:
+        name = 'flask-mail-' + hashlib.sha256(service_dir.encode('utf-8')).hexdigest()[:12]
+    return f'/dev/shm/{name}.sqlite3'
+
+
+class SharedState:
+    """Atomic counters and set-if-absent keys with optional expiry, shared across processes"""
+
+    def __init__(self, path=None, purge_interval=DEFAULT_PURGE_INTERVAL):
+        self.path = path or default_path()
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._purged_at = time.monotonic()
+
+    @classmethod
+    def from_env(cls):
+        """Build from SHARED_STATE_PATH, or a default path named by SHARED_STATE_NAME"""
+        return cls(os.environ.get('SHARED_STATE_PATH') or default_path(os.environ.get('SHARED_STATE_NAME')))
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Counters are soft state: losing the last writes on power failure is acceptable
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute(SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _maybe_purge(self, conn, now):
+        if time.monotonic() - self._purged_at < self.purge_interval:
+            return
+        self._purged_at = time.monotonic()
+        conn.execute('DELETE FROM shared_keys WHERE expires_at IS NOT NULL AND expires_at <= ?', (now,))
+
+    def incr(self, key, amount=1, ttl=None):
+        """Add to a counter and return the new value; an expired counter restarts from zero.
+
+        With ttl the counter is a fixed window: the expiry is set when the window opens and
+        is not extended by later increments.
+        """
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        conn = self._connection()
+        row = conn.execute(INCR_SQL + 'RETURNING value', (key, amount, expires_at, now, now)).fetchone()
+        self._maybe_purge(conn, now)
+        return row[0]
+
+    def incr_many(self, items):
+        """Apply [(key, amount, ttl)] increments in one transaction"""
+        now = time.time()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(INCR_SQL, [(key, amount, now + ttl if ttl else None, now, now)
+                                        for key, amount, ttl in items])
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        self._maybe_purge(conn, now)
+
+    def scan(self, prefix):
+        """Live {key: value} for every key starting with prefix (a primary-key range scan)"""
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        rows = self._connection().execute(
+            'SELECT key, value FROM shared_keys WHERE key >= ? AND key < ? '
+            'AND (expires_at IS NULL OR expires_at > ?)',
+            (prefix, upper, time.time())
+        )
+        return dict(rows)
+
+    def add(self, key, ttl=None, value=1):
+        """Set key only if it is absent or expired; True if this call claimed it"""
+        now = time.time()
+        conn = self._connection()
+        cursor = conn.execute(
+            """
+            INSERT INTO shared_keys (key, value, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at
+            WHERE expires_at IS NOT NULL AND expires_at <= ?
+            """,
+            (key, value, now + ttl if ttl else None, now)
+        )
+        self._maybe_purge(conn, now)
+        return cursor.rowcount == 1
+
+    def get(self, key):
+        """Current value, or None if the key is missing or expired"""
+        row = self._connection().execute(
+            'SELECT value FROM shared_keys WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def ttl(self, key):
+        """Seconds until the key expires (None if it has no expiry or does not exist)"""
+        row = self._connection().execute('SELECT expires_at FROM shared_keys WHERE key = ?', (key,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def delete(self, key):
+        self._connection().execute('DELETE FROM shared_keys WHERE key = ?', (key,))
+
+
+def parse_rate(spec):
+    """Parse "5/3600" (count per seconds) into (5, 3600.0); empty means no limit"""
+    if not spec:
+        return None
+    count, _, seconds = spec.partition('/')
+    return int(count), float(seconds or 60)
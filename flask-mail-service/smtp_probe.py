@@ -0,0 +1,149 @@
+"""
+Background SMTP connectivity probe backing the /ready endpoint.
+A daemon thread connects to the relay on a fixed interval (EHLO, STARTTLS, optional
+login, NOOP) and caches the outcome, so readiness checks never touch the network.
+"""
+
+import os
+import time
+import smtplib
+import logging
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 30
+DEFAULT_TIMEOUT = 10
+
+
+def probe_smtp(host, port, use_tls=False, use_ssl=False, username=None, password=None, timeout=DEFAULT_TIMEOUT):
+    """Connect to an SMTP relay once and report whether it accepted EHLO/NOOP (and login)"""
+    started = time.perf_counter()
+    result = {
+        'ok': False,
+        'host': host,
+        'port': port,
+        'checked_at': datetime.now(timezone.utc).isoformat()
+    }
+    client = None
+    try:
+        client_class = smtplib.SMTP_SSL if use_ssl else smtplib.SMTP
+        client = client_class(host, port, timeout=timeout)
+        client.ehlo()
+        if use_tls and not use_ssl:
+            client.starttls()
+            client.ehlo()
+        if username and password:
+            client.login(username, password)
+        code, _ = client.noop()
+        result['ok'] = code == 250
+        if not result['ok']:
+            result['error'] = f"NOOP returned {code}"
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        if client is not None:
+            try:
+                client.quit()
+            except Exception:
+                client.close()
+    result['latency_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+class SmtpProbe:
+    """Runs probe_smtp on an interval in a background thread and caches the latest result"""
+
+    def __init__(self, host, port, use_tls=False, use_ssl=False, username=None, password=None,
+                 interval=DEFAULT_INTERVAL, timeout=DEFAULT_TIMEOUT, metrics=None):
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.username = username
+        self.password = password
+        self.interval = interval
+        self.timeout = timeout
+        self.metrics = metrics
+        self._result = None
+        self._first_result = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    @classmethod
+    def from_config(cls, config, metrics=None):
+        """Build a probe from the Flask-Mail settings plus SMTP_PROBE_* overrides"""
+        login = os.environ.get('SMTP_PROBE_LOGIN', 'true').lower() == 'true'
+        return cls(
+            host=config.get('MAIL_SERVER'),
+            port=config.get('MAIL_PORT'),
+            use_tls=config.get('MAIL_USE_TLS', False),
+            use_ssl=config.get('MAIL_USE_SSL', False),
+            username=config.get('MAIL_USERNAME') if login else None,
+            password=config.get('MAIL_PASSWORD') if login else None,
+            interval=float(os.environ.get('SMTP_PROBE_INTERVAL', DEFAULT_INTERVAL)),
+            timeout=float(os.environ.get('SMTP_PROBE_TIMEOUT', DEFAULT_TIMEOUT)),
+            metrics=metrics
+        )
+
+    def run_once(self):
+        result = probe_smtp(self.host, self.port, self.use_tls, self.use_ssl,
+                            self.username, self.password, self.timeout)
+        result['probed_at'] = time.monotonic()
+        with self._lock:
+            previous = self._result
+            self._result = result
+        self._first_result.set()
+
+        if self.metrics:
+            self.metrics.observe('smtp_probe_latency_ms', result['latency_ms'])
+            self.metrics.set_gauge('smtp_probe_ok', 1 if result['ok'] else 0)
+        if previous is None or previous['ok'] != result['ok']:
+            if result['ok']:
+                logger.info("SMTP relay %s:%s reachable (%.1f ms)", self.host, self.port, result['latency_ms'])
+            else:
+                logger.warning("SMTP relay %s:%s failing: %s", self.host, self.port, result.get('error'))
+        return result
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error("SMTP probe crashed: %s", e)
+            self._stopped.wait(self.interval)
+
+    def start(self):
+        """Start the background thread if it is not already running"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='smtp-probe', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def wait(self, timeout=None):
+        """Block until the first probe has finished; False if it has not within timeout"""
+        return self._first_result.wait(timeout)
+
+    def status(self):
+        """Latest cached result. Never blocks: until the first probe (started here if
+        needed) has finished, the relay is reported as not ok."""
+        self.start()
+        with self._lock:
+            result = dict(self._result) if self._result else None
+        if result is None:
+            return {'ok': False, 'pending': True, 'error': 'SMTP probe has not completed yet'}
+
+        age = time.monotonic() - result.pop('probed_at')
+        result['age_seconds'] = round(age, 1)
+        # A result older than a few intervals means the probe thread is stuck
+        if age > self.interval * 3 + self.timeout:
+            result['ok'] = False
+            result['error'] = 'SMTP probe result is stale'
+        return result
@@ -0,0 +1,135 @@
+"""
+Minimal local SMTP server that accepts and discards mail.
+Used as a stand-in relay by the tests and the load-test tool. Supports EHLO/HELO,
+AUTH (any credentials unless `reject_auth` is set), MAIL/RCPT/DATA, RSET, NOOP and QUIT,
+with an optional artificial delay before each reply to DATA. With `keep` set, received
+messages are kept (dot-unstuffed) in `received` for tests to inspect.
+"""
+
+import time
+import socketserver
+import threading
+
+
+class _SinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+        self.wfile.flush()
+
+    def handle(self):
+        sink = self.server.sink
+        self.reply('220 localhost smtp-sink ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+
+            if verb == 'EHLO':
+                self.wfile.write(b'250-localhost\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n')
+                self.wfile.flush()
+            elif verb == 'HELO':
+                self.reply('250 localhost')
+            elif verb == 'AUTH':
+                if sink.reject_auth:
+                    self.reply('535 5.7.8 Authentication credentials invalid')
+                elif command.upper().startswith('AUTH LOGIN'):
+                    self.reply('334 VXNlcm5hbWU6')
+                    self.rfile.readline()
+                    self.reply('334 UGFzc3dvcmQ6')
+                    self.rfile.readline()
+                    self.reply('235 2.7.0 Authentication successful')
+                else:
+                    self.reply('235 2.7.0 Authentication successful')
+            elif verb in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                size = 0
+                lines = []
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data == b'.\r\n':
+                        break
+                    size += len(data)
+                    if sink.keep:
+                        lines.append(data[1:] if data.startswith(b'.') else data)
+                if sink.latency:
+                    time.sleep(sink.latency)
+                sink.record(size, b''.join(lines) if sink.keep else None)
+                self.reply('250 OK queued')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SMTPSink:
+    """A threaded SMTP sink listening on localhost; use port 0 for a free port"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, reject_auth=False, keep=False):
+        self.latency = latency
+        self.reject_auth = reject_auth
+        self.keep = keep
+        self.received = []
+        self.messages = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._server = _ThreadingServer((host, port), _SinkHandler)
+        self._server.sink = self
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def record(self, size, message=None):
+        with self._lock:
+            self.messages += 1
+            self.bytes += size
+            if message is not None:
+                self.received.append(message)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='smtp-sink', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run a local SMTP sink')
+    parser.add_argument('--port', type=int, default=2525)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before accepting each message')
+    args = parser.parse_args()
+
+    sink = SMTPSink(port=args.port, latency=args.latency).start()
+    print(f"SMTP sink listening on {sink.address[0]}:{sink.port}")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"accepted {sink.messages} messages ({sink.bytes} bytes)")
+    except KeyboardInterrupt:
+        sink.stop()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Tests for admission control on the send endpoints
+"""
+
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from admission import AdmissionController
+from lanes import LaneScheduler, LANE_CRITICAL, LANE_TRANSACTIONAL, LANE_BULK
+from metrics import Metrics
+
+
+class FixedWait:
+    """Stands in for a LaneScheduler with a fixed estimated wait"""
+
+    def __init__(self, wait=0.0):
+        self.wait = wait
+        self.lanes = {LANE_CRITICAL: None, LANE_TRANSACTIONAL: None, LANE_BULK: None}
+
+    def estimated_wait(self, lane):
+        return self.wait
+
+
+def test_estimated_wait_tracks_service_time():
+    scheduler = LaneScheduler(lanes={'bulk': (1, 1)}, workers=1)
+    assert scheduler.estimated_wait('bulk') == 0.0
+
+    release = threading.Event()
+    scheduler.run('bulk', lambda: None)
+    assert scheduler.lanes['bulk'].service_time > 0
+
+    scheduler.lanes['bulk'].service_time = 2.0
+    blocker = scheduler.submit('bulk', release.wait)
+    queued = [scheduler.submit('bulk', lambda: None) for _ in range(2)]
+    while scheduler.lanes['bulk'].active == 0:
+        time.sleep(0.001)
+    # Two jobs ahead plus the new one, one at a time, two seconds each
+    assert scheduler.estimated_wait('bulk') == 6.0
+    release.set()
+    blocker.result()
+    for future in queued:
+        future.result()
+    scheduler.shutdown()
+
+
+def test_sheds_on_lane_wait():
+    registry = Metrics()
+    scheduler = FixedWait(wait=7.5)
+    controller = AdmissionController(scheduler, max_inflight=4, max_wait=5, metrics=registry)
+    retry_after = controller.try_acquire(LANE_BULK)
+    assert 8 <= retry_after <= 12
+    assert controller.inflight == 0
+    assert registry.snapshot()['counters']['admission_shed_total{lane=bulk,reason=queue_wait}'] == 1
+
+    scheduler.wait = 1.0
+    assert controller.try_acquire(LANE_BULK) is None
+    assert controller.inflight == 1
+
+
+def test_sheds_when_saturated():
+    registry = Metrics()
+    controller = AdmissionController(FixedWait(), max_inflight=2, max_wait=5, metrics=registry)
+    assert controller.try_acquire(LANE_TRANSACTIONAL) is None
+    assert controller.try_acquire(LANE_TRANSACTIONAL) is None
+
+    # The cap holds even when recent requests were fast
+    controller.request_time = 0.05
+    assert controller.try_acquire(LANE_TRANSACTIONAL) == 1
+
+    controller.request_time = 8.0
+    assert controller.try_acquire(LANE_TRANSACTIONAL) >= 8
+    assert controller.inflight == 2
+    counters = registry.snapshot()['counters']
+    assert counters['admission_shed_total{lane=transactional,reason=inflight}'] == 2
+
+    # Critical sends get the reserved slot above the cap, and no more
+    assert controller.try_acquire(LANE_CRITICAL) is None
+    assert controller.try_acquire(LANE_CRITICAL) >= 8
+    assert controller.inflight == 3
+    assert registry.snapshot()['counters']['admission_shed_total{lane=critical,reason=inflight}'] == 1
+    assert registry.snapshot()['gauges']['admission_inflight'] == 3
+
+    for _ in range(3):
+        controller.release(8.0)
+    assert controller.try_acquire(LANE_TRANSACTIONAL) is None
+
+
+def test_zero_wait_disables_wait_check():
+    controller = AdmissionController(FixedWait(wait=100), max_inflight=1, max_wait=0, critical_reserve=0)
+    assert controller.try_acquire(LANE_BULK) is None
+    assert controller.try_acquire(LANE_BULK) == 1
+    assert controller.try_acquire(LANE_CRITICAL) == 1
+
+    # max_inflight 0 turns the cap off
+    controller.max_inflight = 0
+    assert controller.try_acquire(LANE_BULK) is None
+
+
+def test_app_returns_429():
+    import app as mail_app
+    mail_app.mail.state.suppress = True
+    mail_app.mail.state.default_sender = 'noreply@novakinetix.academy'
+    controller = mail_app.admission
+    saved = controller.max_inflight, controller.max_wait, controller.inflight, controller.request_time
+    controller.max_inflight, controller.max_wait, controller.inflight, controller.request_time = 1, 5, 1, 10.0
+    try:
+        client = mail_app.app.test_client()
+        response = client.post('/api/send-welcome-email', json={'email': 'ada@example.com', 'name': 'Ada'})
+        assert response.status_code == 429
+        assert int(response.headers['Retry-After']) >= 10
+        assert response.get_json()['retry_after'] == int(response.headers['Retry-After'])
+
+        response = client.post('/api/send-password-reset', json={
+            'email': 'ada@example.com', 'reset_url': 'https://novakinetix.academy/reset?token=abc'})
+        assert response.status_code == 200
+        assert controller.inflight == 1
+
+        snapshot = client.get('/metrics').get_json()
+        assert snapshot['counters']['admission_shed_total{lane=transactional,reason=inflight}'] >= 1
+        assert snapshot['admission']['max_inflight'] == 1
+    finally:
+        controller.max_inflight, controller.max_wait, controller.inflight, controller.request_time = saved
+
+
+if __name__ == '__main__':
+    test_estimated_wait_tracks_service_time()
+    test_sheds_on_lane_wait()
+    test_sheds_when_saturated()
+    test_zero_wait_disables_wait_check()
+    test_app_returns_429()
+    print("5 tests passed")
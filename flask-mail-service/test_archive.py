@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Tests for the sent-message archive
+"""
+
+import os
+import sys
+import gzip
+import tempfile
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from archive import MessageArchive, message_id_of
+from metrics import Metrics
+from relays import RelayPool
+from smtp_sink import SMTPSink
+
+SENDER = 'noreply@novakinetix.academy'
+HEADERS = {'X-Admin-Token': 'secret'}
+
+
+def make_message(index, to):
+    return (f'Message-ID: <msg-{index}@novakinetix.academy>\r\nTo: {to}\r\nSubject: Hello {index}\r\n\r\n'
+            f'<p>Hello number {index}</p>\r\n').encode('ascii') + b'x' * 500
+
+
+def test_archive_and_lookup():
+    """Messages are written off-thread, segments rotate, lookups read one frame"""
+    assert message_id_of(make_message(7, 'a@example.com')) == 'msg-7@novakinetix.academy'
+    assert message_id_of(b'Subject: none\r\n\r\nMessage-ID: <body@x>') is None
+
+    registry = Metrics()
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = MessageArchive(tmp, codec='gzip', segment_bytes=2048, metrics=registry)
+        for index in range(20):
+            assert archive.archive('Ada@Example.com' if index % 2 else 'sam@example.com', make_message(index, 'x'))
+        assert archive.flush(timeout=10)
+        segments = sorted(name for name in os.listdir(tmp) if name.endswith('.gz'))
+        assert len(segments) > 1
+
+        record = archive.get('<msg-13@novakinetix.academy>')
+        assert record['message'] == make_message(13, 'x')
+        assert record['recipients'] == ['Ada@Example.com']
+        assert archive.get('msg-99@novakinetix.academy') is None
+
+        found = archive.find('ada@example.com', limit=3)
+        assert [item['message_id'] for item in found] == [f'msg-{i}@novakinetix.academy' for i in (19, 17, 15)]
+        assert archive.find('nobody@example.com') == []
+
+        # Each segment is a plain multi-member gzip file
+        with gzip.open(os.path.join(tmp, segments[0])) as f:
+            assert b'Hello number 0' in f.read()
+        archive.close()
+    assert registry.snapshot()['counters']['archive_messages_total{result=written}'] == 20
+
+
+def test_full_queue_drops_instead_of_blocking():
+    with tempfile.TemporaryDirectory() as tmp:
+        registry = Metrics()
+        archive = MessageArchive(tmp, codec='gzip', queue_size=1, metrics=registry)
+        results = [archive.archive('a@example.com', make_message(index, 'a')) for index in range(200)]
+        assert results[0] and not all(results)
+        archive.close()
+        counters = registry.snapshot()['counters']
+        assert counters['archive_messages_total{result=dropped}'] == results.count(False)
+
+
+def test_app_archives_sent_mail():
+    import app as mail_app
+    os.environ['ADMIN_API_TOKEN'] = 'secret'
+    try:
+        with tempfile.TemporaryDirectory() as tmp, SMTPSink(keep=True) as sink:
+            archive = MessageArchive(tmp, codec='gzip')
+            previous = mail_app.relay_pool, mail_app.message_archive
+            mail_app.relay_pool = RelayPool([('127.0.0.1', sink.port, 1)])
+            mail_app.message_archive = archive
+            mail_app.mail.state.suppress = False
+            mail_app.mail.state.default_sender = SENDER
+            try:
+                client = mail_app.app.test_client()
+                response = client.post('/api/send-welcome-email', json={'email': 'ada@example.com', 'name': 'Ada'})
+                assert response.status_code == 200
+                response = client.post('/api/send-batch', json={
+                    'template': 'welcome',
+                    'subject': 'Welcome',
+                    'messages': [{'to': f'user{i}@example.com', 'template_data': {'user_name': f'User {i}'}}
+                                 for i in range(3)]
+                })
+                assert response.get_json()['sent'] == 3
+                assert archive.flush(timeout=10)
+
+                assert client.get('/api/archive?to=ada@example.com').status_code == 401
+                assert client.get('/api/archive', headers=HEADERS).status_code == 400
+                listed = client.get('/api/archive?to=ADA@example.com', headers=HEADERS).get_json()['messages']
+                assert len(listed) == 1
+
+                response = client.get(f"/api/archive/{listed[0]['message_id']}", headers=HEADERS)
+                assert response.status_code == 200 and response.mimetype == 'message/rfc822'
+                sent = [message for message in sink.received if b'ada@example.com' in message]
+                assert response.data == sent[0]
+
+                message_id = client.get('/api/archive?to=user2@example.com', headers=HEADERS).get_json()['messages'][0]['message_id']
+                response = client.get(f'/api/archive/<{message_id}>', headers=HEADERS)
+                assert response.data in sink.received and b'To: user2@example.com' in response.data
+                assert client.get('/api/archive/missing@example.com', headers=HEADERS).status_code == 404
+            finally:
+                mail_app.relay_pool, mail_app.message_archive = previous
+                mail_app.mail.state.suppress = True
+                archive.close()
+    finally:
+        os.environ.pop('ADMIN_API_TOKEN')
+
+
+if __name__ == '__main__':
+    test_archive_and_lookup()
+    test_full_queue_drops_instead_of_blocking()
+    test_app_archives_sent_mail()
+    print("3 tests passed")
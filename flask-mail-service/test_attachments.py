@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Tests for streamed, content-hash cached attachments
+"""
+
+import io
+import os
+import sys
+import base64
+import email
+import hashlib
+import smtplib
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from attachments import (AttachmentStore, AttachmentError, StreamedMessage, encode_stream,
+                         sendmail_chunks)
+from fanout import FanoutMessageBuilder, logo_part, new_boundary
+from relays import RelayPool
+from smtp_sink import SMTPSink
+from metrics import Metrics
+
+SENDER = 'noreply@novakinetix.academy'
+PDF = b'%PDF-1.4\n' + bytes(range(256)) * 400 + b'\n%%EOF\n'
+
+
+class ShortReads(io.BytesIO):
+    """A stream that returns at most 1000 bytes per read, like a socket"""
+
+    def read(self, size=-1):
+        return super().read(min(size, 1000) if size and size > 0 else 1000)
+
+
+def _store(directory, metrics=None):
+    os.makedirs(os.path.join(directory, 'certificates'), exist_ok=True)
+    with open(os.path.join(directory, 'certificates', 'hours.pdf'), 'wb') as f:
+        f.write(PDF)
+    return AttachmentStore(directory, metrics=metrics)
+
+
+def test_encode_stream_matches_base64():
+    for size in (0, 1, 57, 58, 57 * 4 + 3, 5000):
+        data = os.urandom(size)
+        out = io.BytesIO()
+        digest, length = encode_stream(io.BytesIO(data).read, out.write, chunk_size=57 * 2)
+        assert length == size
+        assert digest == hashlib.sha256(data).hexdigest()
+        assert out.getvalue() == base64.encodebytes(data).replace(b'\n', b'\r\n')
+        assert all(len(line) <= 76 for line in out.getvalue().split(b'\r\n'))
+
+
+def test_part_is_encoded_once():
+    with tempfile.TemporaryDirectory() as directory:
+        registry = Metrics()
+        store = _store(directory, metrics=registry)
+        first = store.part({'path': 'certificates/hours.pdf'})
+        second = store.part({'path': 'certificates/hours.pdf', 'filename': 'Certificate.pdf'})
+        counters = registry.snapshot()['counters']
+        assert counters['attachment_cache_total{result=miss}'] == 1
+        assert counters['attachment_cache_total{result=hit}'] == 1
+        assert first.digest == second.digest == hashlib.sha256(PDF).hexdigest()
+        assert b'Content-Type: application/pdf' in first.headers
+        assert b'filename="Certificate.pdf"' in second.headers
+        assert base64.b64decode(b''.join(list(first.chunks())[1:])) == PDF
+
+        # A fresh store (another worker) reuses the encoded body on disk
+        other = AttachmentStore(directory, memory_bytes=0, metrics=registry)
+        part = other.part({'path': 'certificates/hours.pdf'})
+        assert part.data is None
+        assert registry.snapshot()['counters']['attachment_cache_total{result=hit}'] == 2
+        assert base64.b64decode(b''.join(list(part.chunks())[1:])) == PDF
+
+
+def test_rejects_bad_references():
+    with tempfile.TemporaryDirectory() as directory:
+        store = _store(directory)
+        store.max_bytes = 100
+        for ref in ({'path': '../etc/passwd'}, {'path': 'missing.pdf'}, {'id': 'not-a-digest'},
+                    {'path': 'certificates/hours.pdf'}, {}, 'hours.pdf',
+                    {'path': 'certificates/hours.pdf', 'content_type': 'text/html\r\nBcc: x'}):
+            try:
+                store.part(ref)
+            except AttachmentError:
+                pass
+            else:
+                raise AssertionError(f'accepted {ref!r}')
+
+
+def test_upload_by_id():
+    with tempfile.TemporaryDirectory() as directory:
+        store = AttachmentStore(directory)
+        attachment_id, size = store.save_stream(ShortReads(PDF))
+        assert attachment_id == hashlib.sha256(PDF).hexdigest() and size == len(PDF)
+        part = store.part({'id': attachment_id, 'filename': 'receipt.pdf'})
+        assert base64.b64decode(b''.join(list(part.chunks())[1:])) == PDF
+
+        store.max_bytes = 10
+        try:
+            store.save_stream(io.BytesIO(PDF))
+        except AttachmentError:
+            pass
+        else:
+            raise AssertionError('oversized upload accepted')
+        assert os.listdir(os.path.join(directory, 'uploads')) == [attachment_id]
+
+
+def test_encoded_cache_is_swept():
+    with tempfile.TemporaryDirectory() as directory:
+        registry = Metrics()
+        store = _store(directory, metrics=registry)
+        store.cache_bytes = 0
+        part = store.part({'path': 'certificates/hours.pdf'})
+        # Just used, so within the grace period even though the cache is over its size
+        assert store.sweep() == 0 and os.path.exists(part.path)
+
+        later = time.time() + 120
+        assert store.sweep(now=later) == 1 and not os.path.exists(part.path)
+        assert registry.snapshot()['counters']['attachment_cache_evicted_total'] == 1
+
+        # Swept bodies are encoded again on next use; hits keep old bodies from ageing out
+        store = AttachmentStore(directory, memory_bytes=0, cache_age=3600, metrics=registry)
+        part = store.part({'path': 'certificates/hours.pdf'})
+        os.utime(part.path, (later - 7200, later - 7200))
+        store.part({'path': 'certificates/hours.pdf'})
+        assert store.sweep(now=later + 1800) == 0
+        assert store.sweep(now=time.time() + 7200) == 1
+        assert registry.snapshot()['counters']['attachment_cache_total{result=miss}'] == 2
+
+
+def test_streamed_message_round_trip():
+    with tempfile.TemporaryDirectory() as directory:
+        store = _store(directory)
+        boundary = new_boundary()
+        builder = FanoutMessageBuilder([logo_part(b'\x89PNG fake')])
+        head = builder.build(SENDER, 'ada@example.com', 'Your certificate', '<p>Hi</p>', mixed_boundary=boundary)
+        message = StreamedMessage(head, boundary, store.parts([{'path': 'certificates/hours.pdf'}]))
+
+        parsed = email.message_from_bytes(message.as_bytes())
+        assert parsed.get_content_type() == 'multipart/mixed'
+        related, attachment = parsed.get_payload()
+        assert related.get_content_type() == 'multipart/related'
+        assert [p.get_content_type() for p in related.get_payload()] == ['text/html', 'image/png']
+        assert attachment.get_filename() == 'hours.pdf'
+        assert attachment.get_payload(decode=True) == PDF
+
+
+def test_sendmail_chunks_dot_stuffing():
+    with SMTPSink(keep=True) as sink:
+        client = smtplib.SMTP('127.0.0.1', sink.port)
+        chunks = [b'Subject: dots\r\n\r\n', b'.leading\r\n', b'a\r\n.', b'split\r\n', b'end']
+        sendmail_chunks(client, SENDER, 'ada@example.com', chunks)
+        client.quit()
+        assert sink.received == [b'Subject: dots\r\n\r\n.leading\r\na\r\n.split\r\nend\r\n']
+
+
+def test_app_sends_attachments():
+    import app as mail_app
+    with tempfile.TemporaryDirectory() as directory, SMTPSink(keep=True) as sink:
+        previous = mail_app.relay_pool, mail_app.attachment_store
+        mail_app.relay_pool = RelayPool([('127.0.0.1', sink.port, 1)])
+        mail_app.attachment_store = _store(directory)
+        mail_app.mail.state.suppress = False
+        mail_app.mail.state.default_sender = SENDER
+        os.environ['ADMIN_API_TOKEN'] = 'secret'
+        try:
+            client = mail_app.app.test_client()
+            response = client.post('/api/attachments', data=PDF, headers={'X-Admin-Token': 'secret'})
+            assert response.status_code == 200
+            attachment_id = response.get_json()['id']
+
+            response = client.post('/api/send-email', json={
+                'to': 'ada@example.com',
+                'subject': 'Your volunteer hours certificate',
+                'template': 'welcome',
+                'template_data': {'user_name': 'Ada', 'user_email': 'ada@example.com'},
+                'attachments': [{'id': attachment_id, 'filename': 'certificate.pdf'}]
+            })
+            assert response.status_code == 200
+
+            response = client.post('/api/send-batch', json={
+                'template': 'welcome',
+                'subject': 'Tutoring receipt',
+                'attachments': [{'path': 'certificates/hours.pdf'}],
+                'messages': [{'to': f'user{i}@example.com', 'template_data': {'user_name': f'User {i}'}}
+                             for i in range(3)]
+            })
+            assert response.status_code == 200 and response.get_json()['sent'] == 3
+
+            response = client.post('/api/send-email', json={
+                'to': 'ada@example.com', 'subject': 'x', 'template': 'welcome', 'template_data': {},
+                'attachments': [{'path': '../app.py'}]
+            })
+            assert response.status_code == 400
+
+            assert len(sink.received) == 4
+            for raw in sink.received:
+                parsed = email.message_from_bytes(raw)
+                attachment = parsed.get_payload()[1]
+                assert attachment.get_payload(decode=True) == PDF
+            assert email.message_from_bytes(sink.received[0]).get_payload()[1].get_filename() == 'certificate.pdf'
+        finally:
+            mail_app.relay_pool, mail_app.attachment_store = previous
+            mail_app.mail.state.suppress = True
+            os.environ.pop('ADMIN_API_TOKEN')
+
+
+if __name__ == '__main__':
+    test_encode_stream_matches_base64()
+    test_part_is_encoded_once()
+    test_rejects_bad_references()
+    test_upload_by_id()
+    test_encoded_cache_is_swept()
+    test_streamed_message_round_trip()
+    test_sendmail_chunks_dot_stuffing()
+    test_app_sends_attachments()
+    print("8 tests passed")
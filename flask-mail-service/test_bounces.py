@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Tests for DSN parsing and incremental Maildir/mbox bounce ingestion
+"""
+
+import os
+import sys
+import email
+import tempfile
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from bounces import parse_dsn, split_mbox, db_path, BounceIngestor, DeliveryStatusStore
+from suppression import SuppressionList
+from metrics import Metrics
+
+
+def make_dsn(recipient, action='failed', status='5.1.1', message_id='<orig@novakinetix.academy>'):
+    return f"""From: MAILER-DAEMON@relay.example.com
+To: noreply@novakinetix.academy
+Subject: Undelivered Mail Returned to Sender
+MIME-Version: 1.0
+Content-Type: multipart/report; report-type=delivery-status; boundary="B"
+
+--B
+Content-Type: text/plain
+
+The mail could not be delivered.
+
+--B
+Content-Type: message/delivery-status
+
+Reporting-MTA: dns; relay.example.com
+
+Final-Recipient: rfc822; {recipient}
+Action: {action}
+Status: {status}
+Remote-MTA: dns; mx.example.com
+Diagnostic-Code: smtp; 550 {status} <{recipient}>: Recipient address rejected
+
+--B
+Content-Type: text/rfc822-headers
+
+Message-ID: {message_id}
+Subject: Welcome
+
+--B--
+""".encode('utf-8')
+
+
+def test_parse_dsn():
+    events = parse_dsn(email.message_from_bytes(make_dsn('Gone@Example.com')))
+    assert events == [{
+        'email': 'gone@example.com',
+        'kind': 'hard',
+        'action': 'failed',
+        'status': '5.1.1',
+        'diagnostic': '550 5.1.1 <Gone@Example.com>: Recipient address rejected',
+        'remote_mta': 'mx.example.com',
+        'original_message_id': '<orig@novakinetix.academy>'
+    }]
+    soft = parse_dsn(email.message_from_bytes(make_dsn('later@example.com', 'delayed', '4.4.1')))
+    assert soft[0]['kind'] == 'soft'
+    assert parse_dsn(email.message_from_bytes(b'Subject: hello\r\n\r\nnot a bounce')) == []
+
+
+def test_split_mbox_leaves_partial_tail():
+    data = b'From a\nSubject: 1\n\nbody\n\nFrom b\nSubject: 2\n\nbody\n\nFrom c\nSubject: 3\n\npart'
+    chunks = list(split_mbox(data))
+    assert [raw.split(b'\n', 1)[0] for _, raw in chunks] == [b'From a', b'From b']
+    assert data[chunks[-1][0]:].startswith(b'From c')
+
+
+def test_maildir_ingestion_is_incremental():
+    with tempfile.TemporaryDirectory() as tmp:
+        maildir = os.path.join(tmp, 'Maildir')
+        for sub in ('new', 'cur', 'tmp'):
+            os.makedirs(os.path.join(maildir, sub))
+
+        def deliver(name, raw):
+            with open(os.path.join(maildir, 'new', name), 'wb') as f:
+                f.write(raw)
+
+        suppressions = SuppressionList(os.path.join(tmp, 's.sqlite3'))
+        registry = Metrics()
+        ingestor = BounceIngestor(DeliveryStatusStore(os.path.join(tmp, 'b.sqlite3')), maildir=maildir,
+                                  suppression_list=suppressions, soft_bounce_limit=2, metrics=registry)
+        deliver('1.host', make_dsn('gone@example.com'))
+        deliver('2.host', make_dsn('slow@example.com', 'delayed', '4.2.2'))
+        assert ingestor.ingest() == 2
+        assert ingestor.ingest() == 0
+        assert sorted(os.listdir(os.path.join(maildir, 'cur'))) == ['1.host:2,S', '2.host:2,S']
+
+        assert suppressions.is_suppressed('gone@example.com')
+        assert not suppressions.is_suppressed('slow@example.com')
+        assert ingestor.store.get('gone@example.com')['hard_bounces'] == 1
+
+        # A second soft bounce reaches the limit and suppresses the address
+        deliver('3.host', make_dsn('slow@example.com', 'delayed', '4.2.2'))
+        assert ingestor.ingest() == 1
+        assert ingestor.store.get('slow@example.com')['soft_bounces'] == 2
+        assert suppressions.is_suppressed('slow@example.com')
+
+        counters = registry.snapshot()['counters']
+        assert counters['bounces_total{kind=hard}'] == 1
+        assert counters['bounces_total{kind=soft}'] == 2
+
+
+def test_mbox_ingestion_resumes_from_checkpoint():
+    with tempfile.TemporaryDirectory() as tmp:
+        mbox = os.path.join(tmp, 'bounces.mbox')
+        store = DeliveryStatusStore(os.path.join(tmp, 'b.sqlite3'))
+
+        def append(raw):
+            with open(mbox, 'ab') as f:
+                f.write(b'From MAILER-DAEMON Mon Jan  1 00:00:00 2024\n' + raw + b'\n')
+
+        append(make_dsn('one@example.com'))
+        append(make_dsn('two@example.com'))
+        assert BounceIngestor(store, mbox=mbox).ingest() == 2
+
+        append(make_dsn('three@example.com'))
+        # A fresh ingestor (e.g. after a restart) only reads the appended message
+        assert BounceIngestor(store, mbox=mbox).ingest() == 1
+        assert BounceIngestor(store, mbox=mbox).ingest() == 0
+        assert store.get('one@example.com')['hard_bounces'] == 1
+        assert store.get('three@example.com')['kind'] == 'hard'
+
+
+def test_default_db_path_ignores_working_directory():
+    previous = os.environ.pop('BOUNCE_DB', None), os.getcwd()
+    os.environ['BOUNCE_MBOX'] = 'bounces.mbox'
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            assert db_path() == os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bounces.sqlite3')
+            assert BounceIngestor.from_env().store.path == db_path()
+    finally:
+        del os.environ['BOUNCE_MBOX']
+        if previous[0] is not None:
+            os.environ['BOUNCE_DB'] = previous[0]
+        os.chdir(previous[1])
+
+
+def test_admin_routes():
+    import app as mail_app
+    with tempfile.TemporaryDirectory() as tmp:
+        mbox = os.path.join(tmp, 'bounces.mbox')
+        with open(mbox, 'wb') as f:
+            f.write(b'From MAILER-DAEMON Mon Jan  1 00:00:00 2024\n' + make_dsn('gone@example.com') + b'\n')
+        previous = mail_app.bounce_ingestor
+        mail_app.bounce_ingestor = BounceIngestor(DeliveryStatusStore(os.path.join(tmp, 'b.sqlite3')), mbox=mbox)
+        os.environ['ADMIN_API_TOKEN'] = 'secret'
+        try:
+            client = mail_app.app.test_client()
+            headers = {'X-Admin-Token': 'secret'}
+            assert client.post('/admin/bounces/ingest', headers=headers).get_json()['processed'] == 1
+            status = client.get('/api/delivery-status/gone@example.com', headers=headers).get_json()
+            assert status['status'] == '5.1.1'
+            assert client.get('/api/delivery-status/fine@example.com', headers=headers).status_code == 404
+        finally:
+            mail_app.bounce_ingestor = previous
+            del os.environ['ADMIN_API_TOKEN']
+
+
+if __name__ == '__main__':
+    test_parse_dsn()
+    test_split_mbox_leaves_partial_tail()
+    test_maildir_ingestion_is_incremental()
+    test_mbox_ingestion_resumes_from_checkpoint()
+    test_default_db_path_ignores_working_directory()
+    test_admin_routes()
+    print("Bounce tests passed")
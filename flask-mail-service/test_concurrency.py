@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Tests for the adaptive delivery concurrency limit
+Feeds synthetic latencies to the limiter and runs it under a real lane scheduler
+"""
+
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from concurrency import AdaptiveLimit, MIN_WINDOW
+from lanes import LaneScheduler, LANE_BULK
+from metrics import Metrics
+
+
+def run_window(limiter, latency, errors=0, busy=True):
+    """One full adjustment window at the given latency"""
+    if busy:
+        limiter.observe_inflight(limiter.limit)
+    samples = max(MIN_WINDOW, limiter.limit)
+    limiter.record(latency, count=samples, errors=errors)
+
+
+def test_aimd_adjustments():
+    """Healthy busy windows add one, errors and latency spikes cut multiplicatively"""
+    registry = Metrics()
+    limiter = AdaptiveLimit(max_limit=10, min_limit=2, initial=4, metrics=registry)
+    assert registry.snapshot()['gauges']['delivery_concurrency_limit'] == 4
+
+    run_window(limiter, 0.05)
+    run_window(limiter, 0.05)
+    assert limiter.limit == 6
+    # An idle window says nothing about whether more slots would help
+    run_window(limiter, 0.05, busy=False)
+    assert limiter.limit == 6
+
+    run_window(limiter, 0.05, errors=3)
+    assert limiter.limit == 4
+    run_window(limiter, 0.5)
+    assert limiter.limit == 2
+    run_window(limiter, 0.5)
+    assert limiter.limit == 2
+
+    for _ in range(20):
+        run_window(limiter, 0.01)
+    assert limiter.limit == 10
+
+    snapshot = registry.snapshot()
+    assert snapshot['gauges']['delivery_concurrency_limit'] == 10
+    assert snapshot['counters']['delivery_concurrency_adjustments_total{direction=down}'] == 2
+    assert limiter.stats()['baseline_ms'] == 10.0
+
+
+def test_slow_relay_becomes_baseline():
+    """A relay that stays slower settles at a new baseline instead of pinning the floor"""
+    limiter = AdaptiveLimit(max_limit=8)
+    run_window(limiter, 0.02)
+    for _ in range(10):
+        run_window(limiter, 0.1)
+    assert limiter.limit == 1
+    for _ in range(40):
+        run_window(limiter, 0.1)
+    assert limiter.limit > 1
+
+
+def test_scheduler_respects_limit():
+    """Lane workers never run more deliveries at once than the current limit"""
+    limiter = AdaptiveLimit(max_limit=4, initial=2)
+    scheduler = LaneScheduler(lanes={LANE_BULK: (1, 4)}, workers=4, limiter=limiter)
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def deliver():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        scheduler.record_delivery(0.01)
+
+    futures = [scheduler.submit(LANE_BULK, deliver) for _ in range(MIN_WINDOW - 1)]
+    for future in futures:
+        future.result(timeout=5)
+    assert peak[0] == 2 and limiter.limit == 2
+
+    # Completing a busy, healthy window raises the limit and frees a worker
+    futures = [scheduler.submit(LANE_BULK, deliver) for _ in range(MIN_WINDOW)]
+    for future in futures:
+        future.result(timeout=5)
+    assert limiter.limit == 3 and peak[0] == 3
+    scheduler.shutdown()
+
+
+def test_metrics_endpoint_reports_limit():
+    import app as mail_app
+
+    mail_app.mail.state.suppress = True
+    mail_app.mail.state.default_sender = 'noreply@novakinetix.academy'
+    client = mail_app.app.test_client()
+    response = client.post('/api/send-email', json={
+        'to': 'student@example.com',
+        'subject': 'Hello',
+        'template': 'welcome',
+        'template_data': {'user_name': 'Sam'}
+    })
+    assert response.status_code == 200
+    snapshot = client.get('/metrics').get_json()
+    assert snapshot['concurrency']['max'] == mail_app.lane_scheduler.workers
+    assert snapshot['gauges']['delivery_concurrency_limit'] == snapshot['concurrency']['limit']
+
+
+if __name__ == '__main__':
+    test_aimd_adjustments()
+    test_slow_relay_becomes_baseline()
+    test_scheduler_respects_limit()
+    test_metrics_endpoint_reports_limit()
+    print("4 tests passed")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Tests for the fan-out message builder
+"""
+
+import os
+import sys
+from email import message_from_bytes
+from email.header import decode_header, make_header
+from email.utils import parseaddr
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fanout import FanoutMessageBuilder, HeaderInjectionError, logo_part, encode_header_value, encode_address
+
+LOGO = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 40
+
+
+def test_message_structure():
+    """Each message parses cleanly with a personalized HTML part and the shared logo"""
+    builder = FanoutMessageBuilder([logo_part(LOGO)])
+    raw = builder.build('NOVAKINETIX <noreply@novakinetix.academy>', 'ada@example.com',
+                        'Welcome 🎉', '<p>Dear Ada, ¡hola!</p>')
+    message = message_from_bytes(raw)
+
+    assert message.get_content_type() == 'multipart/related'
+    assert message['To'] == 'ada@example.com'
+    assert message['Subject'] == encode_header_value('Welcome 🎉')
+    assert not message.defects
+
+    parts = [part for part in message.walk() if not part.is_multipart()]
+    assert [part.get_content_type() for part in parts] == ['text/html', 'image/png']
+    assert parts[0].get_payload(decode=True).decode('utf-8') == '<p>Dear Ada, ¡hola!</p>'
+    assert parts[1].get_payload(decode=True) == LOGO
+    assert parts[1]['Content-ID'] == '<novakinetix-logo>'
+    assert b'\r\n' in raw and b'\n' not in raw.replace(b'\r\n', b'')
+
+
+def test_shared_parts_serialized_once():
+    """The invariant tail is byte-identical across recipients, only headers and HTML differ"""
+    builder = FanoutMessageBuilder([logo_part(LOGO)])
+    first = builder.build('noreply@novakinetix.academy', 'a@example.com', 'Hi', '<p>A</p>')
+    second = builder.build('noreply@novakinetix.academy', 'b@example.com', 'Hi', '<p>B</p>')
+    assert first[-builder.shared_size:] == second[-builder.shared_size:]
+    assert message_from_bytes(second)['Message-ID'] != message_from_bytes(first)['Message-ID']
+
+
+def test_extra_headers():
+    builder = FanoutMessageBuilder()
+    raw = builder.build('noreply@novakinetix.academy', 'a@example.com', 'Hi', '<p>A</p>',
+                        extra_headers={'List-Unsubscribe': '<mailto:unsubscribe@novakinetix.academy>'})
+    message = message_from_bytes(raw)
+    assert message['List-Unsubscribe'] == '<mailto:unsubscribe@novakinetix.academy>'
+    assert [p.get_content_type() for p in message.walk() if not p.is_multipart()] == ['text/html']
+
+
+def test_sender_display_name_encoded_alone():
+    """Only a non-ASCII display name is RFC 2047-encoded; the address stays plain"""
+    builder = FanoutMessageBuilder([logo_part(LOGO)])
+    raw = builder.build('"Académie, NOVAKINETIX" <noreply@novakinetix.academy>', 'ada@example.com',
+                        'Hi', '<p>Hi</p>')
+    sender = message_from_bytes(raw)['From']
+    assert sender.startswith('=?utf-8?') and sender.endswith(' <noreply@novakinetix.academy>')
+    assert parseaddr(sender)[1] == 'noreply@novakinetix.academy'
+    assert str(make_header(decode_header(sender))) == 'Académie, NOVAKINETIX <noreply@novakinetix.academy>'
+    assert encode_address('NOVAKINETIX <noreply@novakinetix.academy>') == 'NOVAKINETIX <noreply@novakinetix.academy>'
+
+
+def test_rejects_header_injection():
+    builder = FanoutMessageBuilder()
+    for kwargs in ({'subject': 'Hi\r\nBcc: x@y'}, {'to': 'a@example.com\nBcc: x@y'},
+                   {'subject': 'Olá\nBcc: x@y'}, {'extra_headers': {'List-Id': 'a\rBcc: x@y'}},
+                   {'extra_headers': {'Bcc: x@y\r\nX-Tag': 'a'}}):
+        args = {'sender': 'noreply@novakinetix.academy', 'to': 'a@example.com', 'subject': 'Hi',
+                'html': '<p>A</p>', **kwargs}
+        try:
+            builder.build(**args)
+        except HeaderInjectionError:
+            continue
+        raise AssertionError(f'{kwargs} was not rejected')
+
+
+def test_routes_reject_header_injection():
+    import app as mail_app
+    previous = mail_app.mail.state.default_sender, mail_app.mail.state.suppress
+    mail_app.mail.state.default_sender = 'noreply@novakinetix.academy'
+    mail_app.mail.state.suppress = True
+    try:
+        client = mail_app.app.test_client()
+        response = client.post('/api/send-email', json={
+            'to': 'ada@example.com', 'subject': 'Hi\r\nBcc: x@y', 'template': 'welcome', 'template_data': {}
+        })
+        assert response.status_code == 400
+
+        response = client.post('/api/send-batch', json={
+            'template': 'welcome', 'subject': 'Hi\r\nBcc: x@y', 'messages': [{'to': 'a@example.com'}]
+        })
+        assert response.status_code == 400
+
+        response = client.post('/api/send-batch', json={
+            'template': 'welcome', 'subject': 'Hi',
+            'messages': [{'to': 'a@example.com'}, {'to': 'b@example.com', 'subject': 'Hi\nBcc: x@y'}]
+        })
+        assert response.status_code == 200
+        assert response.get_json()['failed'] == [
+            {'to': 'b@example.com', 'error': 'Header values must not contain line breaks'}]
+    finally:
+        mail_app.mail.state.default_sender, mail_app.mail.state.suppress = previous
+
+
+if __name__ == '__main__':
+    test_message_structure()
+    test_shared_parts_serialized_once()
+    test_extra_headers()
+    test_sender_display_name_encoded_alone()
+    test_rejects_header_injection()
+    test_routes_reject_header_injection()
+    print("Fan-out tests passed")
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Tests for the priority lane scheduler
+Runs jobs against an in-memory scheduler and the Flask test client with sending suppressed
+"""
+
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from lanes import LaneScheduler, resolve_lane, parse_lanes, LANE_CRITICAL, LANE_BULK, LANE_TRANSACTIONAL
+from metrics import Metrics
+
+
+def test_resolve_lane():
+    """Priorities from callers map onto lanes, unknown values keep the endpoint default"""
+    assert resolve_lane('high') == LANE_CRITICAL
+    assert resolve_lane('LOW') == LANE_BULK
+    assert resolve_lane('normal', LANE_BULK) == LANE_TRANSACTIONAL
+    assert resolve_lane(None, LANE_BULK) == LANE_BULK
+    assert resolve_lane('whatever', LANE_CRITICAL) == LANE_CRITICAL
+    assert parse_lanes('critical:6:4, bulk:1:2') == {'critical': (6, 4), 'bulk': (1, 2)}
+
+
+def test_weighted_order():
+    """With one worker busy, queued critical jobs are picked ahead of bulk ones by weight"""
+    scheduler = LaneScheduler(lanes={LANE_CRITICAL: (3, 1), LANE_BULK: (1, 1)}, workers=1)
+    started = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def hold_worker():
+        started.set()
+        release.wait()
+
+    blocker = scheduler.submit(LANE_BULK, hold_worker)
+    started.wait(timeout=5)
+    futures = []
+    for index in range(4):
+        futures.append(scheduler.submit(LANE_BULK, order.append, f"bulk-{index}"))
+    for index in range(4):
+        futures.append(scheduler.submit(LANE_CRITICAL, order.append, f"critical-{index}"))
+
+    release.set()
+    blocker.result(timeout=5)
+    for future in futures:
+        future.result(timeout=5)
+    scheduler.shutdown()
+
+    # Smooth weighted round-robin at 3:1 gives critical three of the first four slots
+    assert [name.split('-')[0] for name in order[:4]].count('critical') == 3
+    assert sorted(order) == sorted([f"bulk-{i}" for i in range(4)] + [f"critical-{i}" for i in range(4)])
+
+
+def test_lane_metrics_and_errors():
+    """Failures propagate to the caller and latency is recorded per lane"""
+    registry = Metrics()
+    scheduler = LaneScheduler(workers=2, metrics=registry)
+
+    assert scheduler.run(LANE_TRANSACTIONAL, lambda: 42) == 42
+    try:
+        scheduler.run(LANE_CRITICAL, lambda: 1 / 0)
+        assert False, "expected ZeroDivisionError"
+    except ZeroDivisionError:
+        pass
+    scheduler.shutdown()
+
+    snapshot = registry.snapshot()
+    assert snapshot['counters']['lane_jobs_total{lane=transactional,status=ok}'] == 1
+    assert snapshot['counters']['lane_jobs_total{lane=critical,status=error}'] == 1
+    assert snapshot['summaries']['lane_latency_ms{lane=critical}']['count'] == 1
+
+
+def test_endpoints_use_lanes():
+    """Password resets go through the critical lane, welcome emails through transactional"""
+    import app as mail_app
+
+    mail_app.mail.state.suppress = True
+    mail_app.mail.state.default_sender = 'noreply@novakinetix.academy'
+    client = mail_app.app.test_client()
+
+    response = client.post('/api/send-password-reset', json={
+        'email': 'student@example.com',
+        'reset_url': 'https://novakinetix.academy/reset?token=abc'
+    })
+    assert response.status_code == 200
+    response = client.post('/api/send-email', json={
+        'to': 'student@example.com',
+        'subject': 'Hello',
+        'template': 'welcome',
+        'template_data': {'user_name': 'Sam'},
+        'priority': 'low'
+    })
+    assert response.status_code == 200
+
+    counters = client.get('/metrics').get_json()['counters']
+    assert counters.get('lane_jobs_total{lane=critical,status=ok}', 0) >= 1
+    assert counters.get('lane_jobs_total{lane=bulk,status=ok}', 0) >= 1
+
+
+if __name__ == '__main__':
+    test_resolve_lane()
+    test_weighted_order()
+    test_lane_metrics_and_errors()
+    test_endpoints_use_lanes()
+    print("Lane tests passed")
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Tests for localized template resolution and locale formatting
+"""
+
+import os
+import sys
+import email
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from locales import TemplateLocalizer, FORMATS, locale_chain, normalize_locale
+from relays import RelayPool
+from smtp_sink import SMTPSink
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+SENDER = 'noreply@novakinetix.academy'
+
+
+def _html(raw):
+    message = email.message_from_bytes(raw)
+    for part in message.walk():
+        if part.get_content_type() == 'text/html':
+            return part.get_payload(decode=True).decode('utf-8')
+    return None
+
+
+def test_locale_chain_and_negotiation():
+    assert normalize_locale('es_MX') == 'es-mx'
+    assert normalize_locale('<script>') is None
+    assert locale_chain('es-MX') == ['es-mx', 'es', 'en']
+
+    localizer = TemplateLocalizer(TEMPLATE_DIR)
+    assert 'es' in localizer.locales and 'en' in localizer.locales
+    assert localizer.negotiate('es-MX') == 'es'
+    assert localizer.negotiate('ES') == 'es'
+    assert localizer.negotiate('fr-CA') == 'en'
+    assert localizer.negotiate(None) == 'en'
+    assert localizer.negotiate('not a locale!') == 'en'
+    assert 'not a locale!' not in localizer._negotiated
+
+    assert TemplateLocalizer(TEMPLATE_DIR, default_locale='es').negotiate(None) == 'es'
+
+
+def test_resolve_falls_back_to_default_template():
+    localizer = TemplateLocalizer(TEMPLATE_DIR)
+    assert localizer.resolve('welcome', 'es') == 'es/welcome.html'
+    assert localizer.resolve('welcome', 'en') is None
+    assert localizer.resolve('welcome_email', 'es') is None
+    assert localizer.subject('welcome', 'es') == '¡Bienvenido a NOVAKINETIX ACADEMY!'
+    assert localizer.subject('welcome', 'fr') == 'Welcome to NOVAKINETIX ACADEMY!'
+
+
+def test_formats():
+    en, es = FORMATS['en'], FORMATS['es']
+    assert en.format_date('2024-05-01') == 'May 1, 2024'
+    assert es.format_date(date(2024, 5, 1)) == '1 de mayo de 2024'
+    assert es.format_date('2024-05-01', 'short') == '01/05/2024'
+    assert en.format_date('next Tuesday') == 'next Tuesday'
+    assert en.format_number(1234.5) == '1,234.5'
+    assert es.format_number(1234.5) == '1234,5'
+    assert es.format_number(12345) == '12.345'
+    assert es.format_number('7.50') == '7,5'
+    assert en.format_number(-1500) == '-1,500'
+    assert en.format_number('n/a') == 'n/a'
+
+
+def test_compiled_cache_is_per_locale():
+    import app as mail_app
+    data = {'user_name': 'Ana', 'hours_date': '2024-05-01', 'hours_count': 2.5, 'total_hours': 1200,
+            'activity_description': 'Tutoría'}
+    with mail_app.app.test_request_context():
+        spanish = mail_app.get_compiled_template('volunteer_hours_approved', 'es')
+        english = mail_app.get_compiled_template('volunteer_hours_approved', 'en')
+        assert spanish is not english
+        assert spanish is mail_app.get_compiled_template('volunteer_hours_approved', 'es')
+
+        html = mail_app.render_compiled(spanish, data, 'es')
+        assert '<html lang="es">' in html and 'Horas de voluntariado aprobadas' in html
+        assert '1 de mayo de 2024' in html and '2,5 horas' in html and '1200 horas' in html
+        assert 'Todos los derechos reservados' in html
+
+        html = mail_app.render_compiled(english, data, 'en')
+        assert '<html lang="en">' in html and 'May 1, 2024' in html and '1,200 hours' in html
+
+
+def test_app_sends_localized_mail():
+    import app as mail_app
+    with SMTPSink(keep=True) as sink:
+        previous = mail_app.relay_pool
+        mail_app.relay_pool = RelayPool([('127.0.0.1', sink.port, 1)])
+        mail_app.mail.state.suppress = False
+        mail_app.mail.state.default_sender = SENDER
+        try:
+            client = mail_app.app.test_client()
+            response = client.post('/api/send-welcome-email', json={
+                'email': 'ana@example.com', 'name': 'Ana', 'locale': 'es-MX'})
+            assert response.status_code == 200
+            message = email.message_from_bytes(sink.received[0])
+            assert str(email.header.make_header(email.header.decode_header(message['Subject']))) == \
+                '¡Bienvenido a NOVAKINETIX ACADEMY!'
+            assert 'Hola, Ana:' in _html(sink.received[0])
+
+            response = client.post('/api/send-batch', json={
+                'template': 'welcome',
+                'subject': 'Welcome',
+                'messages': [
+                    {'to': 'ana@example.com', 'locale': 'es', 'template_data': {'user_name': 'Ana'}},
+                    {'to': 'ada@example.com', 'template_data': {'user_name': 'Ada'}}
+                ]
+            })
+            assert response.get_json()['sent'] == 2
+            bodies = sorted(_html(raw) for raw in sink.received[1:])
+            assert any('Hola, Ana:' in body for body in bodies)
+            assert any('Dear Ada,' in body for body in bodies)
+        finally:
+            mail_app.relay_pool = previous
+            mail_app.mail.state.suppress = True
+
+
+if __name__ == '__main__':
+    test_locale_chain_and_negotiation()
+    test_resolve_falls_back_to_default_template()
+    test_formats()
+    test_compiled_cache_is_per_locale()
+    test_app_sends_localized_mail()
+    print("5 tests passed")
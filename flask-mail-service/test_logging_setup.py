@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Tests for the queued JSON logging pipeline
+"""
+
+import os
+import sys
+import json
+import queue
+import logging
+import subprocess
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from logging_setup import JsonFormatter, LazyQueueHandler, SuccessSampler
+
+
+def _record(msg, args=(), **extra):
+    record = logging.LogRecord('app', logging.INFO, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter_includes_extra_fields():
+    line = JsonFormatter().format(_record("Email sent successfully to %s", ('a@example.com',),
+                                          sampled=True, duration_ms=12.5))
+    payload = json.loads(line)
+    assert payload['message'] == 'Email sent successfully to a@example.com'
+    assert payload['duration_ms'] == 12.5
+    assert payload['level'] == 'INFO'
+    assert 'sampled' not in payload
+
+
+def test_queue_handler_defers_formatting():
+    """Records are enqueued with msg and args intact; formatting happens on the listener side"""
+    records = queue.SimpleQueue()
+    handler = LazyQueueHandler(records)
+    handler.handle(_record("sent to %s", ('a@example.com',)))
+    queued = records.get_nowait()
+    assert queued.msg == "sent to %s"
+    assert queued.args == ('a@example.com',)
+
+
+def test_success_sampler():
+    sampler = SuccessSampler(0.25)
+    kept = sum(sampler.filter(_record("ok", sampled=True)) for _ in range(100))
+    assert kept == 25
+    # Unflagged records (errors, warnings) are never sampled out
+    assert all(sampler.filter(_record("error")) for _ in range(10))
+    assert not SuccessSampler(0).filter(_record("ok", sampled=True))
+
+
+FORK_SCRIPT = '''
+import os, logging, time
+import logging_setup
+logging_setup.configure_logging(log_format='text')
+logging.getLogger('app').warning('before fork')
+pid = os.fork()
+if pid == 0:
+    logging.getLogger('app').warning('from child')
+    logging_setup.stop_logging()
+    os._exit(0)
+os.waitpid(pid, 0)
+'''
+
+
+def test_listener_restarts_after_fork():
+    """A forked worker gets its own listener thread and does not replay the parent's records"""
+    if not hasattr(os, 'fork'):
+        return
+    result = subprocess.run([sys.executable, '-c', FORK_SCRIPT], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, timeout=30)
+    lines = [line for line in result.stderr.splitlines() if line.startswith('WARNING:app:')]
+    assert sorted(lines) == ['WARNING:app:before fork', 'WARNING:app:from child']
+
+
+if __name__ == '__main__':
+    test_json_formatter_includes_extra_fields()
+    test_queue_handler_defers_formatting()
+    test_success_sampler()
+    test_listener_restarts_after_fork()
+    print("Logging tests passed")
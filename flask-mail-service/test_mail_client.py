@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Tests for the batching mail service client
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from mail_client import MailClient, MailClientError, match_results
+
+
+class FakeService(ThreadingHTTPServer):
+    """Answers /api/send-batch like the service, recording each request"""
+
+    daemon_threads = True
+
+    def __init__(self, delay=0.0, shed=0, status=200):
+        super().__init__(('127.0.0.1', 0), FakeHandler)
+        self.delay = delay
+        self.shed = shed
+        self.status = status
+        # Requests to accept and then drop without answering
+        self.drop = 0
+        # Close keep-alive connections after answering, as an idle timeout would
+        self.hang_up = False
+        self.batches = []
+        self.peers = set()
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with server.lock:
+            server.peers.add(self.client_address)
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            shed = server.shed > 0
+            server.shed -= 1
+        try:
+            time.sleep(server.delay)
+            if shed:
+                return self._reply(429, {'error': 'overloaded', 'retry_after': 1}, {'Retry-After': '1'})
+            if server.status != 200:
+                return self._reply(server.status, {'error': 'Failed to send batch'})
+            with server.lock:
+                server.batches.append(body)
+                drop = server.drop > 0
+                server.drop -= 1
+            if drop:
+                self.close_connection = True
+                return
+            messages = body['messages']
+            failed = [{'to': m['to'], 'error': 'Invalid email address'} for m in messages if '@' not in m['to']]
+            suppressed = [m['to'] for m in messages if m['to'].startswith('bounced')]
+            self._reply(200, {'message': 'Batch processed', 'sent': len(messages) - len(failed) - len(suppressed),
+                              'failed': failed, 'suppressed': suppressed})
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def _reply(self, status, data, headers=None):
+        raw = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(raw)
+        if self.server.hang_up:
+            self.close_connection = True
+
+
+def test_sends_are_coalesced_into_one_batch():
+    with FakeService() as service, MailClient(service.url, batch_window=0.2) as client:
+        futures = [client.send(to, 'welcome', {'user_name': 'Ada'}, subject='Welcome')
+                   for to in ('a@example.com', 'not-an-address', 'bounced@example.com', 'b@example.com')]
+        results = [future.result(timeout=5) for future in futures]
+        assert len(service.batches) == 1
+        assert service.batches[0]['messages'][0] == {
+            'to': 'a@example.com', 'template': 'welcome', 'template_data': {'user_name': 'Ada'}, 'subject': 'Welcome'}
+        assert [result['status'] for result in results] == ['sent', 'failed', 'suppressed', 'sent']
+        assert results[1]['error'] == 'Invalid email address'
+
+
+def test_max_batch_and_priority_split_batches():
+    with FakeService() as service, MailClient(service.url, batch_window=0.2, max_batch=3) as client:
+        futures = [client.send(f'user{i}@example.com', 'welcome') for i in range(5)]
+        futures.append(client.send('admin@example.com', 'password_reset', priority='critical'))
+        assert client.flush(timeout=5)
+        assert all(future.result()['status'] == 'sent' for future in futures)
+        sizes = sorted(len(batch['messages']) for batch in service.batches)
+        assert sizes == [1, 2, 3]
+        assert [batch.get('priority') for batch in service.batches].count('critical') == 1
+
+
+def test_connections_are_reused():
+    with FakeService() as service, MailClient(service.url, batch_window=0.01) as client:
+        for i in range(5):
+            assert client.send(f'user{i}@example.com', 'welcome').result(timeout=5)['status'] == 'sent'
+        assert len(service.batches) == 5
+        assert client.stats['connections'] == 1
+        assert len(service.peers) == 1
+
+
+def test_inflight_limit():
+    with FakeService(delay=0.1) as service, MailClient(service.url, batch_window=0, max_batch=1,
+                                                       max_inflight=2) as client:
+        futures = [client.send(f'user{i}@example.com', 'welcome') for i in range(6)]
+        assert all(future.result(timeout=5)['status'] == 'sent' for future in futures)
+        assert service.max_active == 2
+        assert client.stats['connections'] == 2
+
+
+def test_retries_after_429_and_reports_errors():
+    with FakeService(shed=2) as service, MailClient(service.url, batch_window=0, max_retry_wait=0.01) as client:
+        assert client.send('a@example.com', 'welcome').result(timeout=5)['status'] == 'sent'
+        assert client.stats['retries'] == 2
+
+    with FakeService(status=500) as service, MailClient(service.url, batch_window=0) as client:
+        try:
+            client.send('a@example.com', 'welcome').result(timeout=5)
+            assert False, 'expected MailClientError'
+        except MailClientError as e:
+            assert e.status == 500
+
+    client = MailClient(service.url, batch_window=0)
+    try:
+        client.send('a@example.com', 'welcome').result(timeout=5)
+        assert False, 'expected MailClientError'
+    except MailClientError as e:
+        assert e.status is None
+    finally:
+        client.close()
+
+
+def test_lost_responses_are_not_resent():
+    """A batch the server received is never sent again, but a closed idle connection is
+    replaced before use"""
+    with FakeService() as service, MailClient(service.url, batch_window=0) as client:
+        assert client.send('a@example.com', 'welcome').result(timeout=5)['status'] == 'sent'
+        service.drop = 1
+        try:
+            client.send('b@example.com', 'welcome').result(timeout=5)
+            assert False, 'expected MailClientError'
+        except MailClientError as e:
+            assert e.status is None
+        assert [batch['messages'][0]['to'] for batch in service.batches] == ['a@example.com', 'b@example.com']
+
+    with FakeService() as service, MailClient(service.url, batch_window=0) as client:
+        service.hang_up = True
+        for i in range(3):
+            assert client.send(f'user{i}@example.com', 'welcome').result(timeout=5)['status'] == 'sent'
+            time.sleep(0.05)
+        assert len(service.batches) == 3
+        assert client.stats['connections'] == 3
+
+
+def test_match_results_with_repeated_addresses():
+    items = [({'to': 'a@example.com'}, None)] * 3
+    data = {'failed': [{'to': 'a@example.com', 'error': 'refused'}], 'suppressed': []}
+    assert [result['status'] for result in match_results(items, data)] == ['failed', 'sent', 'sent']
+
+
+def test_against_service():
+    import app as mail_app
+    from werkzeug.serving import make_server
+    mail_app.mail.state.suppress = True
+    mail_app.mail.state.default_sender = 'noreply@novakinetix.academy'
+    server = make_server('127.0.0.1', 0, mail_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with MailClient(f'http://127.0.0.1:{server.server_port}') as client:
+            futures = [client.send(f'intern{i}@example.com', 'welcome', {'user_name': f'Intern {i}'},
+                                   subject='Welcome') for i in range(3)]
+            futures.append(client.send('intern@example.com', 'no_such_template', subject='Hi'))
+            statuses = [future.result(timeout=10)['status'] for future in futures]
+            assert statuses == ['sent', 'sent', 'sent', 'failed']
+            status, data = client.post('/api/send-welcome-email', {'email': 'ada@example.com', 'name': 'Ada'})
+            assert status == 200 and data['message'] == 'Email sent successfully'
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    test_sends_are_coalesced_into_one_batch()
+    test_max_batch_and_priority_split_batches()
+    test_connections_are_reused()
+    test_inflight_limit()
+    test_retries_after_429_and_reports_errors()
+    test_lost_responses_are_not_resent()
+    test_match_results_with_repeated_addresses()
+    test_against_service()
+    print("8 tests passed")
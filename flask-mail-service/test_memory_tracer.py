@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Tests for on-demand allocation tracing
+"""
+
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from memory_tracer import MemoryTracer
+
+HEADERS = {'X-Admin-Token': 'secret'}
+
+_retained = []
+
+
+def grow():
+    _retained.extend(bytearray(4096) for _ in range(200))
+
+
+def test_report_diffs_between_snapshots():
+    tracer = MemoryTracer()
+    tracer.register('retained', lambda: len(_retained))
+    tracer.register('broken', lambda: 1 / 0)
+
+    report = tracer.report()
+    assert report['tracing'] is False and 'top' not in report
+    assert report['sizes']['retained'] == 0
+    assert report['sizes']['broken'].startswith('error:')
+
+    tracer.start(frames=2)
+    try:
+        grow()
+        report = tracer.report(limit=5)
+        top = report['top'][0]
+        assert top['site'].startswith(__file__) and top['size_diff'] >= 200 * 4096
+        assert report['sizes']['retained'] == 200
+
+        # The next report only shows growth since this one
+        report = tracer.report(limit=5)
+        assert all(stat['size_diff'] < 200 * 4096 for stat in report['top'])
+        report = tracer.report(limit=5, since='start', group_by='traceback')
+        assert report['top'][0]['size_diff'] >= 200 * 4096
+        assert isinstance(report['top'][0]['site'], list)
+    finally:
+        tracer.stop()
+        _retained.clear()
+    assert not tracemalloc.is_tracing()
+
+    try:
+        tracer.start(frames=0)
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+
+
+def test_memory_endpoint():
+    import app as mail_app
+    os.environ['ADMIN_API_TOKEN'] = 'secret'
+    try:
+        mail_app.mail.state.suppress = True
+        mail_app.mail.state.default_sender = 'noreply@novakinetix.academy'
+        client = mail_app.app.test_client()
+
+        assert client.get('/admin/memory').status_code == 401
+        report = client.get('/admin/memory', headers=HEADERS).get_json()
+        assert report['tracing'] is False and report['pid'] == os.getpid()
+        assert {'email_queue', 'compiled_templates', 'preview_cache', 'attachment_memory_bytes'} <= set(report['sizes'])
+        assert client.post('/admin/memory', json={'frames': 'x'}, headers=HEADERS).status_code == 400
+
+        response = client.post('/admin/memory', json={'frames': 3}, headers=HEADERS)
+        assert response.status_code == 200 and response.get_json()['pid'] == os.getpid()
+        try:
+            queued = len(mail_app.email_service.email_queue)
+            with mail_app.app.app_context():
+                result = mail_app.email_service.send_email('student@example.com', 'Hello', '<p>Hi</p>')
+            assert result['success']
+            report = client.get('/admin/memory?limit=5', headers=HEADERS).get_json()
+            assert report['tracing'] is True and len(report['top']) <= 5
+            assert report['sizes']['email_queue'] == queued + 1
+            assert report['traced_bytes'] > 0
+            assert client.get('/admin/memory?group_by=module', headers=HEADERS).status_code == 400
+        finally:
+            assert client.delete('/admin/memory', headers=HEADERS).status_code == 200
+        assert not tracemalloc.is_tracing()
+    finally:
+        os.environ.pop('ADMIN_API_TOKEN')
+
+
+if __name__ == '__main__':
+    test_report_diffs_between_snapshots()
+    test_memory_endpoint()
+    print("2 tests passed")
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Tests for outbox pull mode
+Runs claims against a temporary SQLite outbox, and the poller against the app and a local SMTP sink
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from outbox import SQLiteOutbox, OutboxPoller, open_outbox
+from metrics import Metrics
+from relays import RelayPool
+from smtp_sink import SMTPSink
+
+SENDER = 'noreply@novakinetix.academy'
+
+
+def new_store(tmp):
+    return open_outbox(f'sqlite:///{os.path.join(tmp, "outbox.sqlite3")}')
+
+
+def test_claims_are_exclusive():
+    """Concurrent claimers split the rows between them and never share one"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = new_store(tmp)
+        assert isinstance(store, SQLiteOutbox)
+        for index in range(200):
+            store.enqueue(f'user{index}@example.com', 'welcome', 'Welcome')
+        claimed = []
+        lock = threading.Lock()
+
+        def claimer(owner):
+            while True:
+                rows = store.claim(7, owner)
+                if not rows:
+                    return
+                with lock:
+                    claimed.extend(row['id'] for row in rows)
+
+        threads = [threading.Thread(target=claimer, args=(f'worker-{index}',)) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(claimed) == 200 and len(set(claimed)) == 200
+        assert store.counts() == {'claimed': 200}
+
+        # A claim that outlives its lease can be taken over, and the late owner's results are ignored
+        rows = store.claim(5, 'worker-5', lease=0)
+        assert len(rows) == 5 and all(row['attempts'] == 2 for row in rows)
+        store.finish('worker-0', [(row['id'], 'sent', None, None) for row in rows])
+        store.finish('worker-5', [(rows[0]['id'], 'sent', None, None), (rows[1]['id'], 'failed', 'boom', None)])
+        assert store.counts() == {'claimed': 198, 'sent': 1, 'failed': 1}
+
+    try:
+        open_outbox('mysql://localhost/mail')
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+
+
+def test_poller_retries_and_gives_up():
+    """Failed sends are retried with backoff, invalid rows and exhausted retries fail"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = new_store(tmp)
+        store.enqueue('ok@example.com', 'welcome', 'Welcome', {'user_name': 'Ok'})
+        store.enqueue('flaky@example.com', 'welcome', 'Welcome')
+        store.enqueue('bad@example.com', 'welcome', 'Welcome')
+        store.enqueue('gone@example.com', 'welcome', 'Welcome')
+        conn = store.connection()
+        conn.execute("INSERT INTO outbox (recipient, template, template_data) VALUES ('x@example.com', 'welcome', '[1')")
+
+        batches = []
+        outcomes = {
+            'ok@example.com': {'status': 'sent'},
+            'flaky@example.com': {'status': 'failed', 'error': '451 try later'},
+            'bad@example.com': {'status': 'invalid', 'error': 'Invalid email address'},
+            'gone@example.com': {'status': 'suppressed'}
+        }
+
+        def deliver(messages):
+            batches.append(messages)
+            return [outcomes[message['to']] for message in messages]
+
+        registry = Metrics()
+        poller = OutboxPoller(store, deliver, batch_size=10, max_attempts=2, retry_backoff=0.05, metrics=registry)
+        assert poller.poll_once() == 5
+        assert batches[0][0]['template_data'] == {'user_name': 'Ok'} and len(batches[0]) == 4
+        assert store.counts() == {'sent': 1, 'pending': 1, 'failed': 2, 'suppressed': 1}
+
+        # Not due yet, then retried once more and given up on
+        assert poller.poll_once() == 0
+        time.sleep(0.06)
+        assert poller.poll_once() == 1
+        assert store.counts() == {'sent': 1, 'failed': 3, 'suppressed': 1}
+        error = conn.execute("SELECT last_error FROM outbox WHERE recipient = 'flaky@example.com'").fetchone()[0]
+        assert error == '451 try later'
+
+        counters = registry.snapshot()['counters']
+        assert counters['outbox_messages_total{status=retry}'] == 1
+        assert counters['outbox_messages_total{status=failed}'] == 3
+
+        # An error before anything was sent retries the whole batch
+        store.enqueue('ok@example.com', 'welcome', 'Welcome')
+        poller.deliver = lambda messages: 1 / 0
+        assert poller.poll_once() == 1
+        assert store.counts()['pending'] == 1
+
+
+def test_poller_sends_through_app():
+    import app as mail_app
+    with tempfile.TemporaryDirectory() as tmp, SMTPSink(keep=True) as sink:
+        store = new_store(tmp)
+        store.enqueue('ada@example.com', 'welcome', 'Welcome', {'user_name': 'Ada'})
+        store.enqueue('not-an-address', 'welcome', 'Welcome')
+        store.enqueue('sam@example.com', 'password_reset', 'Restablecer', {'user_name': 'Sam'},
+                      locale='es', priority='high')
+        store.enqueue('kim@example.com', 'no_such_template', 'Hello')
+
+        previous = mail_app.relay_pool
+        mail_app.relay_pool = RelayPool([('127.0.0.1', sink.port, 1)])
+        mail_app.mail.state.suppress = False
+        mail_app.mail.state.default_sender = SENDER
+        poller = OutboxPoller(store, mail_app.deliver_outbox, interval=0.01)
+        try:
+            poller.start()
+            deadline = time.monotonic() + 10
+            while store.counts().get('pending') or store.counts().get('claimed'):
+                assert time.monotonic() < deadline
+                time.sleep(0.02)
+        finally:
+            poller.stop()
+            mail_app.relay_pool = previous
+            mail_app.mail.state.suppress = True
+
+        assert store.counts() == {'sent': 2, 'failed': 2}
+        assert sink.messages == 2
+        bodies = b''.join(message for message in sink.received)
+        assert b'ada@example.com' in bodies and b'sam@example.com' in bodies
+
+
+def test_failed_chunk_is_retried_alone():
+    import app as mail_app
+    state = mail_app.mail.state
+    previous = (mail_app.relay_pool, mail_app.BATCH_SEND_CHUNK, state.server, state.port,
+                state.use_tls, state.username)
+    original_connect = mail_app.mail.connect
+    calls = []
+    lock = threading.Lock()
+
+    def connect():
+        with lock:
+            calls.append(None)
+            if len(calls) == 2:
+                raise ConnectionRefusedError('Connection refused')
+        return original_connect()
+
+    with tempfile.TemporaryDirectory() as tmp, SMTPSink(keep=True) as sink:
+        store = new_store(tmp)
+        addresses = [f'user{i}@example.com' for i in range(6)]
+        for address in addresses:
+            store.enqueue(address, 'welcome', 'Welcome')
+
+        mail_app.relay_pool = None
+        mail_app.BATCH_SEND_CHUNK = 2
+        state.server, state.port, state.use_tls, state.username = '127.0.0.1', sink.port, False, None
+        state.suppress = False
+        state.default_sender = SENDER
+        mail_app.mail.connect = connect
+        poller = OutboxPoller(store, mail_app.deliver_outbox, retry_backoff=0)
+        try:
+            assert poller.poll_once() == 6
+            assert store.counts() == {'sent': 4, 'pending': 2}
+            assert poller.poll_once() == 2
+        finally:
+            del mail_app.mail.connect
+            (mail_app.relay_pool, mail_app.BATCH_SEND_CHUNK, state.server, state.port,
+             state.use_tls, state.username) = previous
+            state.suppress = True
+
+        assert store.counts() == {'sent': 6}
+        recipients = [line for message in sink.received for line in message.split(b'\r\n')
+                      if line.startswith(b'To: ')]
+        assert sorted(recipients) == sorted(f'To: {address}'.encode() for address in addresses)
+
+
+if __name__ == '__main__':
+    test_claims_are_exclusive()
+    test_poller_retries_and_gives_up()
+    test_poller_sends_through_app()
+    test_failed_chunk_is_retried_alone()
+    print("4 tests passed")
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Tests for template previews with ETag revalidation
+"""
+
+import os
+import sys
+import json
+import tempfile
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from preview import PreviewCache, data_digest, templates_version
+from metrics import Metrics
+
+HEADERS = {'X-Admin-Token': 'secret'}
+
+
+def test_etag_depends_on_version_and_data():
+    assert data_digest({'a': 1, 'b': [1, 2]}) == data_digest({'b': [1, 2], 'a': 1})
+    cache = PreviewCache('v1')
+    etag = cache.etag('welcome', 'en', {'user_name': 'Ada'})
+    assert etag == cache.etag('welcome', 'en', {'user_name': 'Ada'})
+    assert etag != cache.etag('welcome', 'en', {'user_name': 'Grace'})
+    assert etag != cache.etag('welcome', 'es', {'user_name': 'Ada'})
+    assert etag != PreviewCache('v2').etag('welcome', 'en', {'user_name': 'Ada'})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'base.html'), 'w') as f:
+            f.write('<html></html>')
+        before = templates_version({'welcome': 'Hi'}, tmp)
+        assert before == templates_version({'welcome': 'Hi'}, tmp)
+        assert before != templates_version({'welcome': 'Hello'}, tmp)
+        with open(os.path.join(tmp, 'base.html'), 'w') as f:
+            f.write('<html><body></body></html>')
+        assert before != templates_version({'welcome': 'Hi'}, tmp)
+
+
+def test_cache_is_bounded():
+    registry = Metrics()
+    cache = PreviewCache('v1', max_entries=2, metrics=registry)
+    cache.put('a', '<p>a</p>')
+    cache.put('b', '<p>b</p>')
+    assert cache.get('a') == '<p>a</p>'
+    cache.put('c', '<p>c</p>')
+    assert cache.get('b') is None
+    assert len(cache) == 2
+    counters = registry.snapshot()['counters']
+    assert counters['preview_total{result=hit}'] == 1
+    assert counters['preview_total{result=miss}'] == 1
+
+
+def test_preview_endpoint():
+    import app as mail_app
+    os.environ['ADMIN_API_TOKEN'] = 'secret'
+    try:
+        client = mail_app.app.test_client()
+        assert client.get('/api/preview/welcome').status_code == 401
+        assert client.get('/api/preview/no_such_template', headers=HEADERS).status_code == 404
+        assert client.get('/api/preview/welcome?data=[1]', headers=HEADERS).status_code == 400
+
+        cache = mail_app.get_preview_cache()
+        renders = []
+        original = mail_app.render_compiled
+        mail_app.render_compiled = lambda *args: renders.append(args) or original(*args)
+        try:
+            data = json.dumps({'user_name': 'Grace Hopper'})
+            response = client.get(f'/api/preview/welcome?data={data}', headers=HEADERS)
+            assert response.status_code == 200
+            assert response.mimetype == 'text/html'
+            html = response.get_data(as_text=True)
+            assert 'Dear Grace Hopper,' in html
+            assert 'cid:' not in html and 'data:image/png;base64,' in html
+            etag = response.headers['ETag']
+            assert etag.startswith('"') and not etag.startswith('W/')
+
+            response = client.get(f'/api/preview/welcome?data={data}', headers=dict(HEADERS, **{'If-None-Match': etag}))
+            assert response.status_code == 304
+            assert response.headers['ETag'] == etag
+
+            # Served from the cache without the conditional header, re-rendered for new data
+            response = client.get(f'/api/preview/welcome?data={data}', headers=HEADERS)
+            assert response.status_code == 200 and response.headers['ETag'] == etag
+            assert len(renders) == 1
+
+            response = client.get('/api/preview/welcome?locale=es', headers=HEADERS)
+            assert 'Hola, Ada Lovelace:' in response.get_data(as_text=True)
+            assert response.headers['ETag'] != etag
+            assert len(renders) == 2
+
+            response = client.get('/api/preview/volunteer_hours_approved', headers=HEADERS)
+            assert 'May 1, 2024' in response.get_data(as_text=True)
+        finally:
+            mail_app.render_compiled = original
+        assert len(cache) >= 3
+    finally:
+        os.environ.pop('ADMIN_API_TOKEN')
+
+
+if __name__ == '__main__':
+    test_etag_depends_on_version_and_data()
+    test_cache_is_bounded()
+    test_preview_endpoint()
+    print("3 tests passed")
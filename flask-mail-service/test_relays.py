@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Tests for the weighted SMTP relay pool, using local SMTP sinks as relays
+"""
+
+import os
+import sys
+import socket
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from relays import RelayPool, parse_relays
+from smtp_sink import SMTPSink
+from metrics import Metrics
+
+SENDER = 'noreply@novakinetix.academy'
+PAYLOAD = b'Subject: test\r\n\r\nhello\r\n'
+
+
+def _closed_port():
+    """A localhost port with nothing listening on it"""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_parse_relays():
+    assert parse_relays('smtp-a.example.com:587:3, smtp-b.example.com:2525,smtp-c.example.com') == [
+        ('smtp-a.example.com', 587, 3),
+        ('smtp-b.example.com', 2525, 1),
+        ('smtp-c.example.com', 587, 1)
+    ]
+
+
+def test_weighted_distribution():
+    with SMTPSink() as heavy, SMTPSink() as light:
+        registry = Metrics()
+        pool = RelayPool([('127.0.0.1', heavy.port, 3), ('127.0.0.1', light.port, 1)], metrics=registry)
+        for i in range(8):
+            pool.send(SENDER, [f'user{i}@example.com'], PAYLOAD)
+
+        assert (heavy.messages, light.messages) == (6, 2)
+        counters = registry.snapshot()['counters']
+        assert counters[f'relay_messages_total{{relay=127.0.0.1:{heavy.port},status=sent}}'] == 6
+
+
+def test_failover_and_ejection():
+    dead_port = _closed_port()
+    with SMTPSink() as sink:
+        registry = Metrics()
+        pool = RelayPool([('127.0.0.1', dead_port, 5), ('127.0.0.1', sink.port, 1)],
+                         failure_threshold=2, timeout=2, metrics=registry)
+        pool.start = lambda: None  # probes are driven by the test
+
+        failed = pool.send_many(SENDER, [(f'user{i}@example.com', PAYLOAD) for i in range(10)])
+        assert failed == []
+        assert sink.messages == 10
+
+        pool.send(SENDER, ['another@example.com'], PAYLOAD)
+        dead = f'127.0.0.1:{dead_port}'
+        assert pool.stats()[dead]['healthy'] is False
+        snapshot = registry.snapshot()
+        assert snapshot['counters'][f'relay_errors_total{{relay={dead}}}'] == 2
+        assert snapshot['counters']['relay_failovers_total'] == 2
+        assert snapshot['gauges'][f'relay_healthy{{relay={dead}}}'] == 0
+
+        # Out of rotation: further sends go straight to the healthy relay
+        pool.send(SENDER, ['third@example.com'], PAYLOAD)
+        assert snapshot['counters']['relay_failovers_total'] == registry.snapshot()['counters']['relay_failovers_total']
+        assert sink.messages == 12
+
+
+def test_ejected_relay_restored_after_probe():
+    port = _closed_port()
+    pool = RelayPool([('127.0.0.1', port, 1)], failure_threshold=1, timeout=2)
+    pool.start = lambda: None
+    try:
+        pool.send(SENDER, ['user@example.com'], PAYLOAD)
+        assert False, "send should fail while the only relay is down"
+    except Exception as e:
+        assert 'All SMTP relays failed' in str(e)
+    assert pool.stats()[f'127.0.0.1:{port}']['healthy'] is False
+
+    pool.check_ejected()
+    assert pool.stats()[f'127.0.0.1:{port}']['healthy'] is False
+
+    with SMTPSink(port=port) as sink:
+        pool.check_ejected()
+        assert pool.stats()[f'127.0.0.1:{port}']['healthy'] is True
+        pool.send(SENDER, ['user@example.com'], PAYLOAD)
+        assert sink.messages == 1
+
+
+def test_app_sends_through_relays():
+    import app as mail_app
+    with SMTPSink() as first, SMTPSink() as second:
+        pool = RelayPool([('127.0.0.1', first.port, 1), ('127.0.0.1', second.port, 1)])
+        previous = mail_app.relay_pool
+        mail_app.relay_pool = pool
+        mail_app.mail.state.suppress = False
+        mail_app.mail.state.default_sender = SENDER
+        try:
+            client = mail_app.app.test_client()
+            response = client.post('/api/send-welcome-email', json={'email': 'ada@example.com', 'name': 'Ada'})
+            assert response.status_code == 200
+            response = client.post('/api/send-batch', json={
+                'template': 'welcome',
+                'subject': 'Welcome',
+                'messages': [{'to': f'user{i}@example.com', 'template_data': {'user_name': str(i)}}
+                             for i in range(3)]
+            })
+            assert response.get_json()['sent'] == 3
+            assert first.messages + second.messages == 4
+            assert 'relays' in client.get('/metrics').get_json()
+        finally:
+            mail_app.relay_pool = previous
+            mail_app.mail.state.suppress = True
+
+
+def test_app_rejects_bad_headers():
+    """The serialized send path refuses headers that Flask-Mail would refuse"""
+    import app as mail_app
+    from flask_mail import Message, BadHeaderError
+    with SMTPSink() as sink:
+        previous = mail_app.relay_pool
+        mail_app.relay_pool = RelayPool([('127.0.0.1', sink.port, 1)])
+        mail_app.mail.state.suppress = False
+        mail_app.mail.state.default_sender = SENDER
+        try:
+            with mail_app.app.app_context():
+                msg = Message(subject='Hi\r\nBcc: evil@example.com', recipients=['ada@example.com'], html='<p>Hi</p>')
+                try:
+                    mail_app.send_message(msg)
+                except BadHeaderError:
+                    pass
+                else:
+                    raise AssertionError('Bad header was sent')
+                mail_app.send_message(Message(subject='Hi', recipients=['ada@example.com'], html='<p>Hi</p>'))
+            assert sink.messages == 1
+        finally:
+            mail_app.relay_pool = previous
+            mail_app.mail.state.suppress = True
+
+
+if __name__ == '__main__':
+    test_parse_relays()
+    test_weighted_distribution()
+    test_failover_and_ejection()
+    test_ejected_relay_restored_after_probe()
+    test_app_sends_through_relays()
+    test_app_rejects_bad_headers()
+    print("Relay tests passed")
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Tests for the batch render pool
+Checks that pooled and inline renders produce the same personalized MIME messages
+"""
+
+import os
+import sys
+import threading
+from email import message_from_bytes
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from render_pool import RenderPool, chunked
+from smtp_sink import SMTPSink
+
+TEMPLATES = {
+    'greeting': '{% extends "base_email.html" %}{% block content %}<p>Dear {{ user_name }},</p>{% endblock %}'
+}
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+
+
+def _jobs(count, template='greeting'):
+    return [{
+        'sender': 'noreply@novakinetix.academy',
+        'to': f'intern{i}@example.com',
+        'subject': 'Volunteer Hours Approved',
+        'template': template,
+        'template_data': {'user_name': f'Intern <{i}>'}
+    } for i in range(count)]
+
+
+def _html_of(payload):
+    message = message_from_bytes(payload)
+    for part in message.walk():
+        if part.get_content_type() == 'text/html':
+            return part.get_payload(decode=True).decode('utf-8')
+    return None
+
+
+def test_chunked():
+    assert chunked(list(range(5)), 2) == [[0, 1], [2, 3], [4]]
+    assert chunked([], 3) == []
+
+
+def test_inline_render():
+    """Small batches render in-process with autoescaping and the logo as a related part"""
+    pool = RenderPool(TEMPLATES, TEMPLATE_DIR, logo=b'\x89PNG fake', processes=1)
+    results = pool.render(_jobs(3))
+
+    assert [to for to, _, _ in results] == [f'intern{i}@example.com' for i in range(3)]
+    to, payload, error = results[1]
+    assert error is None
+    html = _html_of(payload)
+    assert 'Dear Intern &lt;1&gt;' in html
+    assert 'cid:novakinetix-logo' in html
+
+    message = message_from_bytes(payload)
+    assert message['To'] == 'intern1@example.com'
+    assert any(part.get('Content-ID') == '<novakinetix-logo>' for part in message.walk())
+
+
+def test_pool_matches_inline():
+    """The process pool returns results in job order and reports per-job errors"""
+    pool = RenderPool(TEMPLATES, TEMPLATE_DIR, processes=2, chunksize=4, min_batch=1)
+    jobs = _jobs(10)
+    jobs[4]['template'] = 'missing'
+    try:
+        results = pool.render(jobs)
+    finally:
+        pool.close()
+
+    assert [to for to, _, _ in results] == [job['to'] for job in jobs]
+    assert results[4][1] is None and results[4][2]
+    assert 'Dear Intern &lt;7&gt;' in _html_of(results[7][1])
+
+
+def test_batch_endpoint():
+    """The batch endpoint renders file templates and reports invalid recipients"""
+    import app as mail_app
+
+    mail_app.mail.state.suppress = True
+    mail_app.mail.state.default_sender = 'noreply@novakinetix.academy'
+    client = mail_app.app.test_client()
+
+    response = client.post('/api/send-batch', json={
+        'template': 'volunteer_hours_approved',
+        'subject': 'Your Volunteer Hours Have Been Approved!',
+        'messages': [
+            {'to': 'intern1@example.com', 'template_data': {'intern_name': 'Ada', 'hours': 2}},
+            {'to': 'intern2@example.com', 'template_data': {'intern_name': 'Lin', 'hours': 3}},
+            {'to': 'not-an-email'}
+        ]
+    })
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body['sent'] == 2
+    assert body['failed'] == [{'to': 'not-an-email', 'error': 'Invalid email address'}]
+
+
+def test_failed_connection_fails_only_its_chunk():
+    """A chunk whose SMTP connection cannot be opened fails alone; the others are sent"""
+    import app as mail_app
+
+    state = mail_app.mail.state
+    previous = (mail_app.relay_pool, mail_app.BATCH_SEND_CHUNK, state.server, state.port,
+                state.use_tls, state.username)
+    original_connect = mail_app.mail.connect
+    calls = []
+    lock = threading.Lock()
+
+    def connect():
+        with lock:
+            calls.append(None)
+            if len(calls) == 2:
+                raise ConnectionRefusedError('Connection refused')
+        return original_connect()
+
+    with SMTPSink(keep=True) as sink:
+        mail_app.relay_pool = None
+        mail_app.BATCH_SEND_CHUNK = 2
+        state.server, state.port, state.use_tls, state.username = '127.0.0.1', sink.port, False, None
+        state.suppress = False
+        state.default_sender = 'noreply@novakinetix.academy'
+        mail_app.mail.connect = connect
+        try:
+            response = mail_app.app.test_client().post('/api/send-batch', json={
+                'template': 'welcome',
+                'subject': 'Welcome',
+                'messages': [{'to': f'user{i}@example.com'} for i in range(6)]
+            })
+        finally:
+            del mail_app.mail.connect
+            (mail_app.relay_pool, mail_app.BATCH_SEND_CHUNK, state.server, state.port,
+             state.use_tls, state.username) = previous
+            state.suppress = True
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body['sent'] == 4 and len(sink.received) == 4
+    assert [failure['error'] for failure in body['failed']] == ['Connection refused'] * 2
+
+
+if __name__ == '__main__':
+    test_chunked()
+    test_inline_render()
+    test_pool_matches_inline()
+    test_batch_endpoint()
+    test_failed_connection_fails_only_its_chunk()
+    print("Render pool tests passed")
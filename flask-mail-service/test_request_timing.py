@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Tests for Server-Timing headers, correlation IDs and the admin profiler
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import app as mail_app
+
+RESET_PAYLOAD = {'email': 'student@example.com', 'reset_url': 'https://novakinetix.academy/reset?token=abc'}
+
+
+def _client():
+    mail_app.mail.state.suppress = True
+    mail_app.mail.state.default_sender = 'noreply@novakinetix.academy'
+    return mail_app.app.test_client()
+
+
+def test_server_timing_header():
+    """Send routes report each stage and echo the caller's correlation ID"""
+    response = _client().post('/api/send-password-reset', json=RESET_PAYLOAD,
+                              headers={'X-Request-ID': 'req-123'})
+    assert response.status_code == 200
+    assert response.headers['X-Request-ID'] == 'req-123'
+
+    stages = [part.split(';')[0] for part in response.headers['Server-Timing'].split(', ')]
+    expected = ['parse', 'validate', 'suppression', 'render', 'logo', 'smtp', 'total']
+    if mail_app.MINIFY_MODE == 'full':
+        expected.insert(4, 'minify')
+    assert stages == expected
+
+
+def test_request_id_generated():
+    response = _client().get('/health')
+    assert len(response.headers['X-Request-ID']) == 32
+    assert 'Server-Timing' not in response.headers
+
+
+def test_profiler_requires_token():
+    client = _client()
+    os.environ.pop('ADMIN_API_TOKEN', None)
+    assert client.post('/admin/profile', json={'requests': 1}).status_code == 403
+
+    os.environ['ADMIN_API_TOKEN'] = 'secret'
+    try:
+        assert client.post('/admin/profile', json={'requests': 1},
+                           headers={'X-Admin-Token': 'wrong'}).status_code == 401
+    finally:
+        os.environ.pop('ADMIN_API_TOKEN')
+
+
+def test_profiler_modes():
+    """Armed profilers capture exactly the next N send requests"""
+    client = _client()
+    headers = {'X-Admin-Token': 'secret'}
+    os.environ['ADMIN_API_TOKEN'] = 'secret'
+    try:
+        for mode in ('cprofile', 'sample'):
+            response = client.post('/admin/profile', headers=headers,
+                                   json={'mode': mode, 'requests': 2, 'interval_ms': 1})
+            assert response.status_code == 200
+            for _ in range(3):
+                client.post('/api/send-password-reset', json=RESET_PAYLOAD)
+
+            report = client.get('/admin/profile', headers=headers).get_json()
+            assert report['mode'] == mode
+            assert report['profiled_requests'] == 2
+            assert report['remaining'] == 0
+            if mode == 'cprofile':
+                assert 'send_email_internal' in report['profile']
+                # The SMTP send runs on a lane worker, which is profiled too
+                report = client.get('/admin/profile?limit=1000', headers=headers).get_json()
+                assert '_send_in_app_context' in report['profile']
+            else:
+                assert 'stacks' in report
+
+        assert client.post('/admin/profile', headers=headers, json={'mode': 'bogus'}).status_code == 400
+        client.delete('/admin/profile', headers=headers)
+        assert client.get('/admin/profile', headers=headers).get_json()['mode'] is None
+    finally:
+        os.environ.pop('ADMIN_API_TOKEN')
+
+
+if __name__ == '__main__':
+    test_server_timing_header()
+    test_request_id_generated()
+    test_profiler_requires_token()
+    test_profiler_modes()
+    print("Request timing tests passed")
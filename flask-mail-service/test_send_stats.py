@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Tests for the rolling send statistics behind /api/stats
+"""
+
+import os
+import sys
+import random
+import tempfile
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from send_stats import DDSketch, SendStats
+from shared_state import SharedState
+
+
+def test_sketch_quantiles_within_relative_accuracy():
+    rng = random.Random(7)
+    values = sorted(rng.lognormvariate(4, 1) for _ in range(20000))
+    sketch = DDSketch(0.01)
+    for value in values:
+        sketch.add(value)
+    for q in (0.5, 0.9, 0.99):
+        exact = values[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - exact) / exact <= 0.011
+    # The sketch grows with the range of values, not with how many were added
+    assert len(sketch.buckets) < 1000
+    assert DDSketch().quantile(0.5) is None
+
+
+def test_record_and_snapshot():
+    with tempfile.TemporaryDirectory() as tmp:
+        stats = SendStats(SharedState(os.path.join(tmp, 'state.sqlite3')), cache_ttl=0)
+        for latency in (10, 20, 30, 40):
+            stats.record('welcome', 'sent', latency)
+        stats.record('welcome', 'failed')
+        stats.record('password_reset', 'suppressed', count=3)
+
+        snapshot = stats.snapshot()
+        assert snapshot['totals'] == {'sent': 4, 'failed': 1, 'suppressed': 3, 'rejected': 0}
+        assert snapshot['templates']['welcome']['sent'] == 4
+        assert snapshot['templates']['welcome']['latency_ms']['count'] == 4
+        assert abs(snapshot['templates']['welcome']['latency_ms']['p50'] - 20) <= 0.2
+        assert snapshot['templates']['password_reset'] == {'suppressed': 3, 'latency_ms': None}
+        assert sum(snapshot['daily'][day]['sent'] for day in snapshot['daily']) == 4
+        assert snapshot['latency_today_ms']['count'] == 4
+
+        # Another worker's SendStats on the same store sees the same figures
+        other = SendStats(SharedState(os.path.join(tmp, 'state.sqlite3')), cache_ttl=0)
+        assert other.snapshot()['totals'] == snapshot['totals']
+
+
+def test_hourly_buckets_expire():
+    with tempfile.TemporaryDirectory() as tmp:
+        stats = SendStats(SharedState(os.path.join(tmp, 'state.sqlite3')), hours=1, days=1, cache_ttl=0)
+        stats.record('welcome', 'sent', when=1_000_000_000)
+        snapshot = stats.snapshot()
+        # Recorded long ago: the hour and day buckets are past their TTL, the totals are kept
+        assert snapshot['hourly'] == {} and snapshot['daily'] == {}
+        assert snapshot['totals']['sent'] == 1
+
+
+def test_stats_endpoint():
+    import app as mail_app
+    mail_app.mail.state.suppress = True
+    mail_app.mail.state.default_sender = 'noreply@novakinetix.academy'
+    previous = mail_app.send_stats
+    with tempfile.TemporaryDirectory() as tmp:
+        mail_app.send_stats = SendStats(SharedState(os.path.join(tmp, 'state.sqlite3')), cache_ttl=0)
+        os.environ['ADMIN_API_TOKEN'] = 'secret'
+        try:
+            client = mail_app.app.test_client()
+            assert client.get('/api/stats').status_code == 401
+            response = client.post('/api/send-welcome-email', json={'email': 'ada@example.com', 'name': 'Ada'})
+            assert response.status_code == 200
+            response = client.post('/api/send-batch', json={
+                'template': 'welcome',
+                'subject': 'Welcome',
+                'messages': [{'to': 'a@example.com'}, {'to': 'b@example.com'}]
+            })
+            assert response.get_json()['sent'] == 2
+
+            snapshot = client.get('/api/stats', headers={'X-Admin-Token': 'secret'}).get_json()
+            assert snapshot['templates']['welcome']['sent'] == 3
+            assert snapshot['latency_ms']['count'] == 1
+        finally:
+            mail_app.send_stats = previous
+            os.environ.pop('ADMIN_API_TOKEN')
+
+
+if __name__ == '__main__':
+    test_sketch_quantiles_within_relative_accuracy()
+    test_record_and_snapshot()
+    test_hourly_buckets_expire()
+    test_stats_endpoint()
+    print("4 tests passed")
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Tests for cross-worker shared counters and TTL keys
+"""
+
+import os
+import sys
+import time
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from shared_state import SharedState, default_path, parse_rate
+
+
+def _increment(path, times):
+    state = SharedState(path)
+    for _ in range(times):
+        state.incr('shared')
+
+
+def test_counters_and_windows():
+    with tempfile.TemporaryDirectory() as tmp:
+        state = SharedState(os.path.join(tmp, 'state.sqlite3'))
+        assert state.incr('a') == 1
+        assert state.incr('a', 4) == 5
+        assert state.get('a') == 5
+        assert state.get('missing') is None
+
+        assert state.incr('window', ttl=0.2) == 1
+        assert state.incr('window', ttl=0.2) == 2
+        assert 0 < state.ttl('window') <= 0.2
+        time.sleep(0.25)
+        assert state.get('window') is None
+        assert state.incr('window', ttl=0.2) == 1
+
+
+def test_add_claims_once_until_expiry():
+    with tempfile.TemporaryDirectory() as tmp:
+        state = SharedState(os.path.join(tmp, 'state.sqlite3'))
+        assert state.add('key', ttl=0.2)
+        assert not state.add('key', ttl=0.2)
+        time.sleep(0.25)
+        assert state.add('key', ttl=0.2)
+        state.delete('key')
+        assert state.add('key')
+        assert not state.add('key')
+
+
+def test_counters_are_shared_between_processes():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'state.sqlite3')
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=_increment, args=(path, 200)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(60)
+        assert SharedState(path).get('shared') == 800
+
+
+def test_default_path_is_per_deployment():
+    path = default_path()
+    assert path.startswith('/dev/shm/flask-mail-') or path.startswith(os.path.dirname(os.path.abspath(__file__)))
+    assert path != '/dev/shm/flask-mail-shared-state.sqlite3'
+    assert default_path() == path
+    assert os.path.basename(default_path('mail-staging')) == 'mail-staging.sqlite3'
+
+    # The suite runs against its own file, never the deployment default
+    import app as mail_app
+    if os.environ.get('SHARED_STATE_PATH'):
+        assert mail_app.shared_state.path == os.environ['SHARED_STATE_PATH'] != path
+
+
+def test_parse_rate():
+    assert parse_rate('5/3600') == (5, 3600.0)
+    assert parse_rate('') is None
+
+
+def test_idempotency_and_recipient_rate_limit():
+    import app as mail_app
+    mail_app.mail.state.suppress = True
+    mail_app.mail.state.default_sender = 'noreply@novakinetix.academy'
+    payload = {'email': 'ada@example.com', 'name': 'Ada'}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        previous = mail_app.shared_state, mail_app.RECIPIENT_RATE_LIMIT
+        mail_app.shared_state = SharedState(os.path.join(tmp, 'state.sqlite3'))
+        try:
+            client = mail_app.app.test_client()
+            with mail_app.mail.record_messages() as outbox:
+                first = client.post('/api/send-welcome-email', json=payload, headers={'Idempotency-Key': 'k1'})
+                again = client.post('/api/send-welcome-email', json=payload, headers={'Idempotency-Key': 'k1'})
+                assert first.status_code == again.status_code == 200
+                assert again.get_json()['duplicate'] is True
+                assert len(outbox) == 1
+
+            mail_app.RECIPIENT_RATE_LIMIT = (2, 60)
+            statuses = [client.post('/api/send-welcome-email', json=payload).status_code for _ in range(3)]
+            assert statuses == [200, 200, 429]
+            limited = client.post('/api/send-welcome-email', json=payload)
+            assert 0 < int(limited.headers['Retry-After']) <= 60
+        finally:
+            mail_app.shared_state, mail_app.RECIPIENT_RATE_LIMIT = previous
+
+
+if __name__ == '__main__':
+    test_counters_and_windows()
+    test_add_claims_once_until_expiry()
+    test_counters_are_shared_between_processes()
+    test_default_path_is_per_deployment()
+    test_parse_rate()
+    test_idempotency_and_recipient_rate_limit()
+    print("Shared state tests passed")
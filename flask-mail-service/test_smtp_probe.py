@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Tests for the cached SMTP probe and the /ready endpoint, against a local SMTP sink
+"""
+
+import os
+import sys
+import time
+import socket
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from smtp_probe import SmtpProbe, probe_smtp
+from smtp_sink import SMTPSink
+
+
+def _closed_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_probe_success_and_auth_failure():
+    with SMTPSink() as sink:
+        result = probe_smtp('127.0.0.1', sink.port, username='user', password='pass', timeout=2)
+        assert result['ok'] is True
+        assert result['latency_ms'] >= 0
+
+    with SMTPSink(reject_auth=True) as sink:
+        result = probe_smtp('127.0.0.1', sink.port, username='user', password='wrong', timeout=2)
+        assert result['ok'] is False
+        assert 'SMTPAuthenticationError' in result['error']
+
+
+def test_probe_unreachable():
+    result = probe_smtp('127.0.0.1', _closed_port(), timeout=1)
+    assert result['ok'] is False
+    assert 'error' in result
+
+
+def test_cached_status():
+    """status() serves the cached result instead of reconnecting"""
+    with SMTPSink() as sink:
+        probe = SmtpProbe('127.0.0.1', sink.port, interval=60, timeout=2)
+        probe.start()
+        assert probe.wait(5)
+        first = probe.status()
+        second = probe.status()
+        probe.stop()
+    assert first['ok'] and second['ok']
+    assert first['checked_at'] == second['checked_at']
+
+
+def test_first_status_does_not_block():
+    """Until the first probe finishes the relay is reported not ready, without waiting"""
+    with socket.socket() as listener:
+        # Accepts connections but never sends a greeting, so the probe hangs until its timeout
+        listener.bind(('127.0.0.1', 0))
+        listener.listen()
+        probe = SmtpProbe('127.0.0.1', listener.getsockname()[1], interval=60, timeout=2)
+        started = time.monotonic()
+        status = probe.status()
+        assert time.monotonic() - started < 0.5
+        assert status['ok'] is False and status['pending'] is True
+        probe.stop()
+
+
+def test_ready_endpoint():
+    import app as mail_app
+
+    client = mail_app.app.test_client()
+    original = mail_app.smtp_probe
+    try:
+        with SMTPSink() as sink:
+            mail_app.smtp_probe = SmtpProbe('127.0.0.1', sink.port, interval=60, timeout=2)
+            mail_app.smtp_probe.start()
+            mail_app.smtp_probe.wait(5)
+            response = client.get('/ready')
+            mail_app.smtp_probe.stop()
+        assert response.status_code == 200
+        assert response.get_json()['status'] == 'ready'
+
+        mail_app.smtp_probe = SmtpProbe('127.0.0.1', _closed_port(), interval=60, timeout=1)
+        mail_app.smtp_probe.start()
+        mail_app.smtp_probe.wait(5)
+        response = client.get('/ready')
+        mail_app.smtp_probe.stop()
+        assert response.status_code == 503
+        assert response.get_json()['status'] == 'not_ready'
+        assert 'latency_ms' in response.get_json()['smtp']
+    finally:
+        mail_app.smtp_probe = original
+
+
+def test_ready_uses_relay_pool():
+    """With MAIL_RELAYS set, readiness follows the pool's health rather than MAIL_SERVER"""
+    import app as mail_app
+    from relays import RelayPool
+
+    client = mail_app.app.test_client()
+    original = mail_app.relay_pool, mail_app.smtp_probe
+    mail_app.smtp_probe = SmtpProbe('127.0.0.1', _closed_port(), interval=60, timeout=1)
+    try:
+        with SMTPSink() as sink:
+            mail_app.relay_pool = RelayPool([('127.0.0.1', sink.port, 1), ('127.0.0.1', _closed_port(), 1)])
+            response = client.get('/ready')
+            assert response.status_code == 200
+            assert response.get_json()['smtp']['healthy'] == 2
+
+            for relay in mail_app.relay_pool.relays:
+                relay.healthy = False
+            response = client.get('/ready')
+            assert response.status_code == 503
+            assert response.get_json()['smtp']['error'] == 'All SMTP relays are out of rotation'
+        assert mail_app.smtp_probe._thread is None
+    finally:
+        mail_app.relay_pool, mail_app.smtp_probe = original
+
+
+if __name__ == '__main__':
+    test_probe_success_and_auth_failure()
+    test_probe_unreachable()
+    test_cached_status()
+    test_first_status_does_not_block()
+    test_ready_endpoint()
+    test_ready_uses_relay_pool()
+    print("SMTP probe tests passed")
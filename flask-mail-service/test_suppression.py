@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Tests for the Bloom-filter-fronted suppression list and its API
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from suppression import BloomFilter, SuppressionList
+from metrics import Metrics
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=10000, error_rate=0.01)
+    for i in range(10000):
+        bloom.add(f'user{i}@example.com')
+    assert all(f'user{i}@example.com' in bloom for i in range(10000))
+
+    false_positives = sum(f'other{i}@example.com' in bloom for i in range(10000))
+    assert false_positives < 200
+    # ~9.6 bits per entry at 1%
+    assert bloom.nbytes < 10000 * 10 / 8 + 16
+
+
+def test_suppression_list_add_check_remove():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'suppressions.sqlite3')
+        registry = Metrics()
+        suppressions = SuppressionList(path, capacity=1000, metrics=registry)
+
+        assert suppressions.add_many(['Bounce@Example.com ', 'unsub@example.com', 'bounce@example.com'],
+                                     reason='hard_bounce') == 2
+        assert suppressions.is_suppressed('bounce@example.com')
+        assert suppressions.is_suppressed('UNSUB@example.com')
+        assert not suppressions.is_suppressed('fine@example.com')
+        assert registry.snapshot()['gauges']['suppression_entries'] == 2
+
+        assert suppressions.remove('unsub@example.com')
+        assert not suppressions.is_suppressed('unsub@example.com')
+        assert not suppressions.remove('unsub@example.com')
+        assert suppressions.count() == 1
+        assert registry.snapshot()['gauges']['suppression_entries'] == 1
+
+        # Persisted across instances, and writes from another worker show up after a refresh
+        other = SuppressionList(path, capacity=1000, refresh_interval=0)
+        assert other.is_suppressed('bounce@example.com')
+        suppressions.add('late@example.com')
+        assert other.is_suppressed('late@example.com')
+        assert other.count() == suppressions.count() == 2
+
+
+def test_filter_grows_past_capacity_and_snapshots():
+    with tempfile.TemporaryDirectory() as tmp:
+        suppressions = SuppressionList(os.path.join(tmp, 's.sqlite3'), capacity=10)
+        suppressions.add_many([f'user{i}@example.com' for i in range(50)])
+        assert suppressions._bloom.capacity >= 50
+        assert all(suppressions.is_suppressed(f'user{i}@example.com') for i in range(50))
+
+        # A new worker restores the saved filter and only rehashes rows added after it
+        suppressions.add('tail@example.com')
+        restored = SuppressionList(os.path.join(tmp, 's.sqlite3'), capacity=10).load()
+        assert restored._snapshot_id == 50
+        assert restored._bloom.count == 51
+        suppressions.remove('user3@example.com')
+        assert SuppressionList(os.path.join(tmp, 's.sqlite3'), capacity=10).count() == 50
+        assert restored.is_suppressed('tail@example.com') and restored.is_suppressed('user7@example.com')
+
+
+def test_suppressed_recipients_skip_render_and_send():
+    import app as mail_app
+    mail_app.mail.state.suppress = True
+    mail_app.mail.state.default_sender = 'noreply@novakinetix.academy'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        previous = mail_app.suppression_list
+        mail_app.suppression_list = SuppressionList(os.path.join(tmp, 's.sqlite3'))
+        os.environ['ADMIN_API_TOKEN'] = 'secret'
+        try:
+            client = mail_app.app.test_client()
+            headers = {'X-Admin-Token': 'secret'}
+            response = client.post('/api/suppressions', headers=headers,
+                                   json={'emails': ['gone@example.com', 'left@example.com'], 'reason': 'unsubscribe'})
+            assert response.get_json()['added'] == 2
+            assert client.post('/api/suppressions', headers=headers, json={'emails': ['nope']}).status_code == 400
+            assert client.post('/api/suppressions', json={'emails': ['x@example.com']}).status_code == 401
+
+            with mail_app.mail.record_messages() as outbox:
+                response = client.post('/api/send-welcome-email', json={'email': 'gone@example.com', 'name': 'Gone'})
+                assert response.status_code == 200
+                assert response.get_json()['suppressed'] is True
+                assert 'render' not in response.headers['Server-Timing']
+
+                response = client.post('/api/send-batch', json={
+                    'template': 'welcome',
+                    'subject': 'Welcome',
+                    'messages': [{'to': 'left@example.com'}, {'to': 'kept@example.com'}]
+                })
+                assert response.get_json()['suppressed'] == ['left@example.com']
+                assert response.get_json()['sent'] == 1
+                assert outbox == []
+
+            assert client.get('/api/suppressions/gone@example.com', headers=headers).get_json()['suppressed']
+            assert client.delete('/api/suppressions/gone@example.com', headers=headers).status_code == 200
+            assert client.delete('/api/suppressions/gone@example.com', headers=headers).status_code == 404
+        finally:
+            mail_app.suppression_list = previous
+            del os.environ['ADMIN_API_TOKEN']
+
+
+if __name__ == '__main__':
+    test_bloom_filter_has_no_false_negatives()
+    test_suppression_list_add_check_remove()
+    test_filter_grows_past_capacity_and_snapshots()
+    test_suppressed_recipients_skip_render_and_send()
+    print("Suppression tests passed")
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Tests that the modules copied into the Stem-Spark snapshot's mail service stay identical
+That service is built from its own directory (its own Dockerfile), so it carries copies
+instead of importing these; a fix made on one side only fails here
+"""
+
+import os
+import filecmp
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+VARIANT_DIR = os.path.join(SERVICE_DIR, '..', 'Stem-Spark-22a60c0b96766337b6a06d6f35ec3f593ee2a9c4',
+                           'flask-mail-service')
+
+SHARED_MODULES = ['metrics.py', 'lanes.py', 'concurrency.py', 'request_timing.py', 'smtp_probe.py',
+                  'logging_setup.py']
+
+
+def test_copies_match():
+    assert os.path.isdir(VARIANT_DIR)
+    diverged = [name for name in SHARED_MODULES
+                if not filecmp.cmp(os.path.join(SERVICE_DIR, name), os.path.join(VARIANT_DIR, name), shallow=False)]
+    assert not diverged, f'copy these to {VARIANT_DIR} (or back): {diverged}'
+
+
+if __name__ == '__main__':
+    test_copies_match()
+    print("Variant copies match")
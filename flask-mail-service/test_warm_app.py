@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Tests for warm-up preloading and the compiled template cache
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from flask import render_template_string
+import app as mail_app
+
+TEMPLATE_DATA = {
+    'user_name': 'Ada',
+    'user_email': 'ada@example.com',
+    'login_url': 'https://novakinetix.academy/login',
+    'site_url': 'https://novakinetix.academy'
+}
+
+
+def test_warm_app_preloads_templates_and_logo():
+    mail_app._compiled_templates.clear()
+    mail_app._logo_cache.clear()
+    mail_app.email_service._logo_base64 = None
+
+    assert mail_app.warm_app(preload=False) is mail_app.app
+    assert not mail_app._compiled_templates and not mail_app._logo_cache
+
+    mail_app.warm_app(preload=True)
+    assert set(mail_app._compiled_templates) == {(name, locale) for name in mail_app.TEMPLATE_MAP
+                                                  for locale in mail_app.template_localizer.locales}
+    assert 'data' in mail_app._logo_cache
+    assert mail_app.email_service._logo_base64 is not None
+
+
+def test_compiled_template_matches_render_template_string():
+    with mail_app.app.test_request_context():
+        compiled = mail_app.render_compiled(mail_app.get_compiled_template('welcome'), TEMPLATE_DATA)
+        expected = render_template_string(mail_app.TEMPLATE_MAP['welcome'], **TEMPLATE_DATA)
+    assert compiled == expected
+    assert mail_app.get_compiled_template('welcome') is mail_app.get_compiled_template('welcome')
+    assert mail_app.get_compiled_template('missing') is None
+
+
+if __name__ == '__main__':
+    test_warm_app_preloads_templates_and_logo()
+    test_compiled_template_matches_render_template_string()
+    print("Warm-up tests passed")